@@ -8,6 +8,8 @@
     python app.py
     
 然后浏览器访问: http://127.0.0.1:2333
+
+环境变量 HPM_AUTO_INSTALL=0 时不自动 pip 安装缺失的依赖 (生产/容器环境)
 """
 
 import os
@@ -19,9 +21,201 @@ import subprocess
 import re
 import time
 import importlib
-from datetime import datetime
+import itertools
+import random
+import heapq
+import queue
+import contextvars
+import sqlite3
+import asyncio
+import ipaddress
+import errno
+import select
+import struct
+import bisect
+import hmac
+import secrets
+import urllib.request
+import urllib.error
+import contextlib
+import functools
+import io
+import csv
+import zlib
+from datetime import datetime, timedelta
+from collections import deque
 from concurrent.futures import ThreadPoolExecutor
 
+STARTUP_STARTED = time.perf_counter()
+# 启动各阶段耗时 [(阶段, 毫秒)]
+STARTUP_PHASES = []
+
+@contextlib.contextmanager
+def startup_phase(name):
+    """记录并打印一个启动阶段的耗时"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = (time.perf_counter() - start) * 1000
+        STARTUP_PHASES.append((name, round(elapsed, 1)))
+        print(f"[启动] {name}: {elapsed:.1f}ms")
+
+# 多进程引擎工作进程的结果记录: (端口, errno, RTT微秒), 端口为 0 表示任务结束
+PORT_WORKER_RECORD = struct.Struct("!HHI")
+
+def port_worker_main():
+    """多进程扫描引擎的工作进程 (python app.py --port-worker), 只用标准库, 不加载 Flask 和扫描器
+
+    stdin 每行一条命令: JSON 任务 {"ip", "ports": base64 的 uint16 端口数组, "timeout", "window", "pps"},
+    任务进行中可以收到 "window N" / "pause" / "resume" / "stop"; 结果以 PORT_WORKER_RECORD 批量写到 stdout
+    """
+    import array
+    import base64
+    import selectors
+
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if hard != resource.RLIM_INFINITY and soft < hard:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except Exception:
+        pass
+
+    commands = queue.Queue()
+
+    def read_commands():
+        for line in sys.stdin.buffer:
+            commands.put(line.strip())
+        commands.put(None)  # 父进程已退出
+
+    threading.Thread(target=read_commands, daemon=True).start()
+    out = sys.stdout.buffer
+    selector = selectors.DefaultSelector()
+    pending_errnos = (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EAGAIN)
+
+    while True:
+        line = commands.get()
+        if line is None:
+            return
+        if not line.startswith(b"{"):
+            continue  # 任务结束后才到达的控制命令
+        task = json.loads(line)
+        ip, timeout, window = task["ip"], task["timeout"], task["window"]
+        interval = 1.0 / task["pps"] if task.get("pps") else 0
+        ports = array.array("H")
+        ports.frombytes(base64.b64decode(task["ports"]))
+        port_iter = iter(ports)
+        inflight = {}       # fd -> (socket, 端口, 发起时间)
+        deadlines = deque()  # (超时时间, socket), 同一任务超时相同, 按发起顺序递增
+        results = bytearray()
+        paused = stopped = exhausted = False
+        next_send = 0.0
+
+        while True:
+            while True:
+                try:
+                    command = commands.get_nowait()
+                except queue.Empty:
+                    break
+                if command is None:
+                    return
+                if command == b"stop":
+                    stopped = True
+                elif command == b"pause":
+                    paused = True
+                elif command == b"resume":
+                    paused = False
+                elif command.startswith(b"window "):
+                    window = max(1, int(command[7:]))
+            if stopped:
+                break
+
+            now = time.monotonic()
+            while not paused and not exhausted and len(inflight) < window:
+                if interval and now < next_send:
+                    break
+                port = next(port_iter, None)
+                if port is None:
+                    exhausted = True
+                    break
+                next_send = max(next_send, now) + interval
+                try:
+                    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                except OSError as e:
+                    results += PORT_WORKER_RECORD.pack(port, e.errno or errno.EIO, 0)
+                    continue
+                sock.setblocking(False)
+                now = time.monotonic()
+                try:
+                    err = sock.connect_ex((ip, port))
+                except OSError as e:
+                    err = e.errno or errno.EIO
+                if err in pending_errnos:
+                    inflight[sock.fileno()] = (sock, port, now)
+                    selector.register(sock, selectors.EVENT_WRITE)
+                    deadlines.append((now + timeout, sock))
+                else:
+                    rtt = int((time.monotonic() - now) * 1e6) if err in (0, errno.ECONNREFUSED) else 0
+                    results += PORT_WORKER_RECORD.pack(port, err, rtt)
+                    sock.close()
+            if exhausted and not inflight:
+                break
+
+            wait = 0.05
+            if deadlines:
+                wait = min(wait, deadlines[0][0] - now)
+            if interval and not paused and not exhausted and len(inflight) < window:
+                wait = min(wait, next_send - now)
+            if inflight:
+                events = selector.select(max(0, wait))
+            else:
+                time.sleep(max(0, wait))
+                events = []
+
+            now = time.monotonic()
+            for key, _ in events:
+                sock, port, start = inflight.pop(key.fd)
+                selector.unregister(sock)
+                err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                rtt = int((now - start) * 1e6) if err in (0, errno.ECONNREFUSED) else 0
+                results += PORT_WORKER_RECORD.pack(port, err, rtt)
+                sock.close()
+            while deadlines and deadlines[0][0] <= now:
+                _, sock = deadlines.popleft()
+                if sock.fileno() < 0:
+                    continue  # 已完成并关闭
+                _, port, _ = inflight.pop(sock.fileno())
+                selector.unregister(sock)
+                sock.close()
+                results += PORT_WORKER_RECORD.pack(port, errno.ETIMEDOUT, 0)
+            if results:
+                out.write(results)
+                out.flush()
+                results.clear()
+
+        for sock, _, _ in inflight.values():
+            selector.unregister(sock)
+            sock.close()
+        out.write(results + PORT_WORKER_RECORD.pack(0, 0, 0))
+        out.flush()
+
+if __name__ == "__main__" and sys.argv[1:2] == ["--port-worker"]:
+    port_worker_main()
+    sys.exit(0)
+
+# 代理模式 (--agent): 只接受协调者下发的扫描分片, 不运行定时扫描
+AGENT_MODE = "--agent" in sys.argv[1:] or os.environ.get("HPM_AGENT") == "1"
+
+# 缺少依赖时是否自动 pip 安装; 生产环境应预先安装依赖并设置 HPM_AUTO_INSTALL=0
+AUTO_INSTALL = os.environ.get("HPM_AUTO_INSTALL", "1").lower() not in ("0", "false", "no")
+
+def exit_with_error():
+    """交互终端中等待回车后退出, 容器/服务中直接退出"""
+    if sys.stdin and sys.stdin.isatty():
+        input("按回车键退出...")
+    sys.exit(1)
+
 def install_package(package_name, import_name=None):
     """自动安装缺失的包"""
     if import_name is None:
@@ -56,61 +250,1414 @@ def check_and_install_dependencies():
     
     if not all_installed:
         print("[错误] 部分必要依赖安装失败，请手动运行: pip install flask netifaces-plus")
-        input("按回车键退出...")
-        sys.exit(1)
+        exit_with_error()
     
     print("[OK] 依赖检查完成")
 
-check_and_install_dependencies()
-
-try:
-    from flask import Flask, jsonify, request, Response
-    import netifaces
-except ImportError as e:
-    print(f"[错误] 导入失败: {e}")
-    input("按回车键退出...")
-    sys.exit(1)
+# 依赖已安装时直接导入, 只有导入失败才检查/安装, 正常启动不会调用 pip
+with startup_phase("加载依赖"):
+    try:
+        from flask import Flask, jsonify, request, Response
+        import netifaces
+    except ImportError as e:
+        if not AUTO_INSTALL:
+            print(f"[错误] 导入失败: {e}, 请运行: pip install flask netifaces-plus")
+            exit_with_error()
+        check_and_install_dependencies()
+        try:
+            from flask import Flask, jsonify, request, Response
+            import netifaces
+        except ImportError as e:
+            print(f"[错误] 导入失败: {e}")
+            exit_with_error()
 
 app = Flask(__name__)
 app.config['JSON_AS_ASCII'] = False
 
 SCAN_CACHE = {}
-SCAN_STATUS = {"scanning": False, "paused": False, "progress": 0, "speed_mode": "fast", "current_device": ""}
 DEVICE_NOTES = {}
-SCAN_STREAM = {"current_ip": "", "found_ports": [], "completed_devices": []}
+LAST_SCAN_DIFF = None
+
+# 扫描任务: 数字越小优先级越高; 单台设备端口扫描可以抢占后台全网扫描
+JOB_PRIORITIES = {"high": 0, "normal": 5, "low": 10}
+JOB_CONFIG = {"workers": 2, "max_queue": 16, "history": 50}
 
+# 定时 (后台) 扫描: 并发按 concurrency_factor 缩小, 发包速率不超过 pps / ping_pps;
+# 有交互式扫描运行时后台扫描暂停让路; 未指定时每次触发时间随机推迟 jitter (间隔的比例, cron 为秒数)
+BACKGROUND_SCAN = {"concurrency_factor": 0.25, "pps": 500, "ping_pps": 200, "jitter": 0.1, "cron_jitter": 120}
+
+# port_workers/async_workers 是所有主机共享的总并发预算, per_host_limit 限制单台设备的并发连接数,
+# host_workers 是 discovery() 中同时扫描的主机数
+# pps / ping_pps 为每秒发包数硬上限 (0 = 不限), 实际并发和ICMP发包速率由 RateController 在上限内自适应
 SCAN_SPEED = {
-    "fast":     {"ping_workers": 254, "port_workers": 500, "timeout": 0.1, "name": "极速"},
-    "standard": {"ping_workers": 50, "port_workers": 50, "timeout": 0.5, "name": "常规"}
+    "fast":     {"ping_workers": 254, "port_workers": 500, "async_workers": 4000, "per_host_limit": 2000,
+                 "host_workers": 8, "timeout": 0.1, "pps": 0, "ping_pps": 5000, "name": "极速"},
+    "standard": {"ping_workers": 50, "port_workers": 50, "async_workers": 500, "per_host_limit": 200,
+                 "host_workers": 4, "timeout": 0.5, "pps": 2000, "ping_pps": 500, "name": "常规"}
+}
+
+# 按主机RTT自适应连接超时: 取最近RTT样本的高分位 × multiplier, 限制在 [min, max] 秒之间;
+# 样本不足 min_samples 时使用速度模式的固定超时; 超时的端口以 retry_multiplier 倍超时重试一次
+ADAPTIVE_TIMEOUT = {"enabled": True, "percentile": 95, "multiplier": 4.0, "min": 0.03, "max": 2.0,
+                    "min_samples": 3, "retry_multiplier": 3.0, "retry_limit": 256, "retry_ratio": 0.05}
+
+# 端口扫描引擎: thread = 线程池阻塞connect, async = 单线程事件循环非阻塞connect,
+# process = 端口分给多个工作进程, 每个进程各自做非阻塞connect (全端口扫描可用满多核)
+SCAN_ENGINES = {
+    "async":   {"name": "异步"},
+    "thread":  {"name": "线程池"},
+    "process": {"name": "多进程"},
 }
 
-COMMON_PORTS = [
-    20,21,22,23,25,53,67,68,69,80,81,82,83,88,110,111,113,119,123,135,137,138,139,
-    143,161,179,194,389,443,445,464,465,500,514,515,520,521,546,547,554,587,631,636,
-    989,990,993,995,1080,1194,1433,1434,1521,1701,1723,1883,1900,2049,2082,2083,2086,
-    2087,2095,2096,2222,2375,2376,3000,3128,3306,3389,5432,5500,5555,5601,5672,5900,
-    5901,5984,6379,6443,6631,6667,7001,7474,8000,8008,8080,8086,8088,8443,8883,8888,
-    9000,9042,9092,9200,9443,9999,11211,12306,27017,27018,28015,50000
-]
+# 多进程引擎: workers 个常驻工作进程, 多台主机同时扫描时平分; 每个进程至少分到 min_ports 个端口
+PROCESS_ENGINE = {"workers": os.cpu_count() or 2, "min_ports": 1024}
+
+# 设备发现方式: icmp = 只做echo扫描, tcp = 只做TCP探测, both = 两者并行
+DISCOVERY_MODES = {
+    "both": {"name": "ICMP+TCP"},
+    "icmp": {"name": "ICMP"},
+    "tcp":  {"name": "TCP探测"},
+}
+
+# TCP探测: 对每个地址连接少量端口, 收到 SYN-ACK 或 RST 即视为在线 (62078 = iPhone lockdownd)
+DISCOVERY_PROBE = {"ports": [22, 80, 443, 445, 62078], "timeout": 0.5, "deadline": 3.0, "workers": 256}
+
+# 设备发现引擎: icmp = 进程内单socket发送全部echo请求, subprocess = 每个地址调用一次系统ping
+PING_ENGINES = {
+    "icmp":       {"name": "ICMP"},
+    "subprocess": {"name": "系统ping"},
+}
+
+class ScanEventLog:
+    """扫描事件环形缓冲区
+    
+    每个事件带全局递增序号, 客户端凭上次收到的序号 (SSE 的 Last-Event-ID 或 since=) 只取增量;
+    序号早于缓冲区起点时说明中间事件已丢失, 客户端需要重新拉取完整快照
+    """
+    
+    def __init__(self, maxlen=5000):
+        self._events = deque(maxlen=maxlen)
+        self._seq = 0
+        self._cond = threading.Condition()
+    
+    @property
+    def last_seq(self):
+        return self._seq
+    
+    def publish(self, event_type, **data):
+        with self._cond:
+            self._seq += 1
+            self._events.append({"seq": self._seq, "type": event_type, "data": data})
+            self._cond.notify_all()
+            return self._seq
+    
+    def since(self, seq):
+        """返回 (events, complete), complete 为 False 表示 seq 之后有事件已被挤出缓冲区"""
+        with self._cond:
+            if seq >= self._seq or not self._events:
+                return [], seq <= self._seq
+            first = self._events[0]["seq"]
+            start = max(0, seq + 1 - first)
+            return list(itertools.islice(self._events, start, None)), seq >= first - 1
+    
+    def wait(self, seq, timeout):
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq > seq, timeout)
+        return self.since(seq)
+
+SCAN_EVENTS = ScanEventLog()
+
+class ScanCancelled(Exception):
+    """任务被取消, 由扫描循环中的 checkpoint 抛出"""
+
+class ScanJob:
+    """一个扫描任务, 状态、实时数据 (stream) 和结果都属于任务本身
+    
+    state: queued / running / done / failed / cancelled; status 字段与旧版 /api/status 相同
+    
+    暂停/继续/取消基于事件: 扫描循环在投递下一个探测前调用 checkpoint() (协程中为 acheckpoint()),
+    暂停或被抢占时阻塞在事件上, 不占用线程轮询也不保留socket, 继续后从原位置接着扫描;
+    取消时 checkpoint 抛出 ScanCancelled, 并通知 on_cancel 注册的回调立即中止在途的连接
+    """
+    
+    _ids = itertools.count(1)
+    
+    def __init__(self, kind, fn=None, args=(), priority=JOB_PRIORITIES["normal"], key=None, params=None,
+                 background=False):
+        self.id = next(self._ids)
+        self.kind = kind
+        self.fn = fn
+        self.args = args
+        self.priority = priority
+        self.background = background
+        self.key = key
+        self.params = params or {}
+        self.state = "queued"
+        self.status = {"scanning": fn is not None, "paused": False, "progress": 0, "current_device": "",
+                       "phase": "", "shard": None, "active_hosts": []}
+        self.stream = {"current_ip": "", "found_ports": [], "completed_devices": [], "active_hosts": {}}
+        self.lock = threading.Lock()
+        self.preempted_by = set()
+        self._runnable = threading.Event()
+        self._runnable.set()
+        self._cancelled = threading.Event()
+        self._async_waiters = []
+        self._cancel_callbacks = []
+        self.result = None
+        self.error = None
+        self.trace = None
+        self.created_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.started_at = None
+        self.finished_at = None
+    
+    def update(self, **fields):
+        """修改任务状态, 有变化的字段作为 status 事件推送"""
+        with self.lock:
+            changed = {key: value for key, value in fields.items() if self.status.get(key) != value}
+            self.status.update(fields)
+        if changed:
+            SCAN_EVENTS.publish("status", job=self.id, **changed)
+    
+    def waiting(self):
+        """暂停、被抢占或已取消时, 扫描循环停止投递新的探测"""
+        return not self._runnable.is_set() or self._cancelled.is_set()
+    
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+    
+    def _refresh(self):
+        """按暂停/抢占/取消状态设置事件, 唤醒等待中的线程和协程"""
+        with self.lock:
+            runnable = self._cancelled.is_set() or not (self.status["paused"] or self.preempted_by)
+            if runnable == self._runnable.is_set():
+                return
+            if not runnable:
+                self._runnable.clear()
+                return
+            self._runnable.set()
+            waiters, self._async_waiters = self._async_waiters, []
+        for loop, waiter in waiters:
+            loop.call_soon_threadsafe(lambda w=waiter: w.done() or w.set_result(None))
+    
+    def pause(self):
+        self.update(paused=True)
+        self._refresh()
+    
+    def resume(self):
+        self.update(paused=False)
+        self._refresh()
+    
+    def add_preemptor(self, job_id):
+        with self.lock:
+            was_preempted = bool(self.preempted_by)
+            self.preempted_by.add(job_id)
+        if not was_preempted:
+            SCAN_EVENTS.publish("status", job=self.id, paused=True, preempted=True)
+        self._refresh()
+    
+    def remove_preemptor(self, job_id):
+        with self.lock:
+            if job_id not in self.preempted_by:
+                return
+            self.preempted_by.discard(job_id)
+            resumed = not self.preempted_by
+        if resumed:
+            SCAN_EVENTS.publish("status", job=self.id, paused=self.status["paused"], preempted=False)
+        self._refresh()
+    
+    def cancel(self):
+        with self.lock:
+            if self._cancelled.is_set():
+                return
+            self._cancelled.set()
+            callbacks, self._cancel_callbacks = self._cancel_callbacks, []
+        self._refresh()
+        for callback in callbacks:
+            callback()
+    
+    def on_cancel(self, callback):
+        """注册取消回调 (在调用 cancel 的线程中执行), 返回注销函数; 已取消时立即执行"""
+        with self.lock:
+            if not self._cancelled.is_set():
+                self._cancel_callbacks.append(callback)
+                
+                def unregister():
+                    with self.lock:
+                        if callback in self._cancel_callbacks:
+                            self._cancel_callbacks.remove(callback)
+                return unregister
+        callback()
+        return lambda: None
+    
+    def checkpoint(self):
+        """暂停时阻塞到继续, 已取消时抛出 ScanCancelled"""
+        self._runnable.wait()
+        if self._cancelled.is_set():
+            raise ScanCancelled()
+    
+    async def acheckpoint(self):
+        """checkpoint 的协程版本, 暂停期间只挂起当前协程"""
+        while not self._runnable.is_set():
+            loop = asyncio.get_running_loop()
+            waiter = loop.create_future()
+            with self.lock:
+                if self._runnable.is_set():
+                    break
+                self._async_waiters.append((loop, waiter))
+            await waiter
+        if self._cancelled.is_set():
+            raise ScanCancelled()
+    
+    def status_snapshot(self):
+        with self.lock:
+            status = dict(self.status, paused=self.status["paused"] or bool(self.preempted_by))
+        status.update({"job": self.id, "state": self.state})
+        return status
+    
+    def stream_snapshot(self):
+        with self.lock:
+            return {
+                "found_ports": list(self.stream["found_ports"]),
+                "active_hosts": [dict(h) for h in self.stream["active_hosts"].values()],
+                "completed_devices": len(self.stream["completed_devices"]),
+            }
+    
+    def snapshot(self, include_result=False):
+        info = {
+            "id": self.id,
+            "kind": self.kind,
+            "priority": self.priority,
+            "background": self.background,
+            "params": self.params,
+            "state": self.state,
+            "preempted": bool(self.preempted_by),
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "status": self.status_snapshot(),
+        }
+        if include_result:
+            info["result"] = self.result
+        return info
+
+# 当前线程正在执行的任务; 不在任务中调用扫描方法 (如脚本直接调用) 时使用 IDLE_JOB
+IDLE_JOB = ScanJob("idle")
+CURRENT_JOB = contextvars.ContextVar("current_job", default=IDLE_JOB)
+
+def current_job():
+    return CURRENT_JOB.get()
+
+def bind_job(fn):
+    """包装 fn, 使其在线程池中运行时仍属于当前任务"""
+    job = current_job()
+    
+    def run(*args, **kwargs):
+        token = CURRENT_JOB.set(job)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            CURRENT_JOB.reset(token)
+    return run
+
+def run_cancellable(coro_fn):
+    """用 asyncio.run 运行 coro_fn(); 当前任务被取消时立即取消协程 (在途的连接随之关闭) 并抛出 ScanCancelled"""
+    job = current_job()
+    
+    async def main():
+        loop = asyncio.get_running_loop()
+        task = asyncio.current_task()
+        
+        def on_cancel():
+            try:
+                loop.call_soon_threadsafe(task.cancel)
+            except RuntimeError:
+                pass  # 事件循环已结束
+        
+        unregister = job.on_cancel(on_cancel)
+        try:
+            return await coro_fn()
+        finally:
+            unregister()
+    
+    try:
+        return asyncio.run(main())
+    except asyncio.CancelledError:
+        if job.cancelled:
+            raise ScanCancelled()
+        raise
+
+# ======== 调用链追踪 ========
+# 开启后每个扫描任务记录各阶段/每台主机的耗时, 保留最近 runs 次任务, 每次最多 max_events 个事件 (超出时丢弃最早的);
+# 关闭时 trace_span 直接返回空操作对象, 不记录任何数据
+TRACE = {"enabled": os.environ.get("HPM_TRACE") == "1", "runs": 5, "max_events": 100000}
+TRACE_RUNS = deque(maxlen=TRACE["runs"])
+
+class TraceRun:
+    """一次扫描任务的追踪记录, 事件为 Chrome trace-event 格式 (ph=X), pid 为任务ID"""
+    
+    def __init__(self, job):
+        self.job_id = job.id
+        self.kind = job.kind
+        self.started_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.events = deque(maxlen=TRACE["max_events"])
+        self.threads = {}
+    
+    def add(self, name, cat, start_ns, end_ns, args):
+        tid = threading.get_ident()
+        if tid not in self.threads:
+            self.threads[tid] = threading.current_thread().name
+        self.events.append({"name": name, "cat": cat, "ph": "X", "ts": start_ns / 1000,
+                            "dur": (end_ns - start_ns) / 1000, "pid": self.job_id, "tid": tid, "args": args})
+    
+    def summary(self):
+        return {"job": self.job_id, "kind": self.kind, "started_at": self.started_at, "events": len(self.events)}
+    
+    def chrome_events(self):
+        meta = [{"name": "process_name", "ph": "M", "pid": self.job_id,
+                 "args": {"name": f"#{self.job_id} {self.kind} {self.started_at}"}}]
+        meta += [{"name": "thread_name", "ph": "M", "pid": self.job_id, "tid": tid, "args": {"name": name}}
+                 for tid, name in list(self.threads.items())]
+        return meta + list(self.events)
+
+class _Span:
+    __slots__ = ("run", "name", "cat", "args", "start")
+    
+    def __init__(self, run, name, cat, args):
+        self.run = run
+        self.name = name
+        self.cat = cat
+        self.args = args
+    
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        self.run.add(self.name, self.cat, self.start, time.perf_counter_ns(), self.args)
+        return False
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+NULL_SPAN = _NullSpan()
+
+def trace_span(name, cat="scan", **args):
+    """当前任务开启追踪时返回记录耗时的上下文管理器, 否则返回空操作对象"""
+    run = current_job().trace
+    if run is None:
+        return NULL_SPAN
+    return _Span(run, name, cat, args)
+
+def traced(name, describe=None):
+    """为函数/方法整体添加追踪区间; describe(*args, **kwargs) 返回该区间的参数"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            run = current_job().trace
+            if run is None:
+                return fn(*args, **kwargs)
+            with _Span(run, name, "scan", describe(*args, **kwargs) if describe else {}):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def begin_trace(job):
+    """开启追踪时为任务创建 TraceRun 并加入最近记录"""
+    if not TRACE["enabled"]:
+        return None
+    run = TraceRun(job)
+    TRACE_RUNS.append(run)
+    return run
+
+class JobManager:
+    """扫描任务队列和工作线程池
+    
+    任务按 (优先级, 提交顺序) 排队, 同一 key 同时只能有一个未完成的任务;
+    没有空闲线程时, 高优先级任务在额外线程中立即运行, 并暂停正在运行的最低优先级任务直到它完成;
+    后台任务 (background) 在任何交互式任务运行期间暂停
+    """
+    
+    def __init__(self, workers, max_queue, history):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.history = history
+        self._cond = threading.Condition()
+        self._queue = []
+        self._seq = itertools.count()
+        self._jobs = {}
+        self._running = set()
+        self._idle = 0
+        self._threads = []
+    
+    def submit(self, kind, fn, *args, priority=JOB_PRIORITIES["normal"], key=None, params=None, background=False):
+        """提交任务, 返回 (job, created); key 相同的任务未完成时返回该任务, created 为 False
+        
+        队列已满时抛出 queue.Full
+        """
+        with self._cond:
+            if key is not None:
+                for job in self._jobs.values():
+                    if job.key == key and job.state in ("queued", "running"):
+                        return job, False
+            if len(self._queue) >= self.max_queue:
+                raise queue.Full(f"扫描队列已满 ({self.max_queue})")
+            
+            job = ScanJob(kind, fn, args, priority=priority, key=key, params=params, background=background)
+            self._jobs[job.id] = job
+            self._prune()
+            if self._needs_extra_thread(job):
+                victim = self._preemption_victim(job)
+                if victim is not None:
+                    victim.add_preemptor(job.id)
+                    print(f"[任务] #{job.id} {kind} 抢占 #{victim.id} {victim.kind}")
+                self._running.add(job)
+                threading.Thread(target=self._run, args=(job,), daemon=True).start()
+            else:
+                heapq.heappush(self._queue, (priority, next(self._seq), job))
+                self._ensure_workers()
+                self._cond.notify()
+        SCAN_EVENTS.publish("job", job=job.id, kind=kind, state=job.state)
+        return job, True
+    
+    def _needs_extra_thread(self, job):
+        """没有空闲线程时, 高优先级任务, 或只有后台任务在运行时的交互式任务, 在额外线程中立即运行"""
+        if job.background or self._idle > len(self._queue) or len(self._threads) < self.workers:
+            return False
+        if job.priority <= JOB_PRIORITIES["high"]:
+            return any(j.priority > job.priority for j in self._running)
+        return bool(self._running) and all(j.background for j in self._running)
+    
+    def _preemption_victim(self, job):
+        candidates = [j for j in self._running
+                      if j.priority > job.priority and not j.background and not j.preempted_by]
+        return max(candidates, key=lambda j: (j.priority, j.id)) if candidates else None
+    
+    def _ensure_workers(self):
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._worker, daemon=True, name=f"scan-worker-{len(self._threads)}")
+            self._threads.append(thread)
+            thread.start()
+    
+    def _worker(self):
+        while True:
+            with self._cond:
+                self._idle += 1
+                while not self._queue:
+                    self._cond.wait()
+                self._idle -= 1
+                _, _, job = heapq.heappop(self._queue)
+            self._run(job)
+    
+    def _run(self, job):
+        with self._cond:
+            if job.cancelled:
+                self._running.discard(job)
+                return
+            self._running.add(job)
+            for other in self._running:
+                if other is job:
+                    continue
+                if job.background and not other.background:
+                    job.add_preemptor(other.id)
+                elif other.background and not job.background:
+                    other.add_preemptor(job.id)
+        job.state = "running"
+        job.started_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        SCAN_EVENTS.publish("job", job=job.id, kind=job.kind, state=job.state)
+        job.update(scanning=True)
+        token = CURRENT_JOB.set(job)
+        job.trace = begin_trace(job)
+        try:
+            with trace_span(f"{job.kind} #{job.id}", cat="job"):
+                job.result = job.fn(*job.args)
+            job.state = "done"
+        except ScanCancelled:
+            job.state = "cancelled"
+            print(f"[任务] #{job.id} {job.kind} 已取消")
+        except Exception as e:
+            job.error = str(e)
+            job.state = "failed"
+            print(f"[任务] #{job.id} {job.kind} 失败: {e}")
+        finally:
+            CURRENT_JOB.reset(token)
+            job.finished_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            with self._cond:
+                self._running.discard(job)
+                others = list(self._running)
+            for other in others:
+                other.remove_preemptor(job.id)
+            job.update(scanning=False, state=job.state)
+            SCAN_EVENTS.publish("job", job=job.id, kind=job.kind, state=job.state)
+    
+    def cancel(self, job):
+        """取消任务: 排队中的直接移出队列, 运行中的由扫描循环在下一个 checkpoint 退出"""
+        with self._cond:
+            queued = job.state == "queued"
+            if queued:
+                self._queue = [entry for entry in self._queue if entry[2] is not job]
+                heapq.heapify(self._queue)
+                job.state = "cancelled"
+                job.finished_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        job.cancel()
+        if queued:
+            job.update(scanning=False, state=job.state)
+            SCAN_EVENTS.publish("job", job=job.id, kind=job.kind, state=job.state)
+    
+    def _prune(self):
+        finished = [job for job in self._jobs.values() if job.state in ("done", "failed", "cancelled")]
+        for job in finished[:max(0, len(finished) - self.history)]:
+            del self._jobs[job.id]
+    
+    def get(self, job_id):
+        with self._cond:
+            return self._jobs.get(job_id)
+    
+    def jobs(self):
+        with self._cond:
+            return list(self._jobs.values())
+    
+    def active(self):
+        return [job for job in self.jobs() if job.state in ("queued", "running")]
+    
+    def primary(self):
+        """状态接口默认展示的任务: 优先级最高的运行中任务, 其次是最近提交的任务"""
+        jobs = self.jobs()
+        running = [job for job in jobs if job.state == "running" and not job.preempted_by]
+        if running:
+            return min(running, key=lambda job: (job.priority, job.id))
+        return jobs[-1] if jobs else IDLE_JOB
+
+JOBS = JobManager(**JOB_CONFIG)
+
+def update_status(**fields):
+    """修改当前任务的状态"""
+    current_job().update(**fields)
+
+def stream_host_start(ip, total):
+    job = current_job()
+    with job.lock:
+        job.stream["active_hosts"][ip] = {"ip": ip, "scanned": 0, "total": total, "progress": 0, "found": 0}
+        job.stream["current_ip"] = ip
+        _refresh_current_device(job)
+    SCAN_EVENTS.publish("host_start", job=job.id, ip=ip, total=total)
+
+def stream_host_progress(ip, scanned, total):
+    job = current_job()
+    with job.lock:
+        host = job.stream["active_hosts"].get(ip)
+        if not host:
+            return
+        progress = int(scanned * 100 / max(1, total))
+        changed = progress != host["progress"] or total != host["total"]
+        host["scanned"] = scanned
+        host["total"] = total
+        host["progress"] = progress
+    # 每台主机每个百分点最多推送一次
+    if changed:
+        SCAN_EVENTS.publish("host_progress", job=job.id, ip=ip, scanned=scanned, total=total, progress=progress)
+
+def stream_port_found(ip, port_info):
+    job = current_job()
+    port_info = dict(port_info, ip=ip)
+    with job.lock:
+        job.stream["found_ports"].append(port_info)
+        host = job.stream["active_hosts"].get(ip)
+        if host:
+            host["found"] += 1
+    SCAN_EVENTS.publish("port_open", job=job.id, **port_info)
+
+def stream_port_service(ip, port_info):
+    """服务识别结果: 同时更新已推送的开放端口, 断线重连后的快照中也带有识别结果"""
+    job = current_job()
+    with job.lock:
+        for found in job.stream["found_ports"]:
+            if found["ip"] == ip and found["port"] == port_info["port"]:
+                found.update(port_info)
+    SCAN_EVENTS.publish("port_service", job=job.id, ip=ip, **port_info)
+
+def stream_host_done(ip):
+    job = current_job()
+    with job.lock:
+        host = job.stream["active_hosts"].pop(ip, None)
+        if job.stream["current_ip"] == ip:
+            job.stream["current_ip"] = next(iter(job.stream["active_hosts"]), "")
+        _refresh_current_device(job)
+    SCAN_EVENTS.publish("host_done", job=job.id, ip=ip, found=host["found"] if host else 0)
+
+def stream_device_done(device):
+    job = current_job()
+    with job.lock:
+        job.stream["completed_devices"].append(device)
+
+def _refresh_current_device(job):
+    """兼容旧字段: current_device 显示所有正在扫描的主机"""
+    active = list(job.stream["active_hosts"])
+    job.status["active_hosts"] = active
+    job.status["current_device"] = ", ".join(active)
+
+# ======== 端口频率库 ========
+# 按开放频率从高到低排列的端口 (参考公开的互联网扫描统计, 并补充家庭网络/IoT常见端口),
+# 以紧凑的区间字符串内置, 首次使用时才解析; 排名之外的端口按端口号顺序排在其后, 覆盖 1-65535 全部端口
+_TCP_RANKED = (
+    # 前100, 按频率排序
+    "80,23,443,21,22,25,3389,110,445,139,143,53,135,3306,8080,1723,111,995,993,5900,1025,587,8888,199,1720,"
+    "465,548,113,81,6001,10000,514,5060,179,1026,2000,8443,8000,32768,554,26,1433,49152,2001,515,8008,49154,"
+    "1027,5666,646,5000,5631,631,49153,8081,2049,88,79,5800,106,2121,1110,49155,6000,513,990,5357,427,49156,"
+    "543,544,5101,144,7,389,8009,3128,444,9999,5009,7070,5190,3000,5432,1900,3986,13,1029,9,5051,6646,49157,"
+    "1028,873,1755,2717,4899,9100,119,37,"
+    # 家庭网络/IoT/开发环境常见端口
+    "6379,27017,1883,8883,5555,62078,8123,1400,8060,32400,7000,9000,2375,2376,6443,9200,11211,5601,5672,9092,"
+    "9042,7474,5984,8086,8088,9443,12306,28015,27018,6631,50000,3001,5901,2222,1194,1701,500,161,123,67-69,"
+    "137-138,520-521,546-547,1080,1434,1521,2082-2083,2086-2087,2095-2096,5500,6667,7001,82-83,194,464,636,989,"
+    # 其余前1000, 按端口号排序
+    "1,3-4,6,13,17,19-26,30,32-33,37,42-43,49,53,70,79-85,88-90,99-100,106,109-111,113,119,125,135,139,"
+    "143-144,146,161,163,179,199,211-212,222,254-256,259,264,280,301,306,311,340,366,389,406-407,416-417,425,"
+    "427,443-445,458,464-465,481,497,500,512-515,524,541,543-545,548,554-555,563,587,593,616-617,625,631,636,"
+    "646,648,666-668,683,687,691,700,705,711,714,720,722,726,749,765,777,783,787,800-801,808,843,873,880,888,"
+    "898,900-903,911-912,981,987,990,992-993,995,999-1002,1007,1009-1011,1021-1100,1102,1104-1108,1110-1114,"
+    "1117,1119,1121-1124,1126,1130-1132,1137-1138,1141,1145,1147-1149,1151-1152,1154,1163-1166,1169,1174-1175,"
+    "1183,1185-1187,1192,1198-1199,1201,1213,1216-1218,1233-1234,1236,1244,1247-1248,1259,1271-1272,1277,1287,"
+    "1296,1300-1301,1309-1311,1322,1328,1334,1352,1417,1433-1434,1443,1455,1461,1494,1500-1501,1503,1521,1524,"
+    "1533,1556,1580,1583,1594,1600,1641,1658,1666,1687-1688,1700,1717-1721,1723,1755,1761,1782-1783,1801,1805,"
+    "1812,1839-1840,1862-1864,1875,1900,1914,1935,1947,1971-1972,1974,1984,1998-2010,2013,2020-2022,2030,"
+    "2033-2035,2038,2040-2043,2045-2049,2065,2068,2099-2100,2103,2105-2107,2111,2119,2121,2126,2135,2144,"
+    "2160-2161,2170,2179,2190-2191,2196,2200,2222,2251,2260,2288,2301,2323,2366,2381-2383,2393-2394,2399,2401,"
+    "2492,2500,2522,2525,2557,2601-2602,2604-2605,2607-2608,2638,2701-2702,2710,2717-2718,2725,2800,2809,2811,"
+    "2869,2875,2909-2910,2920,2967-2968,2998,3000-3001,3003,3005-3007,3011,3013,3017,3030-3031,3052,3071,3077,"
+    "3128,3168,3211,3221,3260-3261,3268-3269,3283,3300-3301,3306,3322-3325,3333,3351,3367,3369-3372,3389-3390,"
+    "3404,3476,3493,3517,3527,3546,3551,3580,3659,3689-3690,3703,3737,3766,3784,3800-3801,3809,3814,3826-3828,"
+    "3851,3869,3871,3878,3880,3889,3905,3914,3918,3920,3945,3971,3986,3995,3998,4000-4006,4045,4111,4125-4126,"
+    "4129,4224,4242,4279,4321,4343,4443-4446,4449,4550,4567,4662,4848,4899-4900,4998,5000-5004,5009,5030,5033,"
+    "5050-5051,5054,5060-5061,5080,5087,5100-5102,5120,5190,5200,5214,5221-5222,5225-5226,5269,5280,5298,5357,"
+    "5405,5414,5431-5432,5440,5500,5510,5544,5550,5555,5560,5566,5631,5633,5666,5678-5679,5718,5730,5800-5802,"
+    "5810-5811,5815,5822,5825,5850,5859,5862,5877,5900-5904,5906-5907,5910-5911,5915,5922,5925,5950,5952,"
+    "5959-5963,5987-5989,5998-6007,6009,6025,6059,6100-6101,6106,6112,6123,6129,6156,6346,6389,6502,6510,6543,"
+    "6547,6565-6567,6580,6646,6666-6669,6689,6692,6699,6779,6788-6789,6792,6839,6881,6901,6969,7000-7002,7004,"
+    "7007,7019,7025,7070,7100,7103,7106,7200-7201,7402,7435,7443,7496,7512,7625,7627,7676,7741,7777-7778,7800,"
+    "7911,7920-7921,7937-7938,7999-8002,8007-8011,8021-8022,8031,8042,8045,8080-8090,8093,8099-8100,8180-8181,"
+    "8192-8194,8200,8222,8254,8290-8292,8300,8333,8383,8400,8402,8443,8500,8600,8649,8651-8652,8654,8701,8800,"
+    "8873,8888,8899,8994,9000-9003,9009-9011,9040,9050,9071,9080-9081,9090-9091,9099-9103,9110-9111,9200,9207,"
+    "9220,9290,9415,9418,9485,9500,9502-9503,9535,9575,9593-9595,9618,9666,9876-9878,9898,9900,9917,9929,"
+    "9943-9944,9968,9998-10004,10009-10010,10012,10024-10025,10082,10180,10215,10243,10566,10616-10617,10621,"
+    "10626,10628-10629,10778,11110-11111,11967,12000,12174,12265,12345,13456,13722,13782-13783,14000,14238,"
+    "14441-14442,15000,15002-15004,15660,15742,16000-16001,16012,16016,16018,16080,16113,16992-16993,17877,"
+    "17988,18040,18101,18988,19101,19283,19315,19350,19780,19801,19842,20000,20005,20031,20221-20222,20828,"
+    "21571,22939,23502,24444,24800,25734-25735,26214,27000,27352-27353,27355-27356,27715,28201,30000,30718,"
+    "30951,31038,31337,32768-32785,33354,33899,34571-34573,35500,38292,40193,40911,41511,42510,44176,"
+    "44442-44443,44501,45100,48080,49152-49161,49163,49165,49167,49175-49176,49400,49999-50003,50006,50300,"
+    "50389,50500,50636,50800,51103,51493,52673,52822,52848,52869,54045,54328,55055-55056,55555,55600,"
+    "56737-56738,57294,57797,58080,60020,60443,61532,61900,62078,63331,64623,64680,65000,65129,65389"
+)
+_UDP_RANKED = (
+    "631,161,137,123,138,1434,445,135,67,53,139,500,68,520,1900,4500,514,49152,162,69,5353,111,49154,1701,998,"
+    "996-997,999,3283,49153,1812,136,2222,2049,32768,5060,1025,1433,3456,80,20031,1026,7,1646,1645,593,518,"
+    "2048,626,1027,177,1719,427,497,4444,1023,65024,19,9,49193,1029,49,88,1028,17185,1718,49186,2000,31337,"
+    "5351,5355,3702,10001,11211,1604,5683"
+)
+
+def _expand_ports(spec):
+    """按原顺序展开 "80,443,1000-1002" 形式的端口列表"""
+    for part in spec.split(','):
+        start, _, end = part.partition('-')
+        yield from range(int(start), int(end or start) + 1)
+
+class PortRegistry:
+    """端口频率排名与服务名查询, TCP/UDP 各覆盖 1-65535 全部端口
+    
+    排名表首次使用时解析, 服务名按需通过系统服务库查询并缓存
+    """
+    
+    def __init__(self, sources):
+        self._sources = sources
+        self._ranked = {}
+        self._names = {}
+        self._lock = threading.Lock()
+    
+    def ranked(self, proto="tcp"):
+        """按频率从高到低排列的已知端口 (不含排名之外的端口)"""
+        ranked = self._ranked.get(proto)
+        if ranked is None:
+            with self._lock:
+                ranked = self._ranked.get(proto)
+                if ranked is None:
+                    ranked = self._ranked[proto] = list(dict.fromkeys(_expand_ports(self._sources[proto])))
+        return ranked
+    
+    def order(self, ports, proto="tcp", numeric=None):
+        """按可能性从高到低迭代 ports 中的端口
+        
+        先输出排名表中的端口, 再按端口号输出其余端口; ports 需支持 in 运算,
+        numeric 为按端口号顺序的迭代器, 默认直接迭代 ports
+        """
+        head = [port for port in self.ranked(proto) if port in ports]
+        yield from head
+        seen = set(head)
+        for port in (ports if numeric is None else numeric):
+            if port not in seen:
+                yield port
+    
+    def top(self, n, proto="tcp"):
+        return TopPorts(self, n, proto)
+    
+    def service(self, port, proto="tcp"):
+        """端口的登记服务名, 没有登记时返回 None"""
+        key = (port, proto)
+        if key not in self._names:
+            try:
+                self._names[key] = socket.getservbyport(port, proto).upper()
+            except (OSError, OverflowError):
+                self._names[key] = None
+        return self._names[key]
+
+class TopPorts:
+    """频率最高的 n 个端口, 按频率从高到低惰性迭代; n 超过排名表长度时其余端口按端口号补足"""
+    
+    def __init__(self, registry, n, proto="tcp"):
+        self.registry = registry
+        self.n = max(1, min(65535, int(n)))
+        self.proto = proto
+        self._members = None
+    
+    def __iter__(self):
+        return itertools.islice(self.registry.order(range(1, 65536), self.proto), self.n)
+    
+    def __len__(self):
+        return self.n
+    
+    def __contains__(self, port):
+        if self.n >= 65535:
+            return 1 <= port <= 65535
+        if self._members is None:
+            self._members = frozenset(self)
+        return port in self._members
+    
+    def __str__(self):
+        return "1-65535" if self.n >= 65535 else f"top{self.n}"
+
+PORTS = PortRegistry({"tcp": _TCP_RANKED, "udp": _UDP_RANKED})
+
+# 常用端口为频率最高的1000个, 全端口同样按频率顺序扫描
+COMMON_PORTS = PORTS.top(1000)
+ALL_PORTS = PORTS.top(65535)
+
+# 端口模式: 常用端口(common) 即 top1000; 频率排名表只有约1000个TCP端口, 不提供更大的 topN 模式
+PORT_MODES = {"top100": 100, "common": 1000, "top1000": 1000, "full": 65535}
+
+class PortSpec:
+    """端口范围描述, 如 "1-1024,3306,8000-9000"
+    
+    只保存合并后的区间, 迭代时惰性生成端口, 全端口也不会展开成列表;
+    迭代顺序按端口频率排名, 开放可能性高的端口先扫描
+    """
+    
+    def __init__(self, spec):
+        ranges = []
+        for part in str(spec).replace(' ', '').split(','):
+            if not part:
+                continue
+            if '-' in part:
+                start, _, end = part.partition('-')
+            else:
+                start = end = part
+            if not (start.isdigit() and end.isdigit()):
+                raise ValueError(f"端口格式错误: {part}")
+            start, end = int(start), int(end)
+            if not (1 <= start <= end <= 65535):
+                raise ValueError(f"端口范围无效: {part}")
+            ranges.append((start, end))
+        if not ranges:
+            raise ValueError("端口不能为空")
+        
+        ranges.sort()
+        merged = [ranges[0]]
+        for start, end in ranges[1:]:
+            last_start, last_end = merged[-1]
+            if start <= last_end + 1:
+                merged[-1] = (last_start, max(last_end, end))
+            else:
+                merged.append((start, end))
+        self.ranges = merged
+    
+    def __iter__(self):
+        return PORTS.order(self, numeric=self._numeric())
+    
+    def _numeric(self):
+        return itertools.chain.from_iterable(range(start, end + 1) for start, end in self.ranges)
+    
+    def __contains__(self, port):
+        return any(start <= port <= end for start, end in self.ranges)
+    
+    def __len__(self):
+        return sum(end - start + 1 for start, end in self.ranges)
+    
+    def __str__(self):
+        return ','.join(str(s) if s == e else f"{s}-{e}" for s, e in self.ranges)
+
+def parse_ports(spec):
+    """解析端口参数: "top100" 等取频率最高的N个端口, 其余按 PortSpec 解析
+    
+    排名表只有约1000个TCP端口 (len(PORTS.ranked())), 更大的 N 超出部分按端口号顺序补足, 并非按频率
+    """
+    match = re.fullmatch(r'top(\d+)', str(spec).strip().lower())
+    if match:
+        if not 1 <= int(match.group(1)) <= 65535:
+            raise ValueError(f"端口数量无效: {spec}")
+        return PORTS.top(int(match.group(1)))
+    return PortSpec(spec)
+
+def resolve_port_mode(mode, ports=None):
+    """端口模式和自定义端口 → (fast_mode, port_spec), 自定义端口优先; 格式错误时抛出 ValueError"""
+    if mode not in PORT_MODES:
+        raise ValueError(f"不支持的端口模式: {mode}")
+    if ports:
+        return mode != "full", parse_ports(ports)
+    if mode in ("common", "full"):
+        return mode == "common", None
+    return True, PORTS.top(PORT_MODES[mode])
+
+def port_scope(ports, fast_mode=False):
+    """一次扫描实际覆盖的端口范围 (与 scan_ports 的默认值一致), 支持 in"""
+    if ports is None:
+        return COMMON_PORTS if fast_mode else ALL_PORTS
+    return parse_ports(ports) if isinstance(ports, str) else ports
+
+# 设备发现按分片进行, 每片地址数; 自动检测的网段最大为 /22, 手动配置最多 MAX_DISCOVERY_HOSTS 个地址
+DISCOVERY_SHARD_SIZE = 1024
+AUTO_NETWORK_MIN_PREFIX = 22
+MAX_DISCOVERY_HOSTS = 1 << 18
+
+def parse_networks(spec):
+    """解析一个或多个网段, 如 "192.168.0.0/22, 10.0.0.0/16", 返回 IPv4Network 列表
+    
+    重叠或相邻的网段合并 (如 10.0.0.0/24 与 10.0.0.0/16 合并为 10.0.0.0/16), 结果按地址排序
+    """
+    networks = []
+    for part in re.split(r'[,\s;]+', str(spec).strip()):
+        if not part:
+            continue
+        try:
+            networks.append(ipaddress.IPv4Network(part, strict=False))
+        except ValueError:
+            raise ValueError(f"网段格式错误: {part}")
+    if not networks:
+        raise ValueError("网段不能为空")
+    networks = list(ipaddress.collapse_addresses(networks))
+    total = sum(network.num_addresses for network in networks)
+    if total > MAX_DISCOVERY_HOSTS:
+        raise ValueError(f"网段过大: 共 {total} 个地址, 最多 {MAX_DISCOVERY_HOSTS} 个")
+    return networks
+
+def count_hosts(networks):
+    """可用主机地址数 (/31 及 /32 之外不含网络地址和广播地址)"""
+    return sum(n.num_addresses - 2 if n.prefixlen < 31 else n.num_addresses for n in networks)
+
+def iter_host_shards(networks, shard_size=DISCOVERY_SHARD_SIZE, exclude=()):
+    """按分片惰性生成主机地址列表, 内存占用只与分片大小有关"""
+    shard = []
+    for network in networks:
+        for host in network.hosts():
+            ip = str(host)
+            if ip in exclude:
+                continue
+            shard.append(ip)
+            if len(shard) >= shard_size:
+                yield shard
+                shard = []
+    if shard:
+        yield shard
+
+class PortSlice:
+    """端口空间 ports 均分为 count 片后的第 index 片, 惰性迭代"""
+    
+    def __init__(self, ports, index, count):
+        self.ports = ports
+        self.index = index
+        self.count = count
+        total = len(ports)
+        self.start = total * index // count
+        self.stop = total * (index + 1) // count
+    
+    def __iter__(self):
+        return itertools.islice(iter(self.ports), self.start, self.stop)
+    
+    def __len__(self):
+        return self.stop - self.start
+    
+    def __str__(self):
+        return f"{self.index + 1}/{self.count}"
+
+# 增量扫描时已知主机每次扫描的端口数上限, 全端口约分为16片轮换
+INCREMENTAL_SLICE_SIZE = 4096
+
+# 数据文件目录, 默认与 app.py 相同, 可用环境变量 HPM_DATA_DIR 指定 (如基准测试使用临时目录)
+DATA_DIR = os.environ.get("HPM_DATA_DIR") or os.path.dirname(os.path.abspath(__file__))
+SAVE_FILE = os.path.join(DATA_DIR, 'scan_history.json')
+DB_FILE = os.path.join(DATA_DIR, 'scan_history.db')
+DEVICE_NOTES_FILE = os.path.join(DATA_DIR, 'device_notes.json')
+
+class ScanStore:
+    """SQLite (WAL) 扫描历史库
+    
+    runs 记录每次扫描, hosts/ports 保存每台设备和端口的当前状态及首次/最近发现时间,
+    observations 记录每次扫描中的端口开放/关闭和主机上线/离线, 按 ip、port、时间建索引
+    """
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            params TEXT,
+            started_at TEXT NOT NULL,
+            finished_at TEXT
+        );
+        CREATE TABLE IF NOT EXISTS hosts (
+            ip TEXT PRIMARY KEY,
+            mac TEXT,
+            name TEXT,
+            vendor TEXT,
+            type TEXT,
+            rtt_ms REAL,
+            online INTEGER NOT NULL DEFAULT 1,
+            first_seen TEXT NOT NULL,
+            last_seen TEXT NOT NULL,
+            last_run INTEGER
+        );
+        CREATE TABLE IF NOT EXISTS ports (
+            ip TEXT NOT NULL,
+            port INTEGER NOT NULL,
+            service TEXT,
+            risk TEXT,
+            risk_desc TEXT,
+            open INTEGER NOT NULL DEFAULT 1,
+            first_seen TEXT NOT NULL,
+            last_seen TEXT NOT NULL,
+            PRIMARY KEY (ip, port)
+        );
+        CREATE TABLE IF NOT EXISTS observations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            run_id INTEGER,
+            ip TEXT NOT NULL,
+            port INTEGER,
+            state TEXT NOT NULL,
+            observed_at TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS fingerprints (
+            ip TEXT NOT NULL,
+            port INTEGER NOT NULL,
+            mac TEXT NOT NULL DEFAULT '',
+            service TEXT,
+            product TEXT,
+            banner TEXT,
+            probe TEXT,
+            fingerprinted_at REAL NOT NULL,
+            PRIMARY KEY (ip, port, mac)
+        );
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_ports_port ON ports (port, open);
+        CREATE INDEX IF NOT EXISTS idx_obs_ip_port ON observations (ip, port, observed_at);
+        CREATE INDEX IF NOT EXISTS idx_obs_port ON observations (port, observed_at);
+        CREATE INDEX IF NOT EXISTS idx_obs_time ON observations (observed_at);
+        CREATE INDEX IF NOT EXISTS idx_obs_run ON observations (run_id);
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+        self._conn.commit()
+    
+    @staticmethod
+    def _now():
+        return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    
+    def begin_run(self, kind, params=None):
+        with self._lock, self._conn:
+            cur = self._conn.execute("INSERT INTO runs (kind, params, started_at) VALUES (?, ?, ?)",
+                                     (kind, json.dumps(params or {}, ensure_ascii=False), self._now()))
+            return cur.lastrowid
+    
+    def finish_run(self, run_id):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE runs SET finished_at = ? WHERE id = ?", (self._now(), run_id))
+    
+    def record_hosts(self, run_id, devices, complete=False, scope=None, port_scope=None):
+        """写入设备及其开放端口, observations 只记录状态变化 (新开放/关闭/上线/离线)
+        
+        设备带 "ports" 时该设备的端口列表视为 port_scope (本次扫描的端口范围, 支持 in; None 为全部端口)
+        内的完整结果, 范围内之前开放而本次未发现的端口记为关闭;
+        complete=True 表示 devices 是扫描网段 scope (IPv4Network 列表, None 为全部) 的完整结果,
+        网段内不在其中的在线设备记为离线
+        """
+        now = self._now()
+        with self._lock, self._conn:
+            conn = self._conn
+            for device in devices:
+                ip = device["ip"]
+                row = conn.execute("SELECT online FROM hosts WHERE ip = ?", (ip,)).fetchone()
+                conn.execute("""
+                    INSERT INTO hosts (ip, mac, name, vendor, type, rtt_ms, online, first_seen, last_seen, last_run)
+                    VALUES (?, ?, ?, ?, ?, ?, 1, ?, ?, ?)
+                    ON CONFLICT (ip) DO UPDATE SET mac = excluded.mac, name = excluded.name,
+                        vendor = excluded.vendor, type = excluded.type,
+                        rtt_ms = COALESCE(excluded.rtt_ms, hosts.rtt_ms), online = 1,
+                        last_seen = excluded.last_seen, last_run = excluded.last_run
+                """, (ip, device.get("mac"), device.get("name"), device.get("vendor"), device.get("type"),
+                      device.get("rtt_ms"), now, device.get("last_seen") or now, run_id))
+                if row is None or not row["online"]:
+                    conn.execute("INSERT INTO observations (run_id, ip, port, state, observed_at) VALUES (?, ?, NULL, 'up', ?)",
+                                 (run_id, ip, now))
+                
+                if "ports" not in device:
+                    continue
+                previously_open = {r["port"] for r in conn.execute("SELECT port FROM ports WHERE ip = ? AND open = 1", (ip,))}
+                current = {p["port"] for p in device["ports"]}
+                for p in device["ports"]:
+                    conn.execute("""
+                        INSERT INTO ports (ip, port, service, risk, risk_desc, open, first_seen, last_seen)
+                        VALUES (?, ?, ?, ?, ?, 1, ?, ?)
+                        ON CONFLICT (ip, port) DO UPDATE SET service = excluded.service, risk = excluded.risk,
+                            risk_desc = excluded.risk_desc, open = 1, last_seen = excluded.last_seen
+                    """, (ip, p["port"], p.get("service"), p.get("risk"), p.get("risk_desc"), now, now))
+                    if p["port"] not in previously_open:
+                        conn.execute("INSERT INTO observations (run_id, ip, port, state, observed_at) VALUES (?, ?, ?, 'open', ?)",
+                                     (run_id, ip, p["port"], now))
+                for port in previously_open - current:
+                    if port_scope is not None and port not in port_scope:
+                        continue  # 本次没有扫描这个端口, 状态未知
+                    conn.execute("UPDATE ports SET open = 0 WHERE ip = ? AND port = ?", (ip, port))
+                    conn.execute("INSERT INTO observations (run_id, ip, port, state, observed_at) VALUES (?, ?, ?, 'closed', ?)",
+                                 (run_id, ip, port, now))
+            
+            if complete:
+                seen = {device["ip"] for device in devices}
+                for row in conn.execute("SELECT ip FROM hosts WHERE online = 1").fetchall():
+                    if scope is not None and not any(ipaddress.IPv4Address(row["ip"]) in n for n in scope):
+                        continue
+                    if row["ip"] not in seen:
+                        conn.execute("UPDATE hosts SET online = 0 WHERE ip = ?", (row["ip"],))
+                        conn.execute("INSERT INTO observations (run_id, ip, port, state, observed_at) VALUES (?, ?, NULL, 'down', ?)",
+                                     (run_id, row["ip"], now))
+    
+    def save_run(self, kind, devices, params=None, complete=True, scope=None, port_scope=None):
+        run_id = self.begin_run(kind, params)
+        self.record_hosts(run_id, devices, complete=complete, scope=scope, port_scope=port_scope)
+        self.finish_run(run_id)
+        return run_id
+    
+    def latest_devices(self):
+        """当前在线设备及其开放端口, 格式与 SCAN_CACHE 相同"""
+        with self._lock:
+            hosts = self._conn.execute("SELECT * FROM hosts WHERE online = 1 ORDER BY last_seen").fetchall()
+            ports = self._conn.execute("""
+                SELECT p.*, f.product, f.banner FROM ports p
+                JOIN hosts h ON h.ip = p.ip
+                LEFT JOIN fingerprints f ON f.ip = p.ip AND f.port = p.port AND f.mac = COALESCE(h.mac, '')
+                WHERE p.open = 1 ORDER BY p.ip, p.port
+            """).fetchall()
+        by_ip = {}
+        for p in ports:
+            port_info = {"port": p["port"], "service": p["service"], "risk": p["risk"], "risk_desc": p["risk_desc"]}
+            if p["product"] or p["banner"]:
+                port_info.update(product=p["product"], banner=p["banner"])
+            by_ip.setdefault(p["ip"], []).append(port_info)
+        return [{
+            "ip": h["ip"],
+            "mac": h["mac"],
+            "name": h["name"],
+            "vendor": h["vendor"],
+            "type": h["type"],
+            "ports": by_ip.get(h["ip"], []),
+            "rtt_ms": h["rtt_ms"],
+            "last_seen": h["last_seen"],
+        } for h in hosts]
+    
+    def iter_devices(self, since=None):
+        """逐台生成在线设备及其开放端口 (格式同 latest_devices), since 为 last_seen 下限
+        
+        使用独立的只读连接逐行读取, 导出大量数据时内存占用恒定, 也不会长时间占用写入锁
+        """
+        conn = sqlite3.connect(self.path)
+        conn.row_factory = sqlite3.Row
+        conn.create_function("ip_int", 1, lambda ip: int(ipaddress.IPv4Address(ip)))
+        try:
+            conn.execute("PRAGMA query_only = 1")
+            rows = conn.execute("""
+                SELECT h.ip, h.mac, h.name, h.vendor, h.type, h.rtt_ms, h.last_seen,
+                       p.port, p.service, p.risk, p.risk_desc, f.product, f.banner
+                FROM hosts h
+                LEFT JOIN ports p ON p.ip = h.ip AND p.open = 1
+                LEFT JOIN fingerprints f ON f.ip = p.ip AND f.port = p.port AND f.mac = COALESCE(h.mac, '')
+                WHERE h.online = 1 AND h.last_seen >= ?
+                ORDER BY ip_int(h.ip), p.port
+            """, (since or "",))
+            for _, group in itertools.groupby(rows, key=lambda r: r["ip"]):
+                group = list(group)
+                ports = []
+                for p in group:
+                    if p["port"] is None:
+                        continue
+                    port_info = {"port": p["port"], "service": p["service"], "risk": p["risk"], "risk_desc": p["risk_desc"]}
+                    if p["product"] or p["banner"]:
+                        port_info.update(product=p["product"], banner=p["banner"])
+                    ports.append(port_info)
+                h = group[0]
+                yield {
+                    "ip": h["ip"],
+                    "mac": h["mac"],
+                    "name": h["name"],
+                    "vendor": h["vendor"],
+                    "type": h["type"],
+                    "ports": ports,
+                    "rtt_ms": h["rtt_ms"],
+                    "last_seen": h["last_seen"],
+                }
+        finally:
+            conn.close()
+    
+    def host_history(self, ip, port=None, limit=200):
+        with self._lock:
+            if port is None:
+                ports = self._conn.execute("SELECT * FROM ports WHERE ip = ? ORDER BY port", (ip,)).fetchall()
+                observations = self._conn.execute(
+                    "SELECT run_id, port, state, observed_at FROM observations WHERE ip = ? "
+                    "ORDER BY observed_at DESC, id DESC LIMIT ?", (ip, limit)).fetchall()
+            else:
+                ports = self._conn.execute("SELECT * FROM ports WHERE ip = ? AND port = ?", (ip, port)).fetchall()
+                observations = self._conn.execute(
+                    "SELECT run_id, port, state, observed_at FROM observations WHERE ip = ? AND port = ? "
+                    "ORDER BY observed_at DESC, id DESC LIMIT ?", (ip, port, limit)).fetchall()
+            host = self._conn.execute("SELECT * FROM hosts WHERE ip = ?", (ip,)).fetchone()
+        return {
+            "host": dict(host) if host else None,
+            "ports": [dict(p) for p in ports],
+            "observations": [dict(o) for o in observations],
+        }
+    
+    def first_open(self, ip, port):
+        with self._lock:
+            row = self._conn.execute("SELECT MIN(observed_at) AS first FROM observations "
+                                     "WHERE ip = ? AND port = ? AND state = 'open'", (ip, port)).fetchone()
+        return row["first"]
+    
+    def recent_runs(self, limit=50):
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM runs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+        return [dict(r) for r in rows]
+    
+    def fresh_fingerprints(self, ip, mac, ttl):
+        """(ip, mac) 在 ttl 秒内识别过的端口, 返回 {port: {"service", "product", "banner", "probe"}}"""
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM fingerprints WHERE ip = ? AND mac = ? AND fingerprinted_at >= ?",
+                                      (ip, mac or "", time.time() - ttl)).fetchall()
+        return {r["port"]: {"service": r["service"], "product": r["product"], "banner": r["banner"], "probe": r["probe"]}
+                for r in rows}
+    
+    def save_fingerprints(self, ip, mac, results):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany("""
+                INSERT INTO fingerprints (ip, port, mac, service, product, banner, probe, fingerprinted_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (ip, port, mac) DO UPDATE SET service = excluded.service, product = excluded.product,
+                    banner = excluded.banner, probe = excluded.probe, fingerprinted_at = excluded.fingerprinted_at
+            """, [(ip, port, mac or "", fp.get("service"), fp.get("product"), fp.get("banner"), fp.get("probe"), now)
+                  for port, fp in results.items()])
+    
+    def get_meta(self, key, default=None):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row["value"]) if row else default
+    
+    def set_meta(self, key, value):
+        with self._lock, self._conn:
+            self._conn.execute("INSERT INTO meta (key, value) VALUES (?, ?) "
+                               "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+                               (key, json.dumps(value, ensure_ascii=False)))
+    
+    def is_empty(self):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM runs LIMIT 1").fetchone() is None
+    
+    def import_json(self, path):
+        """从旧版 scan_history.json 导入一次"""
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        devices = data.get('devices', [])
+        self.save_run("import", devices, params={"file": os.path.basename(path)})
+        return len(devices)
+
+# 数据库、扫描日志、定时任务和代理列表由 init_data() 创建 (__main__ 或第一个请求时),
+# 导入本模块 (测试、bench.py、端口扫描子进程) 不会打开或创建任何数据文件
+STORE = None
+
+# 全网扫描的检查点日志; 单台主机的端口按 CHECKPOINT_CHUNK_SIZE 分块记录完成情况
+JOURNAL_FILE = os.path.join(DATA_DIR, 'scan_journal.jsonl')
+CHECKPOINT_CHUNK_SIZE = 8192
+
+class ScanJournal:
+    """追加写入的扫描日志 (JSON Lines), 进程崩溃或容器重启后可从最后的检查点继续
+    
+    记录依次为 begin (任务参数)、hosts (设备发现结果)、chunk (某台主机完成的端口块及其中的开放端口)、
+    host (完成的设备), 按批写入并 fsync; 任务完成后压缩为一条 complete 记录
+    """
+    
+    def __init__(self, path, batch_size=64, flush_interval=2.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._last_flush = time.monotonic()
+    
+    def _append(self, record, flush=False):
+        with self._lock:
+            self._buffer.append(json.dumps(record, ensure_ascii=False))
+            if flush or len(self._buffer) >= self.batch_size or time.monotonic() - self._last_flush >= self.flush_interval:
+                self._flush_locked()
+    
+    def _flush_locked(self):
+        if self._buffer:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write('\n'.join(self._buffer) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            self._buffer = []
+        self._last_flush = time.monotonic()
+    
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+    
+    def _rewrite(self, records):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+    
+    def begin(self, job):
+        with self._lock:
+            self._buffer = []
+            self._rewrite([{"t": "begin", "job": job, "ts": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}])
+            self._last_flush = time.monotonic()
+    
+    def hosts(self, found_devices):
+        self._append({"t": "hosts", "hosts": [list(d) for d in found_devices]}, flush=True)
+    
+    def chunk(self, ip, index, count, open_ports):
+        self._append({"t": "chunk", "ip": ip, "index": index, "count": count, "ports": open_ports})
+    
+    def host(self, device):
+        self._append({"t": "host", "device": device})
+    
+    def resume(self, state):
+        """继续中断的任务前按 state 重写日志, 去掉崩溃时写了一半的记录"""
+        records = [{"t": "begin", "job": state["job"], "ts": state["started_at"]}]
+        if state["hosts"] is not None:
+            records.append({"t": "hosts", "hosts": [list(d) for d in state["hosts"]]})
+        for ip, chunks in state["chunks"].items():
+            records.extend({"t": "chunk", "ip": ip, "index": index, "count": count, "ports": ports}
+                           for (index, count), ports in chunks.items())
+        records.extend({"t": "host", "device": device} for device in state["devices"].values())
+        with self._lock:
+            self._buffer = []
+            self._rewrite(records)
+            self._last_flush = time.monotonic()
+    
+    def complete(self, run_id=None):
+        """任务完成, 结果已写入 STORE, 日志压缩为一条记录"""
+        self.flush()
+        state = self.load() or {}
+        with self._lock:
+            self._buffer = []
+            self._rewrite([{"t": "complete", "job": state.get("job"), "run_id": run_id,
+                            "hosts": len(state.get("devices", {})),
+                            "ts": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}])
+    
+    def discard(self):
+        with self._lock:
+            self._buffer = []
+            if os.path.exists(self.path):
+                os.remove(self.path)
+    
+    def load(self):
+        """重放日志, 返回 {"job", "started_at", "hosts", "chunks", "devices", "complete"}; 没有日志时返回 None"""
+        if not os.path.exists(self.path):
+            return None
+        state = None
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # 崩溃时写了一半的记录
+                kind = record.get("t")
+                if kind in ("begin", "complete"):
+                    state = {"job": record.get("job"), "started_at": record.get("ts"), "hosts": None,
+                             "chunks": {}, "devices": {}, "complete": kind == "complete"}
+                elif state is None:
+                    continue
+                elif kind == "hosts":
+                    state["hosts"] = [tuple(d) for d in record["hosts"]]
+                elif kind == "chunk":
+                    chunks = state["chunks"].setdefault(record["ip"], {})
+                    chunks[(record["index"], record["count"])] = record["ports"]
+                elif kind == "host":
+                    state["devices"][record["device"]["ip"]] = record["device"]
+        return state
+    
+    def pending(self):
+        """中断的任务状态, 没有时返回 None"""
+        try:
+            state = self.load()
+        except OSError as e:
+            print(f"[日志] 读取失败: {e}")
+            return None
+        if state is None or state["complete"] or not state["job"]:
+            return None
+        return state
 
-SAVE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scan_history.json')
-DEVICE_NOTES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'device_notes.json')
+JOURNAL = None
 
 def load_data():
     global SCAN_CACHE, DEVICE_NOTES
-    if os.path.exists(SAVE_FILE):
+    if STORE.is_empty() and os.path.exists(SAVE_FILE):
         try:
-            with open(SAVE_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                SCAN_CACHE = {d['ip']: d for d in data.get('devices', [])}
-        except:
-            pass
+            count = STORE.import_json(SAVE_FILE)
+            print(f"[历史] 已从 {os.path.basename(SAVE_FILE)} 导入 {count} 台设备")
+        except Exception as e:
+            print(f"[历史] 导入旧数据失败: {e}")
+    try:
+        SCAN_CACHE = {d['ip']: d for d in STORE.latest_devices()}
+    except Exception as e:
+        print(f"[历史] 读取失败: {e}")
     if os.path.exists(DEVICE_NOTES_FILE):
         try:
             with open(DEVICE_NOTES_FILE, 'r', encoding='utf-8') as f:
                 DEVICE_NOTES = json.load(f)
         except:
             pass
+    pending = JOURNAL.pending()
+    if pending:
+        print(f"[日志] 发现未完成的扫描 (开始于 {pending['started_at']}, 已完成 {len(pending['devices'])} 台设备), "
+              f"可通过 /api/scan/resume 继续")
 
 def save_notes():
     try:
@@ -121,7 +1668,23 @@ def save_notes():
         print(f"保存备注失败: {e}")
         return False
 
-load_data()
+DATA_LOCK = threading.Lock()
+DATA_READY = False
+
+def init_data():
+    """打开数据库和扫描日志、加载历史数据, 创建定时任务和分布式扫描协调者; 只执行一次"""
+    global STORE, JOURNAL, SCHEDULER, COORDINATOR, DATA_READY
+    with DATA_LOCK:
+        if DATA_READY:
+            return
+        with startup_phase("打开数据库"):
+            STORE = ScanStore(DB_FILE)
+        JOURNAL = ScanJournal(JOURNAL_FILE)
+        with startup_phase("加载历史数据"):
+            load_data()
+        SCHEDULER = ScanScheduler(STORE)
+        COORDINATOR = ScanCoordinator(STORE)
+        DATA_READY = True
 
 PORT_SERVICES = {
     20: ("FTP-Data", "中", "FTP数据传输"),
@@ -164,18 +1727,838 @@ PORT_SERVICES = {
     12306: ("Steam/Custom", "中", "Steam或自定义应用"),
 }
 
-class HomeNetworkScanner:
-    def __init__(self):
-        self.gateway = self._get_gateway()
-        self.local_ip = self._get_local_ip()
-        self.speed_mode = "fast"
-        # 加载自定义网段配置
-        self.custom_network = self._load_custom_network()
-        self.network = self.custom_network or self._get_network()
-    
-    def _load_custom_network(self):
-        """加载用户自定义网段配置"""
-        config_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'network_config.json')
+def port_service(port):
+    """端口的 (服务名, 风险等级, 说明); 不在 PORT_SERVICES 中时使用登记的服务名"""
+    if port in PORT_SERVICES:
+        return PORT_SERVICES[port]
+    name = PORTS.service(port)
+    return (name, "低", "已登记服务") if name else (f"Port {port}", "低", "未知服务")
+
+# ======== 服务识别 ========
+# 端口扫描结束后对开放端口读取banner/发送小探测包识别服务, 结果按 (ip, port, MAC) 缓存 ttl 秒;
+# greeting_timeout 为等待服务端主动发送欢迎信息的时间, read_timeout 为发送探测包后等待响应的时间
+FINGERPRINT = {"enabled": True, "workers": 64, "per_host": 8, "connect_timeout": 1.0, "greeting_timeout": 0.6,
+               "read_timeout": 1.5, "max_bytes": 2048, "ttl": 24 * 3600}
+
+# 优先发送 TLS ClientHello 的端口
+TLS_PORTS = {443, 465, 563, 636, 853, 989, 990, 992, 993, 994, 995, 2376, 5061, 5986, 6443, 8443, 8883, 9443}
+
+# 识别出的服务名对应 PORT_SERVICES 中的标准端口, 用于给非标准端口上的服务标注风险
+SERVICE_PORTS = {"FTP": 21, "SSH": 22, "Telnet": 23, "SMTP": 25, "HTTP": 80, "POP3": 110, "IMAP": 143,
+                 "HTTPS": 443, "MySQL": 3306, "RDP": 3389, "Redis": 6379, "VNC": 5900, "MQTT": 1883}
+
+def _tls_client_hello():
+    """最小的 TLS 1.2 ClientHello, 只用于判断对端是否为 TLS 服务"""
+    ciphers = b"".join(struct.pack("!H", c) for c in
+                       (0x1301, 0x1302, 0x1303, 0xc02b, 0xc02f, 0xc02c, 0xc030, 0x009c, 0x009d, 0x002f, 0x0035))
+    extensions = (
+        struct.pack("!HHH", 0x000a, 6, 4) + struct.pack("!HH", 0x001d, 0x0017)      # supported_groups
+        + struct.pack("!HHB", 0x000b, 2, 1) + b"\x00"                            # ec_point_formats
+        + struct.pack("!HHH", 0x000d, 10, 8) + struct.pack("!HHHH", 0x0403, 0x0804, 0x0401, 0x0501)
+    )
+    body = (b"\x03\x03" + os.urandom(32) + b"\x00" + struct.pack("!H", len(ciphers)) + ciphers + b"\x01\x00"
+            + struct.pack("!H", len(extensions)) + extensions)
+    handshake = b"\x01" + len(body).to_bytes(3, "big") + body
+    return b"\x16\x03\x01" + struct.pack("!H", len(handshake)) + handshake
+
+TLS_VERSIONS = {b"\x03\x01": "TLSv1.0", b"\x03\x02": "TLSv1.1", b"\x03\x03": "TLSv1.2", b"\x03\x04": "TLSv1.3"}
+
+def _banner_line(data):
+    """响应的第一行可打印文本, 最多120字符"""
+    text = data.decode("utf-8", errors="replace").split("\n", 1)[0].strip()
+    return "".join(ch for ch in text if ch.isprintable())[:120]
+
+def classify_banner(data, port):
+    """根据响应内容识别服务, 返回 {"service", "product", "banner"}; 无法识别时 service 为 None"""
+    result = {"service": None, "product": None, "banner": None}
+    if not data:
+        return result
+    if data[0] == 0x16 and len(data) >= 11 and data[5] == 0x02:
+        # ServerHello
+        result["service"] = PORT_SERVICES[port][0] if port in TLS_PORTS and port in PORT_SERVICES else "TLS"
+        result["product"] = TLS_VERSIONS.get(data[9:11])
+        return result
+    if data[:2] in (b"\x15\x03", b"\x16\x03"):
+        result["service"] = "TLS"
+        return result
+    if len(data) > 5 and data[4] == 0x0a and data[5:].find(b"\x00") > 0:
+        # MySQL 握手包: 3字节长度 + 序号 + 协议版本10 + 以0结尾的版本号
+        result["service"] = "MySQL"
+        result["product"] = data[5:5 + data[5:].find(b"\x00")].decode("ascii", errors="replace")
+        return result
+    
+    line = _banner_line(data)
+    upper = line.upper()
+    result["banner"] = line or None
+    if line.startswith("SSH-"):
+        result["service"] = "SSH"
+        result["product"] = line.split("-", 2)[-1] or None
+    elif line.startswith("HTTP/"):
+        result["service"] = "HTTPS" if port in TLS_PORTS else "HTTP"
+        server = re.search(rb"\r?\nServer:\s*([^\r\n]+)", data, re.I)
+        if server:
+            result["product"] = _banner_line(server.group(1))
+    elif line.startswith("220"):
+        result["service"] = "SMTP" if any(k in upper for k in ("SMTP", "MAIL", "POSTFIX", "EXIM")) else "FTP"
+        result["product"] = line[4:] or None
+    elif line.startswith("+OK"):
+        result["service"] = "POP3"
+    elif line.startswith("* OK"):
+        result["service"] = "IMAP"
+    elif line.startswith(("+PONG", "-NOAUTH", "-ERR", "-DENIED")):
+        result["service"] = "Redis"
+    elif line.startswith("RFB "):
+        result["service"] = "VNC"
+        result["product"] = line
+    elif line.startswith("AMQP"):
+        result["service"] = "AMQP"
+    return result
+
+def apply_fingerprint(port_info, fingerprint):
+    """用识别结果更新端口信息; 服务名与静态表不同时按识别结果重新标注风险"""
+    service = fingerprint.get("service")
+    if service and service != port_info["service"]:
+        known = PORT_SERVICES.get(SERVICE_PORTS.get(service))
+        if known:
+            port_info.update(service=service, risk=known[1], risk_desc=known[2])
+        elif port_info["service"].startswith("Port "):
+            port_info["service"] = service
+    for key in ("product", "banner"):
+        if fingerprint.get(key):
+            port_info[key] = fingerprint[key]
+
+# 邻居表中这些状态说明主机刚刚回应过ARP; STALE 等状态的条目可能属于早已离线的主机
+NEIGHBOR_ALIVE_STATES = {"REACHABLE", "DELAY"}
+
+# rtnetlink 邻居表查询 (RTM_GETNEIGH dump) 用到的常量, 见 linux/rtnetlink.h 和 linux/neighbour.h
+NETLINK_HEADER = struct.Struct("=IHHII")    # nlmsghdr: 长度, 类型, 标志, 序号, pid
+NETLINK_NDMSG = struct.Struct("=BBHiHBB")   # ndmsg: 地址族, 填充, 填充, 网卡, NUD状态, 标志, 类型
+NETLINK_ATTR = struct.Struct("=HH")         # rtattr: 长度, 类型
+RTM_NEWNEIGH, RTM_GETNEIGH = 28, 30
+NLMSG_ERROR, NLMSG_DONE = 2, 3
+NLM_F_REQUEST, NLM_F_DUMP = 0x1, 0x300
+NDA_DST, NDA_LLADDR = 1, 2
+NUD_STATES = {0x01: "INCOMPLETE", 0x02: "REACHABLE", 0x04: "STALE", 0x08: "DELAY", 0x10: "PROBE",
+              0x20: "FAILED", 0x40: "NOARP", 0x80: "PERMANENT"}
+
+# /proc/net/arp 的 Flags 只有 ATF_COM (已解析) 和 ATF_PERM (静态条目), 区分不出 REACHABLE 和 STALE
+ATF_COM, ATF_PERM = 0x2, 0x4
+
+def _netlink_neighbors():
+    """通过 rtnetlink 读取 IPv4 邻居表, 返回 {ip: (mac, NUD状态)}; 只发一个请求, 不启动子进程
+    
+    非 Linux 或 netlink 不可用时抛出 OSError/AttributeError
+    """
+    sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+    try:
+        sock.settimeout(2)
+        request = NETLINK_NDMSG.pack(socket.AF_INET, 0, 0, 0, 0, 0, 0)
+        sock.send(NETLINK_HEADER.pack(NETLINK_HEADER.size + len(request), RTM_GETNEIGH,
+                                      NLM_F_REQUEST | NLM_F_DUMP, 1, 0) + request)
+        return parse_netlink_neighbors(iter(lambda: sock.recv(65536), b""))
+    finally:
+        sock.close()
+
+def parse_netlink_neighbors(chunks):
+    """解析 RTM_NEWNEIGH 消息, chunks 为 recv 得到的数据块, 读到 NLMSG_DONE 为止"""
+    table = {}
+    for data in chunks:
+        offset = 0
+        while offset + NETLINK_HEADER.size <= len(data):
+            length, msg_type = NETLINK_HEADER.unpack_from(data, offset)[:2]
+            if length < NETLINK_HEADER.size:
+                raise ValueError("netlink 消息长度错误")
+            if msg_type == NLMSG_DONE:
+                return table
+            if msg_type == NLMSG_ERROR:
+                err = -struct.unpack_from("=i", data, offset + NETLINK_HEADER.size)[0]
+                if err:
+                    raise OSError(err, os.strerror(err))
+            if msg_type == RTM_NEWNEIGH:
+                body = offset + NETLINK_HEADER.size
+                family, _, _, _, state, _, _ = NETLINK_NDMSG.unpack_from(data, body)
+                ip = mac = None
+                attr = body + NETLINK_NDMSG.size
+                while attr + NETLINK_ATTR.size <= offset + length:
+                    attr_len, attr_type = NETLINK_ATTR.unpack_from(data, attr)
+                    if attr_len < NETLINK_ATTR.size:
+                        break
+                    value = data[attr + NETLINK_ATTR.size:attr + attr_len]
+                    if attr_type == NDA_DST and len(value) == 4:
+                        ip = socket.inet_ntoa(value)
+                    elif attr_type == NDA_LLADDR and len(value) == 6:
+                        mac = ":".join(f"{b:02x}" for b in value)
+                    attr += (attr_len + 3) & ~3
+                if family == socket.AF_INET and ip and mac and mac != "00:00:00:00:00:00" \
+                        and not state & 0x21:  # 跳过 INCOMPLETE/FAILED
+                    table[ip] = (mac, NUD_STATES.get(state, hex(state)))
+            offset += (length + 3) & ~3
+    return table
+
+def parse_proc_net_arp(lines):
+    """解析 /proc/net/arp, Flags 转换为状态: ATF_PERM 为 PERMANENT, 其余已解析的条目为 COMPLETE (无法判断新鲜度)"""
+    table = {}
+    for line in lines:
+        fields = line.split()
+        if len(fields) < 4 or fields[0] == "IP":
+            continue
+        ip, mac = fields[0], fields[3].lower()
+        try:
+            flags = int(fields[2], 16)
+        except ValueError:
+            continue
+        # 未完成解析的条目 MAC 全为0
+        if not flags & ATF_COM or mac == "00:00:00:00:00:00":
+            continue
+        table[ip] = (mac, "PERMANENT" if flags & ATF_PERM else "COMPLETE")
+    return table
+
+# 邻居表读不到 NUD 状态时只提示一次
+NEIGHBOR_FALLBACK_WARNED = set()
+
+def _warn_neighbor_fallback(source):
+    if source not in NEIGHBOR_FALLBACK_WARNED:
+        NEIGHBOR_FALLBACK_WARNED.add(source)
+        print(f"[邻居表] netlink 不可用, 改用 {source}: 没有邻居状态, 只有回应探测的主机才算在线")
+
+@traced("read_neighbor_table")
+def read_neighbor_table():
+    """一次性读取内核邻居表, 返回 {ip: (mac, 状态)}
+    
+    Linux 通过 rtnetlink 读取, 带 REACHABLE/STALE/DELAY 等 NUD 状态, 不启动子进程;
+    netlink 不可用时读 /proc/net/arp (状态只有 COMPLETE/PERMANENT), 其他平台退回到单次 `arp -a` (状态为 None)。
+    后两种状态都不在 NEIGHBOR_ALIVE_STATES 中, 此时邻居表只用来补充MAC, 不会把没回应的主机算作在线
+    """
+    try:
+        with trace_span("netlink"):
+            return _netlink_neighbors()
+    except (OSError, AttributeError, ValueError, struct.error):
+        pass
+    
+    try:
+        with open('/proc/net/arp', 'r') as f:
+            table = parse_proc_net_arp(f)
+        _warn_neighbor_fallback("/proc/net/arp")
+        return table
+    except OSError:
+        pass
+    
+    table = {}
+    try:
+        with trace_span("arp"):
+            result = subprocess.run(['arp', '-a'], capture_output=True, text=True, timeout=5)
+        for line in result.stdout.splitlines():
+            ip_match = re.search(r'\d{1,3}(?:\.\d{1,3}){3}', line)
+            mac_match = re.search(r'([0-9a-fA-F]{2}[-:]){5}[0-9a-fA-F]{2}', line)
+            if ip_match and mac_match:
+                table[ip_match.group(0)] = (mac_match.group(0).replace('-', ':').lower(), None)
+    except Exception:
+        pass
+    _warn_neighbor_fallback("arp -a")
+    return table
+
+class IcmpSweeper:
+    """进程内ICMP echo扫描
+    
+    一个socket发出所有echo请求, 按 (id, seq, 源地址) 匹配回包并记录每台主机的RTT。
+    优先使用无需特权的 SOCK_DGRAM ICMP (net.ipv4.ping_group_range), 否则使用原始socket (需要 NET_RAW)。
+    """
+    
+    ECHO_REQUEST = 8
+    ECHO_REPLY = 0
+    
+    def __init__(self, timeout=1.0):
+        self.timeout = timeout
+        self.sock, self.raw = self._open_socket()
+        self.ident = os.getpid() & 0xFFFF
+    
+    @staticmethod
+    def _open_socket():
+        try:
+            return socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP), False
+        except OSError:
+            return socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP), True
+    
+    @staticmethod
+    def _checksum(data):
+        if len(data) % 2:
+            data += b'\0'
+        total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+        total = (total >> 16) + (total & 0xFFFF)
+        total += total >> 16
+        return ~total & 0xFFFF
+    
+    def _packet(self, seq):
+        payload = struct.pack("!d", time.monotonic()) + b'home-port-manager'
+        header = struct.pack("!BBHHH", self.ECHO_REQUEST, 0, 0, self.ident, seq)
+        checksum = self._checksum(header + payload)
+        return struct.pack("!BBHHH", self.ECHO_REQUEST, 0, checksum, self.ident, seq) + payload
+    
+    def _parse_reply(self, data):
+        """返回 (id, seq), 非echo回复返回 None"""
+        if self.raw:
+            data = data[(data[0] & 0x0F) * 4:]
+        if len(data) < 8:
+            return None
+        icmp_type, _, _, ident, seq = struct.unpack("!BBHHH", data[:8])
+        if icmp_type != self.ECHO_REPLY:
+            return None
+        return ident, seq
+    
+    def _drain(self, pending, sent_at, alive, wait):
+        """读取已到达的回包, 最多等待 wait 秒"""
+        while True:
+            readable, _, _ = select.select([self.sock], [], [], wait)
+            if not readable:
+                return
+            wait = 0
+            try:
+                data, addr = self.sock.recvfrom(2048)
+            except OSError:
+                return
+            reply = self._parse_reply(data)
+            if reply is None:
+                continue
+            ident, seq = reply
+            # SOCK_DGRAM 下内核会改写id并只把本socket的回包交给我们
+            if self.raw and ident != self.ident:
+                continue
+            ip = pending.get(seq)
+            if ip is None or ip != addr[0]:
+                continue
+            alive[ip] = round((time.monotonic() - sent_at[seq]) * 1000, 2)
+            del pending[seq]
+    
+    def sweep(self, ips, progress_callback=None, rate=None):
+        """向 ips 中每个地址发送一个echo请求, 返回 {ip: rtt_ms}
+        
+        rate 为 RateController 时按其 limit (每秒发包数) 限速, 发送缓冲区满时自动降速
+        """
+        ips = list(ips)
+        pending = {}
+        sent_at = {}
+        alive = {}
+        job = current_job()
+        try:
+            for idx, ip in enumerate(ips):
+                job.checkpoint()
+                if rate:
+                    # 限速等待期间继续接收回包
+                    wait = rate.wait_time(min(rate.limit, rate.pps_cap or rate.limit))
+                    if wait > 0.001:
+                        self._drain(pending, sent_at, alive, wait)
+                seq = (idx + 1) & 0xFFFF
+                sent_at[seq] = time.monotonic()
+                pending[seq] = ip
+                try:
+                    self.sock.sendto(self._packet(seq), (ip, 0))
+                    if rate:
+                        rate.on_send(0)
+                except OSError as e:
+                    if rate:
+                        rate.on_send(e.errno)
+                    if e.errno == errno.ENOBUFS:
+                        # 发送缓冲区满, 先收一轮回包再重试一次
+                        self._drain(pending, sent_at, alive, 0.01)
+                        try:
+                            self.sock.sendto(self._packet(seq), (ip, 0))
+                        except OSError:
+                            pending.pop(seq, None)
+                    else:
+                        pending.pop(seq, None)
+                self._drain(pending, sent_at, alive, 0)
+                if progress_callback:
+                    progress_callback(idx + 1, len(ips))
+            
+            deadline = time.monotonic() + self.timeout
+            while pending and time.monotonic() < deadline:
+                self._drain(pending, sent_at, alive, deadline - time.monotonic())
+        finally:
+            self.sock.close()
+        return alive
+
+# 本机资源不足导致的失败: 端口并未真正探测, 需要降速并稍后重试
+LOCAL_CONGESTION_ERRNOS = {errno.EMFILE, errno.ENFILE, errno.ENOBUFS, errno.EADDRNOTAVAIL, errno.ENOMEM}
+
+RATE_STATUS = {}
+RATE_LOCK = threading.Lock()
+
+class RateController:
+    """AIMD 拥塞控制
+    
+    每完成一个窗口的探测且没有拥塞时 limit 线性增加 step; 出现本机资源错误(EMFILE/ENOBUFS/
+    EADDRNOTAVAIL等), 或在主机有响应的前提下超时比例过高时, limit 乘以 decrease。
+    limit 可以表示并发连接数, 也可以表示每秒发包数; pps_cap 为可选的每秒发包数硬上限。
+    name 为 "类型:引擎:任务ID[:主机]", 同一主机被多个任务同时扫描时状态互不覆盖。
+    """
+    
+    TIMEOUT_RATIO = 0.3
+    
+    def __init__(self, name, maximum, minimum=1, initial=None, pps_cap=0, decrease=0.5):
+        self.name = name
+        self.maximum = max(1, int(maximum))
+        self.minimum = max(1, min(int(minimum), self.maximum))
+        self.limit = initial or max(self.minimum, self.maximum // 4)
+        self.step = max(1, self.maximum // 32)
+        self.pps_cap = pps_cap
+        self.decrease = decrease
+        self.decreases = 0
+        self._batch = [0, 0, 0]  # 完成数, 有响应数, 超时数
+        self._last_decrease = 0.0
+        self._next_send = 0.0
+        self._publish()
+    
+    def on_result(self, err):
+        if err in LOCAL_CONGESTION_ERRNOS:
+            self.congestion()
+            return
+        batch = self._batch
+        batch[0] += 1
+        if err == errno.ETIMEDOUT:
+            batch[2] += 1
+        elif err in (0, errno.ECONNREFUSED):
+            batch[1] += 1
+        if batch[0] >= max(50, self.limit):
+            # 整个窗口都没有响应通常是主机过滤了端口, 而不是网络丢包, 不据此降速
+            if batch[1] and batch[2] > batch[0] * self.TIMEOUT_RATIO:
+                self.congestion()
+            else:
+                self.limit = min(self.maximum, self.limit + self.step)
+                self._publish()
+            self._batch = [0, 0, 0]
+    
+    def on_send(self, err=0):
+        """用于按发包计量的场景(ICMP): 发送成功计一次成功, 发送缓冲区满等错误触发降速"""
+        if err in LOCAL_CONGESTION_ERRNOS:
+            self.congestion()
+            return
+        self._batch[0] += 1
+        if self._batch[0] >= max(50, self.limit // 4):
+            self.limit = min(self.maximum, self.limit + self.step)
+            self._batch = [0, 0, 0]
+            self._publish()
+    
+    def congestion(self):
+        # 一个超时周期内只降一次, 避免同一批在途连接的失败被重复计入
+        now = time.monotonic()
+        if now - self._last_decrease < 0.2:
+            return
+        self._last_decrease = now
+        self.limit = max(self.minimum, int(self.limit * self.decrease))
+        self.decreases += 1
+        self._batch = [0, 0, 0]
+        self._publish()
+    
+    def wait_time(self, rate=None):
+        """按每秒发包数限速: 返回发送下一个包之前应等待的秒数"""
+        rate = rate or self.pps_cap
+        if not rate:
+            return 0
+        now = time.monotonic()
+        wait = max(0.0, self._next_send - now)
+        self._next_send = max(self._next_send, now) + 1.0 / rate
+        return wait
+    
+    def snapshot(self):
+        return {"limit": self.limit, "maximum": self.maximum, "pps_cap": self.pps_cap, "decreases": self.decreases}
+    
+    def _publish(self):
+        with RATE_LOCK:
+            RATE_STATUS[self.name] = self.snapshot()
+    
+    def close(self):
+        with RATE_LOCK:
+            RATE_STATUS.pop(self.name, None)
+            RATE_STATUS["last:" + self.name.split(":")[0]] = self.snapshot()
+
+def rate_snapshot():
+    with RATE_LOCK:
+        return {name: dict(value) for name, value in RATE_STATUS.items()}
+
+# ======== 运行指标 ========
+# 计数器和直方图按线程分片累加: 每个线程只写自己的分片, 热路径上没有锁; /metrics 抓取时合并各分片,
+# 已结束线程的分片并入 _retired 后释放
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+DURATION_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600)
+
+class Metrics:
+    """Prometheus 文本格式的计数器/直方图/仪表盘, 标签为 (("name", "value"), ...) 元组"""
+    
+    def __init__(self):
+        self._meta = {}
+        self._gauges = {}
+        self._local = threading.local()
+        self._shards = []
+        self._retired = {}
+        self._lock = threading.Lock()
+    
+    def counter(self, name, help_text):
+        self._meta[name] = ("counter", help_text, None)
+    
+    def histogram(self, name, help_text, buckets):
+        self._meta[name] = ("histogram", help_text, tuple(buckets))
+    
+    def gauge(self, name, help_text, collect=None):
+        """collect() 在抓取时调用, 返回 {labels: value}; 不提供时用 set() 设置"""
+        self._meta[name] = ("gauge", help_text, None)
+        self._gauges[name] = collect or {}
+    
+    def _shard(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+    
+    def inc(self, name, labels=(), value=1):
+        shard = self._shard()
+        key = (name, labels)
+        shard[key] = shard.get(key, 0) + value
+    
+    def observe(self, name, value, labels=()):
+        shard = self._shard()
+        key = (name, labels)
+        data = shard.get(key)
+        if data is None:
+            data = shard[key] = [[0] * (len(self._meta[name][2]) + 1), 0.0]
+        data[0][bisect.bisect_left(self._meta[name][2], value)] += 1
+        data[1] += value
+    
+    def set(self, name, value, labels=()):
+        self._gauges[name][labels] = value
+    
+    @staticmethod
+    def _merge(target, shard):
+        for key, value in shard.items():
+            if isinstance(value, list):
+                merged = target.get(key)
+                if merged is None:
+                    merged = target[key] = [[0] * len(value[0]), 0.0]
+                for index, count in enumerate(value[0]):
+                    merged[0][index] += count
+                merged[1] += value[1]
+            else:
+                target[key] = target.get(key, 0) + value
+    
+    def collect(self):
+        """合并所有分片, 返回 {(name, labels): 值}"""
+        with self._lock:
+            alive = []
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    alive.append((thread, shard))
+                else:
+                    self._merge(self._retired, shard.copy())
+            self._shards = alive
+            merged = {}
+            self._merge(merged, self._retired)
+            for _, shard in alive:
+                self._merge(merged, shard.copy())
+        return merged
+    
+    @staticmethod
+    def _labels(labels, extra=()):
+        labels = tuple(labels) + tuple(extra)
+        if not labels:
+            return ""
+        return "{" + ",".join(f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+                              for k, v in labels) + "}"
+    
+    def render(self):
+        values = self.collect()
+        by_name = {}
+        for (name, labels), value in values.items():
+            by_name.setdefault(name, []).append((labels, value))
+        lines = []
+        for name, (kind, help_text, buckets) in self._meta.items():
+            if kind == "gauge":
+                source = self._gauges[name]
+                try:
+                    samples = list((source() if callable(source) else dict(source)).items())
+                except Exception as e:
+                    print(f"[指标] {name} 采集失败: {e}")
+                    continue
+            else:
+                samples = by_name.get(name, [])
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in sorted(samples, key=lambda s: s[0]):
+                if kind != "histogram":
+                    lines.append(f"{name}{self._labels(labels)} {value}")
+                    continue
+                counts, total = value
+                cumulative = 0
+                for bound, count in zip(buckets + ("+Inf",), counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{self._labels(labels, (('le', bound),))} {cumulative}")
+                lines.append(f"{name}_sum{self._labels(labels)} {round(total, 6)}")
+                lines.append(f"{name}_count{self._labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+METRICS = Metrics()
+METRICS.counter("hpm_probes_total", "端口探测数, 按结果分类 (open/closed/timeout/local_error/error)")
+METRICS.counter("hpm_host_probes_total", "设备发现的主机探测数, 按方式和结果分类")
+METRICS.histogram("hpm_connect_latency_seconds", "TCP connect 收到SYN-ACK或RST的耗时", LATENCY_BUCKETS)
+METRICS.histogram("hpm_ping_latency_seconds", "设备发现的ICMP/TCP探测RTT", LATENCY_BUCKETS)
+METRICS.histogram("hpm_scan_duration_seconds", "扫描耗时, 按类型 (ports/ping/discovery/incremental)",
+                  DURATION_BUCKETS)
+METRICS.counter("hpm_scans_total", "完成的扫描数, 按类型")
+METRICS.gauge("hpm_scan_ports_per_second", "最近一次端口扫描每秒探测的端口数")
+
+# 探测结果对应的标签, 预先生成避免热路径上创建元组
+PROBE_LABELS = {0: (("result", "open"),), errno.ECONNREFUSED: (("result", "closed"),),
+                errno.ETIMEDOUT: (("result", "timeout"),)}
+PROBE_LABELS.update((err, (("result", "local_error"),)) for err in LOCAL_CONGESTION_ERRNOS)
+PROBE_ERROR_LABELS = (("result", "error"),)
+SCAN_KIND_LABELS = {kind: (("kind", kind),) for kind in ("ports", "ping", "discovery", "incremental")}
+
+def record_scan(kind, started):
+    """记录一次完成的扫描, started 为 time.monotonic() 开始时间"""
+    METRICS.observe("hpm_scan_duration_seconds", time.monotonic() - started, SCAN_KIND_LABELS[kind])
+    METRICS.inc("hpm_scans_total", SCAN_KIND_LABELS[kind])
+
+def _open_fds():
+    try:
+        return {(): len(os.listdir('/proc/self/fd'))}
+    except OSError:
+        return {}
+
+def _job_states():
+    counts = {}
+    for job in JOBS.jobs():
+        counts[(("state", job.state),)] = counts.get((("state", job.state),), 0) + 1
+    return counts
+
+def _active_hosts():
+    return {(): sum(len(job.status_snapshot().get("active_hosts") or []) for job in JOBS.active())}
+
+METRICS.gauge("hpm_job_queue_depth", "排队中的扫描任务数", lambda: {(): len(JOBS._queue)})
+METRICS.gauge("hpm_jobs", "扫描任务数, 按状态", _job_states)
+METRICS.gauge("hpm_active_hosts", "正在扫描端口的主机数", _active_hosts)
+def _concurrency_limits():
+    """按控制器类型和引擎汇总 (名称为 类型:引擎:任务[:主机]), 不为每个任务/每台主机生成一条时间序列"""
+    totals = {}
+    for name, value in rate_snapshot().items():
+        if name.startswith("last:"):
+            continue
+        kind, engine = (name.split(":") + [""])[:2]
+        labels = (("controller", kind), ("engine", engine))
+        totals[labels] = totals.get(labels, 0) + value["limit"]
+    return totals
+
+METRICS.gauge("hpm_concurrency_limit", "拥塞控制器当前的并发/发包速率上限之和, 按类型和引擎", _concurrency_limits)
+METRICS.gauge("hpm_threads", "进程线程数", lambda: {(): threading.active_count()})
+METRICS.gauge("hpm_open_fds", "进程打开的文件描述符数", _open_fds)
+METRICS.gauge("hpm_startup_seconds", "启动各阶段耗时",
+              lambda: {(("phase", name),): round(ms / 1000, 4) for name, ms in STARTUP_PHASES})
+
+class PortWorker:
+    """多进程引擎的一个常驻工作进程 (见 port_worker_main), 读线程把 stdout 数据转给当前任务的队列"""
+
+    def __init__(self):
+        self.proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--port-worker"],
+                                     stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self.sink = None
+        self._lock = threading.Lock()
+        threading.Thread(target=self._read, daemon=True, name="port-worker-reader").start()
+
+    def _read(self):
+        fd = self.proc.stdout.fileno()
+        while True:
+            try:
+                data = os.read(fd, 65536)
+            except OSError:
+                data = b""
+            if self.sink is not None:
+                self.sink.put((self, data))
+            if not data:
+                return
+
+    def alive(self):
+        return self.proc.poll() is None
+
+    def start(self, sink, task):
+        self.sink = sink
+        return self.send(json.dumps(task))
+
+    def send(self, command):
+        """发送一行命令, 可以在取消回调等其他线程中调用"""
+        try:
+            with self._lock:
+                self.proc.stdin.write(command.encode() + b"\n")
+                self.proc.stdin.flush()
+            return True
+        except (OSError, ValueError):
+            return False
+
+    def kill(self):
+        try:
+            self.proc.kill()
+            self.proc.wait(timeout=5)
+        except Exception:
+            pass
+
+class PortWorkerPool:
+    """工作进程按需启动, 扫描结束后放回复用; 同时扫描的主机平分 PROCESS_ENGINE["workers"] 个进程"""
+
+    def __init__(self):
+        self._idle = []
+        self._started = 0
+        self._users = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, wanted):
+        """取出最多 wanted 个进程 (至少一个), 空闲的不够时启动新进程, 全部在用时等待"""
+        job = current_job()
+        with self._cond:
+            self._users += 1
+        try:
+            while True:
+                with self._cond:
+                    size = max(1, PROCESS_ENGINE["workers"])
+                    for worker in [w for w in self._idle if not w.alive()]:
+                        self._idle.remove(worker)
+                        self._started -= 1
+                    share = max(1, min(wanted, size // self._users))
+                    taken = self._idle[:share]
+                    del self._idle[:len(taken)]
+                    spawn = max(0, min(share - len(taken), size - self._started))
+                    self._started += spawn
+                    if taken or spawn:
+                        break
+                    self._cond.wait(0.5)
+                job.checkpoint()
+            for index in range(spawn):
+                try:
+                    taken.append(PortWorker())
+                except OSError as e:
+                    with self._cond:
+                        self._started -= spawn - index
+                    if not taken:
+                        raise
+                    print(f"[扫描] 无法启动扫描进程: {e}")
+                    break
+            return taken
+        except BaseException:
+            with self._cond:
+                self._users -= 1
+            raise
+
+    def release(self, workers, broken=()):
+        """归还进程; broken 中的进程 (任务未正常结束) 直接结束"""
+        with self._cond:
+            self._users -= 1
+            for worker in workers:
+                worker.sink = None
+                if worker in broken or not worker.alive():
+                    worker.kill()
+                    self._started -= 1
+                else:
+                    self._idle.append(worker)
+            self._cond.notify_all()
+
+    def count(self):
+        return self._started
+
+PORT_WORKERS = PortWorkerPool()
+METRICS.gauge("hpm_port_worker_processes", "多进程引擎已启动的工作进程数", lambda: {(): PORT_WORKERS.count()})
+
+class HostRttTracker:
+    """记录每台主机的RTT样本(来自ICMP/TCP探测和端口连接), 计算自适应超时"""
+    
+    def __init__(self, max_samples=64):
+        self.max_samples = max_samples
+        self._samples = {}
+        # 每台主机累计记录的样本序号; deque 满了以后 len() 不再变化, 缓存必须按序号失效
+        self._seq = {}
+        self._cached = {}
+        self._lock = threading.Lock()
+    
+    def record(self, ip, rtt):
+        with self._lock:
+            samples = self._samples.get(ip)
+            if samples is None:
+                samples = self._samples[ip] = deque(maxlen=self.max_samples)
+            samples.append(rtt)
+            self._seq[ip] = self._seq.get(ip, 0) + 1
+    
+    def timeout_for(self, ip, default):
+        if not ADAPTIVE_TIMEOUT["enabled"]:
+            return default
+        samples = self._samples.get(ip)
+        if not samples or len(samples) < ADAPTIVE_TIMEOUT["min_samples"]:
+            return default
+        # 每新增8个样本重新计算一次分位数
+        seq = self._seq.get(ip, 0)
+        cached = self._cached.get(ip)
+        if cached and seq - cached[0] < 8:
+            return cached[1]
+        with self._lock:
+            seq = self._seq.get(ip, 0)
+            ordered = sorted(samples)
+        rank = min(len(ordered) - 1, int(len(ordered) * ADAPTIVE_TIMEOUT["percentile"] / 100))
+        timeout = ordered[rank] * ADAPTIVE_TIMEOUT["multiplier"]
+        timeout = min(ADAPTIVE_TIMEOUT["max"], max(ADAPTIVE_TIMEOUT["min"], timeout))
+        self._cached[ip] = (seq, timeout)
+        return timeout
+    
+    def stats(self, ip):
+        samples = self._samples.get(ip)
+        if not samples:
+            return None
+        with self._lock:
+            ordered = sorted(samples)
+        return {"samples": len(ordered), "p50_ms": round(ordered[len(ordered) // 2] * 1000, 2),
+                "max_ms": round(ordered[-1] * 1000, 2)}
+
+class HomeNetworkScanner:
+    def __init__(self):
+        self.speed_mode = "fast"
+        self.engine = "async"
+        self.ping_engine = os.environ.get("HPM_PING_ENGINE", "icmp")
+        self.discovery_mode = os.environ.get("HPM_DISCOVERY_MODE", "both")
+        self.probe_ports = list(DISCOVERY_PROBE["ports"])
+        self.fingerprint_enabled = FINGERPRINT["enabled"]
+        # 设备发现时测得的RTT(毫秒)
+        self.host_rtt = {}
+        self.rtt = HostRttTracker()
+        # 加载自定义网段配置; 本机IP/网关/网段在首次使用时检测 (或由 detect_network_async 提前在后台检测)
+        self.custom_network = self._load_custom_network()
+        self._network_info = None
+        self._network_lock = threading.Lock()
+    
+    def _detected(self, key, refresh=False):
+        with self._network_lock:
+            if self._network_info is None or refresh:
+                start = time.perf_counter()
+                local_ip = self._get_local_ip()
+                self._network_info = {"local_ip": local_ip, "gateway": self._get_gateway(),
+                                      "network": self._get_network(local_ip)}
+                print(f"[网络] 本机 {local_ip}, 网段 {self._network_info['network']}, "
+                      f"网关 {self._network_info['gateway']} ({(time.perf_counter() - start) * 1000:.1f}ms)")
+            return self._network_info[key]
+    
+    def detect_network_async(self):
+        """在后台线程中检测网络, 不阻塞启动"""
+        threading.Thread(target=self._detected, args=("network",), daemon=True).start()
+    
+    @property
+    def local_ip(self):
+        return self._detected("local_ip")
+    
+    @property
+    def gateway(self):
+        return self._detected("gateway")
+    
+    @property
+    def network(self):
+        return self.custom_network or self._detected("network")
+    
+    def _load_custom_network(self):
+        """加载用户自定义网段配置"""
+        config_file = os.path.join(DATA_DIR, 'network_config.json')
         if os.path.exists(config_file):
             try:
                 with open(config_file, 'r', encoding='utf-8') as f:
@@ -187,12 +2570,11 @@ class HomeNetworkScanner:
     
     def save_custom_network(self, network):
         """保存用户自定义网段配置"""
-        config_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'network_config.json')
+        config_file = os.path.join(DATA_DIR, 'network_config.json')
         try:
             with open(config_file, 'w', encoding='utf-8') as f:
                 json.dump({'network': network}, f, ensure_ascii=False, indent=2)
             self.custom_network = network
-            self.network = network
             return True
         except Exception as e:
             print(f"[错误] 保存网段配置失败: {e}")
@@ -200,14 +2582,14 @@ class HomeNetworkScanner:
     
     def reset_network(self):
         """重置为自动检测网段"""
-        config_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'network_config.json')
+        config_file = os.path.join(DATA_DIR, 'network_config.json')
         if os.path.exists(config_file):
             try:
                 os.remove(config_file)
             except:
                 pass
         self.custom_network = None
-        self.network = self._get_network()
+        self._detected("network", refresh=True)
         return True
         
     def set_speed_mode(self, mode):
@@ -218,15 +2600,46 @@ class HomeNetworkScanner:
             return True
         return False
     
+    def set_engine(self, engine):
+        if engine in SCAN_ENGINES:
+            self.engine = engine
+            print(f"[扫描] 扫描引擎: {SCAN_ENGINES[engine]['name']}")
+            return True
+        return False
+    
+    def set_ping_engine(self, engine):
+        if engine in PING_ENGINES:
+            self.ping_engine = engine
+            print(f"[扫描] 设备发现引擎: {PING_ENGINES[engine]['name']}")
+            return True
+        return False
+    
+    def set_discovery_mode(self, mode):
+        if mode in DISCOVERY_MODES:
+            self.discovery_mode = mode
+            print(f"[扫描] 设备发现方式: {DISCOVERY_MODES[mode]['name']}")
+            return True
+        return False
+    
     def _get_local_ip(self):
+        """默认路由所在网卡的IP (UDP connect 不发包); 没有默认路由时取第一个非回环网卡的IP"""
         try:
             s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            s.connect(("8.8.8.8", 80))
-            ip = s.getsockname()[0]
-            s.close()
-            return ip
-        except:
-            return "127.0.0.1"
+            try:
+                s.connect(("8.8.8.8", 80))
+                return s.getsockname()[0]
+            finally:
+                s.close()
+        except OSError:
+            pass
+        try:
+            for iface in netifaces.interfaces():
+                for addr in netifaces.ifaddresses(iface).get(netifaces.AF_INET, []):
+                    if addr.get('addr') and not addr['addr'].startswith('127.'):
+                        return addr['addr']
+        except Exception:
+            pass
+        return "127.0.0.1"
     
     def _get_gateway(self):
         try:
@@ -235,21 +2648,43 @@ class HomeNetworkScanner:
         except:
             return "192.168.1.1"
     
-    def _get_network(self):
-        ip = self._get_local_ip()
-        parts = ip.split('.')
-        return f"{parts[0]}.{parts[1]}.{parts[2]}.0/24"
+    def _get_network(self, ip=None):
+        """按本机网卡的实际掩码计算网段, 超过 /22 时只取本机所在的 /22"""
+        ip = ip or self._get_local_ip()
+        prefix = 24
+        try:
+            for iface in netifaces.interfaces():
+                for addr in netifaces.ifaddresses(iface).get(netifaces.AF_INET, []):
+                    if addr.get('addr') == ip and addr.get('netmask'):
+                        prefix = ipaddress.IPv4Network(f"0.0.0.0/{addr['netmask']}").prefixlen
+        except:
+            pass
+        prefix = max(prefix, AUTO_NETWORK_MIN_PREFIX) if prefix < 31 else 24
+        return str(ipaddress.IPv4Network(f"{ip}/{prefix}", strict=False))
     
     def _tcp_check(self, ip, port, timeout=1.0):
+        return self._tcp_connect(ip, port, timeout) == 0
+    
+    def _tcp_connect(self, ip, port, timeout=1.0):
+        """阻塞connect, 返回 errno (0 = 开放), 收到SYN-ACK或RST时记录RTT"""
         sock = None
         try:
             sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             sock.settimeout(timeout)
+            start = time.monotonic()
             result = sock.connect_ex((ip, port))
+            if result in (0, errno.ECONNREFUSED):
+                rtt = time.monotonic() - start
+                self.rtt.record(ip, rtt)
+                METRICS.observe("hpm_connect_latency_seconds", rtt)
+            elif result in (errno.EAGAIN, errno.EWOULDBLOCK):
+                result = errno.ETIMEDOUT
             sock.close()
-            return result == 0
+            return result
+        except OSError as e:
+            return e.errno or errno.EIO
         except:
-            return False
+            return errno.EIO
         finally:
             if sock:
                 try:
@@ -257,177 +2692,1462 @@ class HomeNetworkScanner:
                 except:
                     pass
     
-    def scan_ports(self, ip, ports=None, progress_callback=None, found_callback=None, fast_mode=False):
-        import concurrent.futures
-        
-        if ports is None:
-            if fast_mode:
-                ports = COMMON_PORTS.copy()
-            else:
-                ports = list(range(1, 65536))
-        
-        config = SCAN_SPEED.get(self.speed_mode, SCAN_SPEED["standard"])
-        workers = config["port_workers"]
-        timeout = config["timeout"]
-        
-        open_ports = []
-        total = len(ports)
-        scanned = [0]
+    async def _async_connect(self, loop, ip, port, timeout=1.0):
+        """非阻塞connect: 直接挂在事件循环的可写回调上, 不为每个端口创建Task
+        
+        返回 errno: 0 = 端口开放, ECONNREFUSED = 收到RST, ETIMEDOUT = 超时
+        """
+        try:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        except OSError as e:
+            return e.errno or errno.EIO
+        try:
+            sock.setblocking(False)
+            start = loop.time()
+            err = sock.connect_ex((ip, port))
+            if err in (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EAGAIN):
+                fd = sock.fileno()
+                waiter = loop.create_future()
+                
+                def on_writable():
+                    if not waiter.done():
+                        waiter.set_result(sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR))
+                
+                def on_timeout():
+                    if not waiter.done():
+                        waiter.set_result(errno.ETIMEDOUT)
+                
+                loop.add_writer(fd, on_writable)
+                timer = loop.call_later(timeout, on_timeout)
+                try:
+                    err = await waiter
+                finally:
+                    timer.cancel()
+                    loop.remove_writer(fd)
+            if err in (0, errno.ECONNREFUSED):
+                rtt = loop.time() - start
+                self.rtt.record(ip, rtt)
+                METRICS.observe("hpm_connect_latency_seconds", rtt)
+            return err
+        except OSError as e:
+            return e.errno or errno.EIO
+        finally:
+            sock.close()
+    
+    def _max_sockets(self, wanted):
+        """按文件描述符上限限制并发连接数, 必要时尝试提高软限制"""
+        try:
+            import resource
+            soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+            if soft != resource.RLIM_INFINITY and soft < wanted + 256:
+                target = wanted + 256 if hard == resource.RLIM_INFINITY else min(hard, wanted + 256)
+                if target > soft:
+                    resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+                    soft = target
+            if soft == resource.RLIM_INFINITY:
+                return wanted
+            return max(1, min(wanted, soft - 256))
+        except Exception:
+            return wanted
+    
+    def _scan_ports_thread(self, ip, ports, get_timeout, rate, on_result):
+        """线程池 + 在途窗口: 端口从迭代器按需取出, 在途连接数不超过 rate.limit, 内存不随端口范围增长"""
+        import concurrent.futures
+        
+        port_iter = iter(ports)
+        pending = {}
+        job = current_job()
+        
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=rate.maximum)
+        try:
+            while True:
+                # 暂停时不再投递新端口, 在途的连接照常完成; 在途连接全部结束后阻塞在任务事件上, 不占用线程
+                if not pending:
+                    job.checkpoint()
+                if not job.waiting() and len(pending) < rate.limit:
+                    for port in port_iter:
+                        wait = rate.wait_time()
+                        if wait > 0.001:
+                            time.sleep(wait)
+                        pending[executor.submit(self._tcp_connect, ip, port, get_timeout())] = port
+                        if len(pending) >= rate.limit:
+                            break
+                if not pending:
+                    if job.waiting():
+                        continue
+                    break
+                
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    on_result(pending.pop(future), future.result())
+                if job.cancelled:
+                    raise ScanCancelled()
+        finally:
+            # 取消时不等待在途的阻塞connect, 它们会在超时内自行结束并关闭socket
+            executor.shutdown(wait=not job.cancelled, cancel_futures=True)
+    
+    def _scan_ports_async(self, ip, ports, get_timeout, rate, on_result):
+        """单线程事件循环: 所有连接都是非阻塞socket, 在途connect数由 rate.limit 控制"""
+        
+        job = current_job()
+        
+        async def run():
+            loop = asyncio.get_running_loop()
+            port_iter = iter(ports)
+            inflight = [0]
+            waiters = deque()
+            
+            def wake():
+                while waiters and inflight[0] < rate.limit:
+                    waiter = waiters.popleft()
+                    if not waiter.done():
+                        waiter.set_result(None)
+                        inflight[0] += 1
+            
+            # rate.maximum 个协程共享同一个端口迭代器, 同时只有 rate.limit 个在发起连接, 其余在 waiters 中排队
+            async def worker():
+                for port in port_iter:
+                    await job.acheckpoint()
+                    if inflight[0] >= rate.limit:
+                        waiter = loop.create_future()
+                        waiters.append(waiter)
+                        await waiter
+                    else:
+                        inflight[0] += 1
+                    wait = rate.wait_time()
+                    if wait > 0.001:
+                        await asyncio.sleep(wait)
+                    try:
+                        err = await self._async_connect(loop, ip, port, get_timeout())
+                    finally:
+                        inflight[0] -= 1
+                    on_result(port, err)
+                    wake()
+            
+            await asyncio.gather(*(worker() for _ in range(rate.maximum)))
+        
+        run_cancellable(run)
+    
+    def _scan_ports_process(self, ip, ports, get_timeout, rate, on_result):
+        """多进程: 端口交错分给若干工作进程 (各进程仍按排名顺序扫描), 每个进程独立做非阻塞connect,
+        结果经管道流回; on_result 仍在当前线程按到达顺序调用, 在途窗口 rate.limit 平分给各进程
+        """
+        import array
+        import base64
+        
+        job = current_job()
+        job.checkpoint()
+        ports = array.array("H", ports)
+        if not ports:
+            return
+        wanted = max(1, min(PROCESS_ENGINE["workers"], len(ports) // PROCESS_ENGINE["min_ports"]))
+        workers = PORT_WORKERS.acquire(wanted)
+        count = len(workers)
+        sink = queue.Queue()
+        buffers = {worker: bytearray() for worker in workers}
+        running = set()
+        size = PORT_WORKER_RECORD.size
+        
+        def broadcast(command):
+            for worker in list(running):
+                worker.send(command)
+        
+        unregister = job.on_cancel(lambda: broadcast("stop"))
+        try:
+            task = {"ip": ip, "timeout": get_timeout(), "window": max(1, rate.limit // count),
+                    "pps": rate.pps_cap / count if rate.pps_cap else 0}
+            for index, worker in enumerate(workers):
+                running.add(worker)
+                task["ports"] = base64.b64encode(ports[index::count].tobytes()).decode()
+                if not worker.start(sink, task):
+                    raise RuntimeError("无法向扫描进程发送任务")
+            if job.cancelled:
+                broadcast("stop")
+            
+            limit, paused = rate.limit, False
+            while running:
+                # 暂停时各进程不再发起新连接, 在途的照常完成; 并发上限变化时同步给各进程
+                if job.waiting() != paused and not job.cancelled:
+                    paused = not paused
+                    broadcast("pause" if paused else "resume")
+                if rate.limit != limit:
+                    limit = rate.limit
+                    broadcast(f"window {max(1, limit // count)}")
+                try:
+                    worker, data = sink.get(timeout=0.2)
+                except queue.Empty:
+                    continue
+                if not data:
+                    raise RuntimeError(f"扫描进程异常退出 (退出码: {worker.proc.poll()})")
+                buffer = buffers[worker]
+                buffer += data
+                end = len(buffer) - len(buffer) % size
+                for port, err, rtt_us in PORT_WORKER_RECORD.iter_unpack(bytes(buffer[:end])):
+                    if port == 0:
+                        running.discard(worker)
+                        continue
+                    if rtt_us:
+                        self.rtt.record(ip, rtt_us / 1e6)
+                        METRICS.observe("hpm_connect_latency_seconds", rtt_us / 1e6)
+                    on_result(port, err)
+                del buffer[:end]
+            if job.cancelled:
+                raise ScanCancelled()
+        finally:
+            unregister()
+            # 任务未正常结束的进程可能还在扫描, 直接结束而不放回池中
+            PORT_WORKERS.release(workers, broken=running)
+    
+    def _speed_config(self):
+        """当前速度模式的参数; 后台 (定时) 任务按 BACKGROUND_SCAN 降低并发和发包速率"""
+        config = SCAN_SPEED.get(self.speed_mode, SCAN_SPEED["standard"])
+        if not current_job().background:
+            return config
+        config = dict(config)
+        for key in ("ping_workers", "port_workers", "async_workers", "per_host_limit", "host_workers"):
+            config[key] = max(1, int(config[key] * BACKGROUND_SCAN["concurrency_factor"]))
+        for key in ("pps", "ping_pps"):
+            config[key] = min(config[key], BACKGROUND_SCAN[key]) if config[key] else BACKGROUND_SCAN[key]
+        return config
+    
+    def host_concurrency(self, engine, active_hosts):
+        """总并发预算平均分给同时扫描的主机, 且单台主机不超过 per_host_limit"""
+        config = self._speed_config()
+        budget = config["async_workers"] if engine in ("async", "process") else config["port_workers"]
+        return max(1, min(config["per_host_limit"], budget // max(1, active_hosts)))
+    
+    @traced("scan_ports", lambda self, ip, ports=None, *args, **kwargs: {"ip": ip})
+    def scan_ports(self, ip, ports=None, progress_callback=None, found_callback=None, fast_mode=False, engine=None,
+                   workers=None, checkpoint=None, skip_chunks=()):
+        """扫描单台主机的端口
+        
+        给出 checkpoint 时端口按 CHECKPOINT_CHUNK_SIZE 分块扫描, 每块完成后调用
+        checkpoint(index, count, open_ports_in_chunk); skip_chunks 中的 (index, count) 块直接跳过
+        """
+        if ports is None:
+            ports = COMMON_PORTS if fast_mode else ALL_PORTS
+        elif isinstance(ports, str):
+            ports = parse_ports(ports)
+        
+        engine = engine or self.engine
+        config = self._speed_config()
+        
+        # 超时随该主机已观测到的RTT变化, 没有样本时使用速度模式的固定超时
+        def get_timeout():
+            return self.rtt.timeout_for(ip, config["timeout"])
+        
+        open_ports = []
+        total = len(ports)
+        scanned = [0]
+        started = time.monotonic()
+        # 超时的端口留待重试; 数量过多(主机整体丢包/过滤)时不重试, 也不再继续记录
+        retry_limit = max(ADAPTIVE_TIMEOUT["retry_limit"], int(total * ADAPTIVE_TIMEOUT["retry_ratio"]))
+        timed_out = []
+        # 给出 checkpoint 时记录每块的开放端口和超时端口所在的块, 超时重试发现的端口补记到所在块
+        chunk_results = {}
+        chunk_of = {}
+        current_chunk = [(0, 1)]
+        
+        print(f"[扫描] {ip} 的 {total} 个端口 (引擎: {SCAN_ENGINES.get(engine, SCAN_ENGINES['thread'])['name']}, "
+              f"超时: {get_timeout() * 1000:.0f}ms)...")
+        
+        def record_open(port):
+            service = port_service(port)
+            result = {
+                "port": port,
+                "service": service[0],
+                "risk": service[1],
+                "risk_desc": service[2],
+            }
+            open_ports.append(result)
+            if found_callback:
+                found_callback(result)
+            print(f"  [开放] {result['port']} - {result['service']}")
+        
+        deferred = []
+        
+        def on_result(port, err):
+            rate.on_result(err)
+            METRICS.inc("hpm_probes_total", PROBE_LABELS.get(err, PROBE_ERROR_LABELS))
+            if err == 0:
+                record_open(port)
+            elif err in LOCAL_CONGESTION_ERRNOS:
+                # 本机资源不足, 端口并未真正探测, 稍后重新扫描
+                deferred.append(port)
+                return
+            elif err == errno.ETIMEDOUT and len(timed_out) <= retry_limit:
+                timed_out.append(port)
+                if checkpoint:
+                    chunk_of[port] = current_chunk[0]
+            
+            scanned[0] += 1
+            # 更新进度更频繁 - 每50个端口或每1%更新一次
+            if progress_callback and (scanned[0] % 50 == 0 or scanned[0] % max(1, total // 100) == 0):
+                progress_callback(scanned[0], total)
+        
+        def on_retry_result(port, err):
+            rate.on_result(err)
+            METRICS.inc("hpm_probes_total", PROBE_LABELS.get(err, PROBE_ERROR_LABELS))
+            if err == 0:
+                record_open(port)
+            elif err in LOCAL_CONGESTION_ERRNOS:
+                deferred.append(port)
+        
+        if workers is None:
+            workers = self.host_concurrency(engine, 1)
+        workers = max(1, min(workers, total))
+        if engine == "async":
+            run_engine = self._scan_ports_async
+            workers = self._max_sockets(workers)
+        elif engine == "process":
+            run_engine = self._scan_ports_process
+        else:
+            run_engine = self._scan_ports_thread
+        rate = RateController(f"ports:{engine}:{current_job().id}:{ip}", maximum=workers, pps_cap=config.get("pps", 0))
+        if checkpoint:
+            count = max(1, -(-total // CHECKPOINT_CHUNK_SIZE))
+            chunks = [(index, count, PortSlice(ports, index, count)) for index in range(count)]
+        else:
+            chunks = [(0, 1, ports)]
+        try:
+            for index, count, chunk in chunks:
+                if (index, count) in skip_chunks:
+                    scanned[0] += len(chunk)
+                    continue
+                chunk_start = len(open_ports)
+                current_chunk[0] = (index, count)
+                with trace_span("ports_chunk", ip=ip, index=index, count=count, ports=len(chunk)):
+                    run_engine(ip, chunk, get_timeout, rate, on_result)
+                
+                # 因本机资源不足未能探测的端口, 降速后重新扫描
+                for _ in range(3):
+                    if not deferred:
+                        break
+                    retry_ports, deferred[:] = list(deferred), []
+                    print(f"[扫描] {ip} 重新扫描 {len(retry_ports)} 个因资源不足未完成的端口 (并发: {rate.limit})")
+                    run_engine(ip, retry_ports, get_timeout, rate, on_result)
+                
+                if checkpoint:
+                    chunk_results[(index, count)] = open_ports[chunk_start:]
+                    checkpoint(index, count, chunk_results[(index, count)])
+            
+            if timed_out and len(timed_out) <= retry_limit:
+                retry_timeout = min(ADAPTIVE_TIMEOUT["max"], get_timeout() * ADAPTIVE_TIMEOUT["retry_multiplier"])
+                print(f"[扫描] {ip} 重试 {len(timed_out)} 个超时端口 (超时: {retry_timeout * 1000:.0f}ms)")
+                retry_start = len(open_ports)
+                with trace_span("retry_timeouts", ip=ip, ports=len(timed_out)):
+                    run_engine(ip, timed_out, lambda: retry_timeout, rate, on_retry_result)
+                if checkpoint:
+                    # 所在块已经记录过, 重新记录包含重试结果的完整块, 中断后继续扫描时不会丢失这些端口
+                    updated = set()
+                    for result in open_ports[retry_start:]:
+                        key = chunk_of[result["port"]]
+                        chunk_results[key].append(result)
+                        updated.add(key)
+                    for index, count in sorted(updated):
+                        checkpoint(index, count, chunk_results[(index, count)])
+        finally:
+            rate.close()
+        
+        # 确保最后100%进度被报告
+        if progress_callback:
+            progress_callback(total, total)
+        
+        open_ports.sort(key=lambda x: x['port'])
+        print(f"[完成] 发现 {len(open_ports)} 个开放端口")
+        record_scan("ports", started)
+        METRICS.set("hpm_scan_ports_per_second", round(total / max(1e-6, time.monotonic() - started), 1))
+        return open_ports
+    
+    async def _exchange(self, ip, port, payload=None, wait_greeting=True):
+        """建立一次连接: 先等待服务端的欢迎信息, 没有时发送 payload, 返回读到的数据 (最多 max_bytes)"""
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), FINGERPRINT["connect_timeout"])
+        except (OSError, asyncio.TimeoutError):
+            return None
+        
+        async def read(timeout):
+            try:
+                return await asyncio.wait_for(reader.read(FINGERPRINT["max_bytes"]), timeout)
+            except (OSError, asyncio.TimeoutError):
+                return b""
+        
+        try:
+            data = await read(FINGERPRINT["greeting_timeout"]) if wait_greeting else b""
+            if not data and payload:
+                writer.write(payload)
+                data = await read(FINGERPRINT["read_timeout"])
+            return data
+        finally:
+            writer.close()
+    
+    async def _probe_service(self, ip, port):
+        """识别单个端口的服务: TLS端口先发 ClientHello, Redis 端口发 PING, 其他端口读欢迎信息后发 HTTP HEAD;
+        都无法识别时再试一次 TLS
+        """
+        http_head = f"HEAD / HTTP/1.0\r\nHost: {ip}\r\nUser-Agent: HomePortManager\r\n\r\n".encode()
+        if port in TLS_PORTS:
+            probes = [("tls", _tls_client_hello(), False), ("http", http_head, True)]
+        elif port == 6379:
+            probes = [("redis", b"PING\r\n", True)]
+        else:
+            probes = [("http", http_head, True), ("tls", _tls_client_hello(), False)]
+        
+        fallback = None
+        for probe, payload, wait_greeting in probes:
+            data = await self._exchange(ip, port, payload, wait_greeting)
+            if data is None:
+                break  # 连接失败, 端口可能已关闭
+            result = classify_banner(data, port)
+            result["probe"] = probe
+            if result["service"]:
+                return result
+            fallback = fallback or (result if result["banner"] else None)
+        return fallback or {"service": None, "product": None, "banner": None, "probe": None}
+    
+    @traced("fingerprint", lambda self, devices: {"devices": len(devices)})
+    def fingerprint_devices(self, devices):
+        """端口扫描后的服务识别阶段, 直接更新 devices 中的端口信息
+        
+        (ip, port, MAC) 在 FINGERPRINT["ttl"] 内识别过的端口使用缓存, 其余端口并发探测,
+        总并发不超过 workers, 单台设备不超过 per_host
+        """
+        if not self.fingerprint_enabled:
+            return
+        todo = []
+        for device in devices:
+            cached = STORE.fresh_fingerprints(device["ip"], device.get("mac"), FINGERPRINT["ttl"])
+            for port_info in device["ports"]:
+                if port_info["port"] in cached:
+                    apply_fingerprint(port_info, cached[port_info["port"]])
+                else:
+                    todo.append((device, port_info))
+        if not todo:
+            return
+        
+        update_status(phase="识别服务")
+        print(f"[服务识别] {len(todo)} 个端口 (缓存命中 {sum(len(d['ports']) for d in devices) - len(todo)} 个)")
+        results = {}
+        
+        async def run():
+            limit = asyncio.Semaphore(FINGERPRINT["workers"])
+            host_limits = {}
+            
+            async def probe(device, port_info):
+                host_limit = host_limits.setdefault(device["ip"], asyncio.Semaphore(FINGERPRINT["per_host"]))
+                async with limit, host_limit:
+                    fingerprint = await self._probe_service(device["ip"], port_info["port"])
+                apply_fingerprint(port_info, fingerprint)
+                results.setdefault((device["ip"], device.get("mac")), {})[port_info["port"]] = fingerprint
+                if fingerprint["service"] or fingerprint["banner"]:
+                    stream_port_service(device["ip"], port_info)
+            
+            await asyncio.gather(*(probe(device, port_info) for device, port_info in todo))
+        
+        try:
+            run_cancellable(run)
+        finally:
+            for (ip, mac), fingerprints in results.items():
+                STORE.save_fingerprints(ip, mac, fingerprints)
+    
+    def _new_ping_rate(self):
+        """ICMP 发包速率控制器, 由调用方持有并跨分片保持; 每次设备发现各用一个, 同时运行的任务互不影响"""
+        config = self._speed_config()
+        return RateController(f"ping:icmp:{current_job().id}", maximum=config["ping_pps"] or 20000, minimum=50,
+                              pps_cap=config["ping_pps"])
+    
+    @traced("icmp_sweep", lambda self, ips, *args, **kwargs: {"hosts": len(ips)})
+    def _icmp_sweep(self, ips, timeout, progress_callback=None, rate=None):
+        """进程内ICMP扫描, 无法创建ICMP socket时返回 None; 没有给出 rate 时只为这一次扫描创建控制器"""
+        try:
+            sweeper = IcmpSweeper(timeout=timeout)
+        except OSError as e:
+            print(f"[设备发现] 无法创建ICMP socket ({e}), 改用系统ping")
+            return None
+        
+        # 发包速率由 AIMD 在 ping_pps 上限内调整
+        own_rate = rate is None
+        if own_rate:
+            rate = self._new_ping_rate()
+        try:
+            return sweeper.sweep(ips, progress_callback=progress_callback, rate=rate)
+        finally:
+            if own_rate:
+                rate.close()
+    
+    @traced("subprocess_sweep", lambda self, ips, *args, **kwargs: {"hosts": len(ips)})
+    def _subprocess_sweep(self, ips, workers, progress_callback=None):
+        total_hosts = len(ips)
+        job = current_job()
+        
+        def ping_host(idx_ip):
+            idx, ip = idx_ip
+            job.checkpoint()
+            
+            # 更新进度
+            if progress_callback:
+                progress_callback(idx + 1, total_hosts)
+            try:
+                # Linux: -c 1 (count), -W 0.5 (timeout in seconds)
+                # Windows: -n 1, -w 500 (timeout in ms)
+                with trace_span("ping", ip=ip):
+                    result = subprocess.run(
+                        ['ping', '-c', '1', '-W', '1', ip],
+                        capture_output=True, text=True, timeout=3
+                    )
+                if result.returncode == 0 and 'TTL' in result.stdout.upper():
+                    rtt_match = re.search(r'time[=<]\s*([\d.]+)', result.stdout)
+                    return ip, float(rtt_match.group(1)) if rtt_match else None
+            except:
+                pass
+            return None
+        
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(bind_job(ping_host), enumerate(ips)))
+        return dict(r for r in results if r is not None)
+    
+    @traced("tcp_probe_sweep", lambda self, ips: {"hosts": len(ips)})
+    def _tcp_probe_sweep(self, ips):
+        """对每个地址并发连接 probe_ports, SYN-ACK(开放) 或 RST(拒绝) 都说明主机在线
+        
+        返回 {ip: rtt_ms}, 整个扫描不超过 DISCOVERY_PROBE["deadline"] 秒
+        """
+        alive = {}
+        alive_errnos = (0, errno.ECONNREFUSED)
+        job = current_job()
+        
+        async def run():
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + DISCOVERY_PROBE["deadline"]
+            ip_iter = iter(ips)
+            
+            async def probe_host(ip):
+                start = loop.time()
+                timeout = min(DISCOVERY_PROBE["timeout"], max(0.01, deadline - start))
+                probes = [asyncio.ensure_future(self._async_connect(loop, ip, port, timeout)) for port in self.probe_ports]
+                try:
+                    for probe in asyncio.as_completed(probes):
+                        if await probe in alive_errnos:
+                            alive[ip] = round((loop.time() - start) * 1000, 2)
+                            return
+                finally:
+                    for probe in probes:
+                        probe.cancel()
+            
+            async def worker():
+                for ip in ip_iter:
+                    if loop.time() >= deadline:
+                        return
+                    await job.acheckpoint()
+                    await probe_host(ip)
+            
+            workers = self._max_sockets(DISCOVERY_PROBE["workers"] * max(1, len(self.probe_ports))) // max(1, len(self.probe_ports))
+            await asyncio.gather(*(worker() for _ in range(max(1, workers))))
+        
+        run_cancellable(run)
+        return alive
+    
+    def _echo_sweep(self, ips, workers, progress_callback=None, rate=None):
+        alive = None
+        if self.ping_engine == "icmp":
+            alive = self._icmp_sweep(ips, timeout=1.0, progress_callback=progress_callback, rate=rate)
+        if alive is None:
+            alive = self._subprocess_sweep(ips, workers, progress_callback=progress_callback)
+        return alive
+    
+    @traced("ping_scan")
+    def ping_scan(self, shard_callback=None, exclude=(), network=None):
+        """按分片扫描网段 network, 默认为配置的所有网段
+        
+        每个分片完成后调用 shard_callback(found_in_shard, shard_index, total_shards),
+        exclude 中的地址不扫描, 返回全部 (ip, mac, name) 列表
+        """
+        networks = parse_networks(network or self.network)
+        workers = 100
+        total_addresses = count_hosts(networks)
+        total_shards = max(1, -(-total_addresses // DISCOVERY_SHARD_SIZE))
+        
+        print(f"[设备发现] 扫描网段 {', '.join(map(str, networks))} ({total_addresses} 个地址, {total_shards} 个分片) ...")
+        update_status(current_device="正在发现内网设备...")
+        
+        found = []
+        # 发包速率跨分片保持
+        ping_rate = self._new_ping_rate() if self.ping_engine == "icmp" and self.discovery_mode != "tcp" else None
+        started = time.monotonic()
+        try:
+            for shard_index, ips in enumerate(iter_host_shards(networks, exclude={self.local_ip, *exclude})):
+                current_job().checkpoint()
+                update_status(shard={"index": shard_index + 1, "total": total_shards,
+                                     "range": f"{ips[0]} - {ips[-1]}"})
+                
+                def shard_progress(done, total):
+                    update_status(progress=int((shard_index + done / max(1, total)) * 100 / total_shards))
+                
+                with trace_span("shard", index=shard_index + 1, hosts=len(ips)):
+                    shard_found = self._sweep_shard(ips, workers, shard_progress, rate=ping_rate)
+                found.extend(shard_found)
+                print(f"[设备发现] 分片 {shard_index + 1}/{total_shards} ({ips[0]} - {ips[-1]}) 发现 {len(shard_found)} 个设备")
+                if shard_callback:
+                    shard_callback(shard_found, shard_index + 1, total_shards)
+        finally:
+            update_status(shard=None)
+            if ping_rate is not None:
+                ping_rate.close()
+        print(f"[设备发现] 共发现 {len(found)} 个设备")
+        record_scan("ping", started)
+        return found
+    
+    def _sweep_shard(self, ips, workers, progress_callback=None, rate=None):
+        # ICMP 扫描与 TCP 探测并行进行, 不回应ICMP的设备由TCP探测补上
+        mode = self.discovery_mode if self.discovery_mode in DISCOVERY_MODES else "both"
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            echo_future = executor.submit(bind_job(self._echo_sweep), ips, workers, progress_callback, rate) if mode in ("icmp", "both") else None
+            tcp_future = executor.submit(bind_job(self._tcp_probe_sweep), ips) if mode in ("tcp", "both") else None
+            alive = tcp_future.result() if tcp_future else {}
+            if echo_future:
+                alive.update(echo_future.result())
+        
+        for ip, rtt in alive.items():
+            if rtt is not None:
+                self.host_rtt[ip] = rtt
+                self.rtt.record(ip, rtt / 1000)
+                METRICS.observe("hpm_ping_latency_seconds", rtt / 1000)
+        METRICS.inc("hpm_host_probes_total", (("mode", mode), ("result", "alive")), len(alive))
+        METRICS.inc("hpm_host_probes_total", (("mode", mode), ("result", "no_reply")), len(ips) - len(alive))
+        
+        # 扫描结束后邻居表里已经有了存活主机的MAC; 不回应ping, 但邻居表显示刚回应过ARP (REACHABLE/DELAY)
+        # 的主机也作为候选设备; STALE 条目可能是已离线的主机, 不能算在线
+        neighbors = read_neighbor_table()
+        
+        found = []
+        for ip in ips:
+            mac, state = neighbors.get(ip, (None, None))
+            if ip in alive:
+                rtt = alive[ip]
+                print(f"  [发现] {ip} ({mac or '00:00:00:00:00:00'})" + (f" {rtt}ms" if rtt is not None else ""))
+            elif mac and state in NEIGHBOR_ALIVE_STATES:
+                print(f"  [邻居表] {ip} ({mac}, {state})")
+            else:
+                continue
+            found.append((ip, mac or "00:00:00:00:00:00", ""))
+            SCAN_EVENTS.publish("host_found", job=current_job().id, ip=ip, mac=mac or "00:00:00:00:00:00", rtt_ms=alive.get(ip))
+        return found
+    
+    def _reset_stream(self):
+        job = current_job()
+        job.update(scanning=True, progress=0)
+        with job.lock:
+            job.stream["found_ports"] = []
+            job.stream["completed_devices"] = []
+            job.stream["active_hosts"] = {}
+    
+    @traced("scan_hosts", lambda self, targets, *args, **kwargs: {"hosts": len(targets)})
+    def _scan_hosts(self, targets, fast_mode=False, journal=None, resume_chunks=None):
+        """并发扫描多台主机的端口
+        
+        targets 为 [((ip, mac, name), ports)], ports 为 None 时按 fast_mode 取默认端口;
+        给出 journal 时记录每个端口块和每台设备的完成情况, resume_chunks ({ip: {(index, count): ports}})
+        中已完成的端口块不再扫描; 返回与 targets 顺序一致的设备列表
+        """
+        import concurrent.futures
+        
+        total_devices = len(targets)
+        config = self._speed_config()
+        host_workers = max(1, min(config["host_workers"], total_devices))
+        per_host = self.host_concurrency(self.engine, host_workers)
+        print(f"[扫描] 同时扫描 {host_workers} 台设备, 每台 {per_host} 并发")
+        
+        devices = []
+        host_progress = {}
+        
+        def update_progress():
+            done = len(devices) + sum(list(host_progress.values()))
+            update_status(progress=int(done * 100 / max(1, total_devices)))
+        
+        def scan_device(target):
+            (ip, mac, device_name), ports = target
+            current_job().checkpoint()
+            
+            def port_progress(scanned, total_ports):
+                host_progress[ip] = scanned / max(1, total_ports)
+                stream_host_progress(ip, scanned, total_ports)
+                update_progress()
+            
+            def on_port_found(port_info):
+                stream_port_found(ip, port_info)
+            
+            done_chunks = (resume_chunks or {}).get(ip, {})
+            checkpoint = None
+            if journal is not None:
+                def checkpoint(index, count, chunk_ports):
+                    journal.chunk(ip, index, count, chunk_ports)
+            
+            stream_host_start(ip, 0)
+            try:
+                open_ports = self.scan_ports(ip, ports=ports, progress_callback=port_progress,
+                                             found_callback=on_port_found, fast_mode=fast_mode, workers=per_host,
+                                             checkpoint=checkpoint, skip_chunks=set(done_chunks))
+            finally:
+                host_progress.pop(ip, None)
+                stream_host_done(ip)
+            if done_chunks:
+                merged = {p["port"]: p for chunk_ports in done_chunks.values() for p in chunk_ports}
+                merged.update({p["port"]: p for p in open_ports})
+                open_ports = [merged[port] for port in sorted(merged)]
+            
+            return {
+                "ip": ip,
+                "mac": mac,
+                "name": device_name or "未知设备",
+                "vendor": "未知",
+                "type": "",
+                "ports": open_ports,
+                "rtt_ms": self.host_rtt.get(ip),
+                "last_seen": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            }
+        
+        executor = ThreadPoolExecutor(max_workers=host_workers)
+        try:
+            futures = [executor.submit(bind_job(scan_device), target) for target in targets]
+            for future in concurrent.futures.as_completed(futures):
+                device_info = future.result()
+                devices.append(device_info)
+                if journal is not None:
+                    journal.host(device_info)
+                stream_device_done(device_info)
+                update_progress()
+        finally:
+            # 取消时还没开始的主机不再扫描; 正在扫描的主机会在下一个 checkpoint 退出
+            executor.shutdown(wait=True, cancel_futures=True)
+        
+        order = {target[0][0]: idx for idx, target in enumerate(targets)}
+        devices.sort(key=lambda d: order[d["ip"]])
+        return devices
+    
+    @traced("save_history", lambda self, devices, kind, *args, **kwargs: {"devices": len(devices), "kind": kind})
+    def _save_history(self, devices, kind, network, port_scope=None, complete=True):
+        try:
+            return STORE.save_run(kind, devices, params={"network": network, "speed_mode": self.speed_mode,
+                                                         "background": current_job().background},
+                                  complete=complete, scope=parse_networks(network), port_scope=port_scope)
+        except Exception as e:
+            print(f"[保存] 失败: {e}")
+    
+    def _finish_scan(self):
+        update_status(progress=100, phase="", current_device="")
+        current_job().stream["current_ip"] = ""
+    
+    @traced("discovery")
+    def discovery(self, fast_mode=False, ports=None, resume=None, network=None):
+        """全网扫描, 过程写入 JOURNAL; resume 为 JOURNAL.pending() 的结果时从中断处继续"""
+        self._reset_stream()
+        network = network or self.network
+        started = time.monotonic()
+        
+        if resume is None:
+            JOURNAL.begin({"kind": "discovery", "fast_mode": fast_mode, "ports": str(ports) if ports else None,
+                           "network": network})
+            found_devices = None
+            done = {}
+        else:
+            JOURNAL.resume(resume)
+            found_devices = resume["hosts"]
+            done = resume["devices"]
+            print(f"[恢复] 继续 {resume['started_at']} 开始的扫描, 已完成 {len(done)} 台设备")
+        
+        if found_devices is None:
+            found_devices = self.ping_scan(network=network)
+            JOURNAL.hosts(found_devices)
+        print(f"[扫描] 发现 {len(found_devices)} 个设备")
+        
+        for device_data in found_devices:
+            if device_data[0] in done:
+                stream_device_done(done[device_data[0]])
+        targets = [(device_data, ports) for device_data in found_devices if device_data[0] not in done]
+        try:
+            scanned = {d["ip"]: d for d in self._scan_hosts(targets, fast_mode=fast_mode, journal=JOURNAL,
+                                                             resume_chunks=resume["chunks"] if resume else None)}
+        except ScanCancelled:
+            # 取消的扫描保留在日志中, 之后仍可通过 /api/scan/resume 继续
+            JOURNAL.flush()
+            raise
+        devices = [done.get(ip) or scanned[ip] for ip, _, _ in found_devices]
+        self.fingerprint_devices(devices)
+        
+        self._finish_scan()
+        run_id = self._save_history(devices, "discovery", network, port_scope(ports, fast_mode))
+        if run_id is not None:
+            JOURNAL.complete(run_id)
+        else:
+            JOURNAL.flush()
+        record_scan("discovery", started)
+        
+        return devices
+    
+    @traced("incremental_scan")
+    def incremental_scan(self, previous, fast_mode=False, ports=None, network=None):
+        """增量扫描, 以上一次的结果 previous ({ip: device}) 为基础
+        
+        1. 复查每台主机已知的开放端口
+        2. 对没有复查到开放端口的已知主机做快速存活检测
+        3. 只对新主机做完整/常用端口扫描, 已知主机只扫描轮换的端口分片
+        
+        返回 (devices, diff)
+        """
+        self._reset_stream()
+        started = time.monotonic()
+        
+        # 第一步: 复查已知开放端口
+        update_status(phase="复查已知端口")
+        print(f"[增量] 复查 {len(previous)} 台已知设备的开放端口")
+        verify_targets = [((ip, d.get("mac", ""), d.get("name", "")), [p["port"] for p in d["ports"]])
+                          for ip, d in previous.items() if d.get("ports")]
+        verified = {d["ip"]: d for d in self._scan_hosts(verify_targets)}
+        alive = {ip: previous[ip].get("mac", "") for ip, d in verified.items() if d["ports"]}
+        
+        # 第二步: 已知主机存活检测
+        update_status(phase="检测已知设备存活")
+        unconfirmed = [ip for ip in previous if ip not in alive]
+        if unconfirmed:
+            for ip, mac, _ in self._sweep_shard(unconfirmed, 100):
+                alive[ip] = mac if mac != "00:00:00:00:00:00" else previous[ip].get("mac", mac)
+        print(f"[增量] 已知设备在线 {len(alive)} 台, 离线 {len(previous) - len(alive)} 台")
+        
+        # 第三步: 发现新主机, 新主机完整扫描, 已知主机扫描轮换分片
+        update_status(phase="发现新设备")
+        new_devices = self.ping_scan(exclude=set(previous), network=network)
+        port_slice = self._next_port_slice(fast_mode, ports)
+        print(f"[增量] 新设备 {len(new_devices)} 台, 已知设备扫描端口分片 {port_slice}")
+        
+        update_status(phase="扫描端口")
+        targets = [(device_data, ports) for device_data in new_devices]
+        targets += [((ip, alive[ip], previous[ip].get("name", "")), port_slice) for ip in previous if ip in alive]
+        scanned = {d["ip"]: d for d in self._scan_hosts(targets, fast_mode=fast_mode)}
+        
+        diff = {"hosts_appeared": [d[0] for d in new_devices], "hosts_disappeared": [],
+                "ports_opened": {}, "ports_closed": {}}
+        devices = []
+        for ip, old in previous.items():
+            if ip not in alive:
+                diff["hosts_disappeared"].append(ip)
+                continue
+            old_ports = {p["port"] for p in old.get("ports", [])}
+            merged = {p["port"]: p for p in verified.get(ip, {}).get("ports", [])}
+            merged.update({p["port"]: p for p in scanned[ip]["ports"]})
+            opened = sorted(set(merged) - old_ports)
+            closed = sorted(old_ports - set(merged))
+            if opened:
+                diff["ports_opened"][ip] = opened
+            if closed:
+                diff["ports_closed"][ip] = closed
+            device = dict(old, **{k: scanned[ip][k] for k in ("mac", "rtt_ms", "last_seen")})
+            device["ports"] = [merged[port] for port in sorted(merged)]
+            devices.append(device)
+        for ip, _, _ in new_devices:
+            devices.append(scanned[ip])
+            if scanned[ip]["ports"]:
+                diff["ports_opened"][ip] = [p["port"] for p in scanned[ip]["ports"]]
+        
+        print(f"[增量] 新增设备 {len(diff['hosts_appeared'])}, 消失设备 {len(diff['hosts_disappeared'])}, "
+              f"新开放端口 {sum(map(len, diff['ports_opened'].values()))}, 关闭端口 {sum(map(len, diff['ports_closed'].values()))}")
+        
+        self.fingerprint_devices(devices)
+        self._finish_scan()
+        self._save_history(devices, "incremental", network or self.network)
+        record_scan("incremental", started)
+        
+        return devices, diff
+    
+    def _next_port_slice(self, fast_mode, ports):
+        """轮换端口分片: 端口空间大于 INCREMENTAL_SLICE_SIZE 时每次只扫描其中一片, 多次增量扫描后覆盖全部端口"""
+        if ports is None:
+            ports = COMMON_PORTS if fast_mode else ALL_PORTS
+        slices = max(1, -(-len(ports) // INCREMENTAL_SLICE_SIZE))
+        cursor = STORE.get_meta("incremental_cursor", 0) % slices
+        STORE.set_meta("incremental_cursor", cursor + 1)
+        return PortSlice(ports, cursor, slices)
+    
+with startup_phase("初始化扫描器"):
+    scanner = HomeNetworkScanner()
+    scanner.detect_network_async()
+
+def _in_networks(ip, networks):
+    address = ipaddress.IPv4Address(ip)
+    return any(address in network for network in networks)
+
+def run_full_scan(fast_mode=False, port_spec=None, incremental=False, network=None, distributed=False):
+    """全网/增量/分布式扫描任务; 指定 network 时只更新 SCAN_CACHE 中该网段的设备"""
+    global LAST_SCAN_DIFF
+    networks = parse_networks(network) if network else None
+    before = list(SCAN_CACHE)
+    if distributed:
+        devices, missed, covered = COORDINATOR.scan(network, fast_mode=fast_mode, ports=port_spec)
+        scanner._finish_scan()
+        # 有存活检测分片被跳过时设备列表不完整, 这次不把任何没有发现的设备记为离线或移出缓存
+        scanner._save_history(devices, "distributed", network or scanner.network, covered, complete=not missed)
+        if missed:
+            before = []
+    elif incremental:
+        previous = {ip: d for ip, d in list(SCAN_CACHE.items()) if networks is None or _in_networks(ip, networks)}
+        devices, LAST_SCAN_DIFF = scanner.incremental_scan(previous, fast_mode=fast_mode, ports=port_spec,
+                                                           network=network)
+    else:
+        devices = scanner.discovery(fast_mode=fast_mode, ports=port_spec, network=network)
+    merge_scan_results(devices, before, networks)
+    return [d['ip'] for d in devices]
+
+def merge_scan_results(devices, before, networks=None):
+    """把全网扫描结果原地并入 SCAN_CACHE
+    
+    扫描开始时已在缓存中 (before) 且属于扫描网段的设备, 这次没有发现就移除;
+    扫描期间其他任务 (如同时运行的设备发现) 加入的设备保留
+    """
+    found = {d['ip'] for d in devices}
+    for ip in before:
+        if ip not in found and (networks is None or _in_networks(ip, networks)):
+            SCAN_CACHE.pop(ip, None)
+    SCAN_CACHE.update((d['ip'], d) for d in devices)
+
+def run_device_discovery(network=None):
+    """设备发现任务, 每个分片完成就写入 SCAN_CACHE, 大网段不必等全部扫描结束"""
+    def on_shard(found_devices, shard_index, total_shards):
+        for ip, mac, name in found_devices:
+            if ip not in SCAN_CACHE:
+                SCAN_CACHE[ip] = {
+                    "ip": ip,
+                    "mac": mac,
+                    "vendor": "未知",
+                    "type": "",
+                    "ports": [],
+                    "rtt_ms": scanner.host_rtt.get(ip),
+                    "last_seen": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                }
+    
+    update_status(current_device="正在发现设备...")
+    found = scanner.ping_scan(shard_callback=on_shard, network=network)
+    STORE.save_run("devices", [{k: v for k, v in SCAN_CACHE[ip].items() if k != "ports"} for ip, _, _ in found],
+                   params={"network": network or scanner.network}, complete=False)
+    update_status(progress=100)
+    return [ip for ip, _, _ in found]
+
+# ======== 定时扫描 ========
+# 定时任务类型: all = 全网扫描, incremental = 增量扫描, devices = 只发现设备
+SCHEDULE_KINDS = {
+    "all":         {"name": "全网扫描"},
+    "incremental": {"name": "增量扫描"},
+    "devices":     {"name": "设备发现"},
+}
+
+CRON_FIELDS = [("分钟", 0, 59), ("小时", 0, 23), ("日", 1, 31), ("月", 1, 12), ("星期", 0, 6)]
+
+def parse_cron(expr):
+    """解析5段 cron 表达式 (分 时 日 月 星期, 支持 * , - /), 返回每段允许值的集合"""
+    parts = str(expr).split()
+    if len(parts) != 5:
+        raise ValueError(f"cron 表达式需要5段: {expr}")
+    fields = []
+    for part, (name, low, high) in zip(parts, CRON_FIELDS):
+        # 星期字段中 0 和 7 都表示周日, 范围可以写到 7 (如 5-7), 展开后按 7 取模
+        top = high + 1 if high == 6 else high
+        values = set()
+        for item in part.split(','):
+            base, _, step = item.partition('/')
+            if step and not step.isdigit():
+                raise ValueError(f"cron {name}格式错误: {item}")
+            if base == '*':
+                start, end = low, high
+            elif '-' in base:
+                start, _, end = base.partition('-')
+                if not (start.isdigit() and end.isdigit()):
+                    raise ValueError(f"cron {name}格式错误: {item}")
+                start, end = int(start), int(end)
+            elif base.isdigit():
+                start = int(base)
+                end = high if step else start
+            else:
+                raise ValueError(f"cron {name}格式错误: {item}")
+            if not low <= start <= end <= top:
+                raise ValueError(f"cron {name}超出范围: {item}")
+            values.update(v % 7 if high == 6 else v for v in range(start, end + 1, int(step or 1)))
+        fields.append((values, part == '*'))
+    return fields
+
+def cron_next(fields, after):
+    """after (datetime) 之后第一个满足 cron 的整分钟"""
+    (minutes, _), (hours, _), (days, any_day), (months, _), (weekdays, any_weekday) = fields
+    t = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+    limit = t + timedelta(days=366 * 5)
+    while t < limit:
+        if t.month not in months:
+            t = (t.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            continue
+        # 日和星期都有限制时满足其一即可 (与 cron 相同)
+        day_ok = t.day in days
+        weekday_ok = (t.weekday() + 1) % 7 in weekdays
+        if not ((day_ok and weekday_ok) if any_day or any_weekday else (day_ok or weekday_ok)):
+            t = t.replace(hour=0, minute=0) + timedelta(days=1)
+            continue
+        if t.hour not in hours:
+            t = t.replace(minute=0) + timedelta(hours=1)
+            continue
+        if t.minute not in minutes:
+            t += timedelta(minutes=1)
+            continue
+        return t
+    raise ValueError("cron 表达式没有可执行的时间")
+
+class ScanScheduler:
+    """定时扫描
+    
+    每条计划为 {"id", "kind", "interval" 或 "cron", "network", "mode", "ports", "jitter", "enabled"},
+    保存在 STORE 的 meta 表中; 到期时以后台低优先级任务提交到 JOBS, 触发时间随机推迟 jitter 以错开扫描
+    """
+    
+    def __init__(self, store):
+        self.store = store
+        self._cond = threading.Condition()
+        self._schedules = {s["id"]: s for s in store.get_meta("schedules", [])}
+        self._next_run = {}
+        self._last = {}
+        self._thread = None
+    
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, daemon=True, name="scan-scheduler")
+            self._thread.start()
+    
+    @staticmethod
+    def validate(data):
+        """校验并规范化计划, 格式错误时抛出 ValueError"""
+        kind = data.get("kind", "all")
+        if kind not in SCHEDULE_KINDS:
+            raise ValueError(f"不支持的扫描类型: {kind}")
+        schedule = {"kind": kind, "enabled": bool(data.get("enabled", True)), "mode": data.get("mode") or "common"}
+        resolve_port_mode(schedule["mode"])
+        if data.get("cron"):
+            parse_cron(data["cron"])
+            schedule["cron"] = str(data["cron"]).strip()
+        elif data.get("interval"):
+            interval = int(data["interval"])
+            if interval < 60:
+                raise ValueError("扫描间隔不能小于60秒")
+            schedule["interval"] = interval
+        else:
+            raise ValueError("需要指定 interval (秒) 或 cron")
+        if data.get("network"):
+            parse_networks(data["network"])
+            schedule["network"] = str(data["network"]).strip()
+        if data.get("ports"):
+            schedule["ports"] = str(parse_ports(data["ports"]))
+        if data.get("jitter") is not None:
+            schedule["jitter"] = max(0.0, float(data["jitter"]))
+        return schedule
+    
+    def _save(self):
+        self.store.set_meta("schedules", list(self._schedules.values()))
+    
+    def add(self, data):
+        schedule = self.validate(data)
+        with self._cond:
+            schedule["id"] = max(self._schedules, default=0) + 1
+            self._schedules[schedule["id"]] = schedule
+            self._save()
+            self._cond.notify()
+        return schedule
+    
+    def remove(self, schedule_id):
+        with self._cond:
+            if self._schedules.pop(schedule_id, None) is None:
+                return False
+            self._next_run.pop(schedule_id, None)
+            self._save()
+            self._cond.notify()
+        return True
+    
+    def list(self):
+        with self._cond:
+            return [dict(s, next_run=datetime.fromtimestamp(self._next_run[s["id"]]).strftime("%Y-%m-%d %H:%M:%S")
+                         if s["id"] in self._next_run else None, last=self._last.get(s["id"]))
+                    for s in self._schedules.values()]
+    
+    def _compute_next(self, schedule, now):
+        if "cron" in schedule:
+            base = cron_next(parse_cron(schedule["cron"]), datetime.fromtimestamp(now)).timestamp()
+            jitter = schedule.get("jitter", BACKGROUND_SCAN["cron_jitter"])
+        else:
+            base = now + schedule["interval"]
+            jitter = schedule.get("jitter", BACKGROUND_SCAN["jitter"]) * schedule["interval"]
+        return base + random.uniform(0, jitter)
+    
+    def _loop(self):
+        while True:
+            with self._cond:
+                now = time.time()
+                for schedule in self._schedules.values():
+                    if schedule["enabled"] and schedule["id"] not in self._next_run:
+                        self._next_run[schedule["id"]] = self._compute_next(schedule, now)
+                due = [self._schedules[i] for i, t in self._next_run.items() if t <= now and i in self._schedules]
+                if not due:
+                    wait = min(self._next_run.values(), default=now + 3600) - now
+                    self._cond.wait(timeout=max(0.5, min(wait, 3600)))
+                    continue
+                for schedule in due:
+                    self._next_run[schedule["id"]] = self._compute_next(schedule, now)
+            for schedule in due:
+                self._fire(schedule)
+    
+    def _fire(self, schedule):
+        kind = schedule["kind"]
+        network = schedule.get("network")
+        params = {"schedule": schedule["id"], "network": network or scanner.network}
+        if kind == "devices":
+            fn, args, key = run_device_discovery, (network,), "devices"
+        else:
+            fast_mode, port_spec = resolve_port_mode(schedule["mode"], schedule.get("ports"))
+            incremental = kind == "incremental" and bool(SCAN_CACHE)
+            fn, args, key = run_full_scan, (fast_mode, port_spec, incremental, network), "all"
+            params["incremental"] = incremental
+        try:
+            job, created = JOBS.submit(kind, fn, *args, priority=JOB_PRIORITIES["low"], key=key, params=params,
+                                       background=True)
+        except queue.Full:
+            created = False
+            job = None
+        if created:
+            print(f"[定时] 计划 #{schedule['id']} 提交{SCHEDULE_KINDS[kind]['name']}任务 #{job.id}")
+            self._last[schedule["id"]] = {"job": job.id, "at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+        else:
+            print(f"[定时] 计划 #{schedule['id']} 跳过: 已有扫描进行中或队列已满")
+
+# 由 init_data() 创建; 定时扫描线程在 __main__ 中启动, 导入本模块 (测试、bench.py) 不会触发任何扫描
+SCHEDULER = None
+
+# ======== 分布式扫描 ========
+# 代理 (python app.py --agent) 通过 HTTP 接收扫描分片 (主机列表 × 端口分片), 以 NDJSON 流式返回结果;
+# 主实例作为协调者拆分任务, 各代理按自身速度拉取分片 (快的代理自然分到更多), 代理失联时未完成的主机重新排队
+# heartbeat: 代理无结果时发送心跳的间隔; stall_timeout: 超过该时间没有任何数据视为代理失联;
+# retry_after: 失联的代理在该时间内不再分配分片; local_worker: 协调者本机也参与扫描
+AGENT = {"token": os.environ.get("HPM_AGENT_TOKEN", ""), "heartbeat": 1, "stall_timeout": 30, "connect_timeout": 5,
+         "discover_hosts": 256, "hosts_per_shard": 4, "ports_per_shard": 16384, "shards_per_agent": 2,
+         "retry_after": 60, "local_worker": True}
+
+def run_agent_shard(shard, emit):
+    """执行一个扫描分片, 结果逐条交给 emit(event)
+    
+    shard: {"hosts": [ip, ...], "discover": bool, "ports": 端口描述, "fast_mode": bool, "slice": [index, count]}
+    discover 为真时只做存活检测, 输出 {"type": "host", "ip", "mac", "name"}; 否则扫描每台主机的端口,
+    输出 {"type": "port", "ip", "port"} 和识别过服务的 {"type": "host_done", "ip", "ports", "scanned"}
+    """
+    hosts = [str(ipaddress.IPv4Address(ip)) for ip in shard["hosts"]]
+    config = scanner._speed_config()
+    if shard.get("discover"):
+        for ip, mac, name in scanner._sweep_shard(hosts, config["ping_workers"]):
+            emit({"type": "host", "ip": ip, "mac": mac, "name": name})
+        return
+    
+    if shard.get("ports"):
+        ports = parse_ports(shard["ports"])
+    else:
+        ports = COMMON_PORTS if shard.get("fast_mode") else ALL_PORTS
+    if shard.get("slice"):
+        index, count = shard["slice"]
+        ports = PortSlice(ports, int(index), int(count))
+    host_workers = max(1, min(config["host_workers"], len(hosts)))
+    per_host = scanner.host_concurrency(scanner.engine, host_workers)
+    
+    def scan_host(ip):
+        current_job().checkpoint()
+        open_ports = scanner.scan_ports(ip, ports=ports, workers=per_host,
+                                        found_callback=lambda port_info: emit({"type": "port", "ip": ip,
+                                                                               "port": port_info}))
+        scanner.fingerprint_devices([{"ip": ip, "mac": None, "ports": open_ports}])
+        emit({"type": "host_done", "ip": ip, "ports": open_ports, "scanned": len(ports)})
+    
+    executor = ThreadPoolExecutor(max_workers=host_workers)
+    try:
+        for future in [executor.submit(bind_job(scan_host), ip) for ip in hosts]:
+            future.result()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+def _shard_size(shard):
+    """分片的探测量, 用于估算代理吞吐量 (存活检测按每台主机一次计)"""
+    return len(shard["hosts"]) * (1 if shard.get("discover") else shard.get("size", 1))
+
+class RemoteAgent:
+    """协调者一侧的代理记录: 地址、可达网段、吞吐量 (探测/秒的滑动平均) 和失败情况"""
+    
+    def __init__(self, url, token="", networks=None):
+        self.url = url.rstrip("/")
+        self.token = token
+        self.networks = networks
+        self._networks = parse_networks(networks) if networks else None
+        self.throughput = None
+        self.shards_done = 0
+        self.failures = 0
+        self.last_error = None
+        self.dead_until = 0.0
+    
+    def alive(self):
+        return time.monotonic() >= self.dead_until
+    
+    def can_reach(self, hosts):
+        return self._networks is None or all(_in_networks(ip, self._networks) for ip in hosts)
+    
+    def mark_dead(self, error):
+        self.failures += 1
+        self.last_error = str(error)
+        self.dead_until = time.monotonic() + AGENT["retry_after"]
+    
+    def record(self, shard, elapsed):
+        rate = _shard_size(shard) / max(elapsed, 1e-3)
+        self.throughput = rate if self.throughput is None else 0.7 * self.throughput + 0.3 * rate
+        self.shards_done += 1
+    
+    def _request(self, path, payload=None, timeout=None):
+        data = json.dumps(payload).encode() if payload is not None else None
+        req = urllib.request.Request(self.url + path, data=data, method="POST" if data else "GET",
+                                     headers={"Content-Type": "application/json", "X-HPM-Token": self.token})
+        return urllib.request.urlopen(req, timeout=timeout or AGENT["connect_timeout"])
+    
+    def info(self):
+        with self._request("/api/agent/info") as resp:
+            return json.loads(resp.read())
+    
+    def run(self, shard, emit, job):
+        """把分片发给代理并逐行处理结果; 代理报错、连接中断或超过 stall_timeout 没有数据时抛出异常"""
+        with self._request("/api/agent/shard", shard, timeout=AGENT["stall_timeout"]) as resp:
+            unregister = job.on_cancel(resp.close)
+            try:
+                for line in resp:
+                    if job.cancelled:
+                        raise ScanCancelled()
+                    event = json.loads(line)
+                    if event["type"] == "heartbeat":
+                        continue
+                    if event["type"] == "done":
+                        return
+                    if event["type"] == "error":
+                        raise RuntimeError(f"代理错误: {event.get('error')}")
+                    emit(event)
+            finally:
+                unregister()
+        raise ConnectionError("代理连接中断")
+    
+    def snapshot(self):
+        return {"url": self.url, "networks": self.networks, "alive": self.alive(),
+                "throughput": round(self.throughput, 1) if self.throughput else None,
+                "shards_done": self.shards_done, "failures": self.failures, "last_error": self.last_error}
+
+class LocalAgent(RemoteAgent):
+    """协调者本机作为一个代理参与扫描"""
+    
+    def __init__(self):
+        super().__init__("local")
+    
+    def run(self, shard, emit, job):
+        run_agent_shard(shard, emit)
+
+class ScanCoordinator:
+    """把全网扫描拆成分片分给各代理执行, 合并结果"""
+    
+    def __init__(self, store):
+        self.store = store
+        self.local = LocalAgent()
+        self._lock = threading.Lock()
+        self._agents = {}
+        for item in store.get_meta("agents", []):
+            try:
+                agent = RemoteAgent(item["url"], item.get("token", ""), item.get("networks"))
+                self._agents[agent.url] = agent
+            except ValueError as e:
+                print(f"[分布式] 忽略无效的代理 {item.get('url')}: {e}")
+    
+    def _save(self):
+        self.store.set_meta("agents", [{"url": a.url, "token": a.token, "networks": a.networks}
+                                       for a in self._agents.values()])
+    
+    def add(self, url, token="", networks=None):
+        """添加代理并检查连通性, 地址/网段格式错误或代理不可用时抛出 ValueError"""
+        if not re.match(r'^https?://[^/\s]+', str(url or "")):
+            raise ValueError(f"代理地址格式错误: {url}")
+        agent = RemoteAgent(url, token, str(networks).strip() if networks else None)
+        try:
+            agent.info()
+        except urllib.error.HTTPError as e:
+            raise ValueError(f"代理拒绝连接 ({e.code}), 请检查 token")
+        except (OSError, ValueError) as e:
+            raise ValueError(f"无法连接代理: {e}")
+        with self._lock:
+            self._agents[agent.url] = agent
+            self._save()
+        return agent.snapshot()
+    
+    def remove(self, url):
+        with self._lock:
+            removed = self._agents.pop(str(url).rstrip("/"), None)
+            self._save()
+        return removed is not None
+    
+    def list(self):
+        with self._lock:
+            agents = list(self._agents.values())
+        return [agent.snapshot() for agent in agents] + [dict(self.local.snapshot(), enabled=AGENT["local_worker"])]
+    
+    def has_agents(self):
+        return bool(self._agents)
+    
+    def _workers(self):
+        """可用的代理, 按吞吐量从高到低排列: 快的代理先启动, 先拿到队首 (含重新排队) 的分片"""
+        with self._lock:
+            workers = [agent for agent in self._agents.values() if agent.alive()]
+        if AGENT["local_worker"] or not workers:
+            workers.append(self.local)
+        workers.sort(key=lambda agent: agent.throughput or 0, reverse=True)
+        return workers
+    
+    def run_shards(self, shards, on_event):
+        """并发执行分片, 每个代理同时最多 shards_per_agent 个; 返回没有代理能执行而跳过的分片列表
         
-        print(f"[扫描] {ip} 的 {total} 个端口...")
+        代理失败时标记为失联, 分片中尚未完成的主机重新排队交给其他代理
+        """
+        job = current_job()
+        pending = deque(shards)
+        cond = threading.Condition()
+        state = {"inflight": 0, "done": 0}
+        total = len(shards)
         
-        def check_single_port(port):
-            if SCAN_STATUS.get("paused", False):
-                return None
-            if self._tcp_check(ip, port, timeout=timeout):
-                service = PORT_SERVICES.get(port, (f"Port {port}", "低", "未知服务"))
-                return {
-                    "port": port,
-                    "service": service[0],
-                    "risk": service[1],
-                    "risk_desc": service[2],
-                }
-            return None
+        def take(agent):
+            with cond:
+                while True:
+                    if job.cancelled or not agent.alive():
+                        return None
+                    if not job.waiting():
+                        for index, shard in enumerate(pending):
+                            if agent.can_reach(shard["hosts"]):
+                                del pending[index]
+                                state["inflight"] += 1
+                                return shard
+                    # 没有可执行的分片且没有在途分片 (不会再有重新排队的主机) 时退出
+                    if state["inflight"] == 0 and not job.waiting():
+                        return None
+                    cond.wait(0.5)
         
-        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
-            future_to_port = {executor.submit(check_single_port, port): port for port in ports}
-            
-            for future in concurrent.futures.as_completed(future_to_port):
-                result = future.result()
-                if result:
-                    open_ports.append(result)
-                    if found_callback:
-                        found_callback(result)
-                    print(f"  [开放] {result['port']} - {result['service']}")
+        def worker(agent):
+            while True:
+                shard = take(agent)
+                if shard is None:
+                    return
+                remaining = set(shard["hosts"])
                 
-                scanned[0] += 1
-                # 更新进度更频繁 - 每50个端口或每1%更新一次
-                if progress_callback and (scanned[0] % 50 == 0 or scanned[0] % max(1, total // 100) == 0):
-                    progress_callback(scanned[0], total)
-        
-        # 确保最后100%进度被报告
-        if progress_callback:
-            progress_callback(total, total)
+                def emit(event):
+                    if event["type"] in ("host", "host_done"):
+                        remaining.discard(event["ip"])
+                    on_event(event)
+                
+                started = time.monotonic()
+                try:
+                    with trace_span("agent_shard", agent=agent.url, hosts=len(shard["hosts"])):
+                        agent.run(shard, emit, job)
+                    agent.record(shard, time.monotonic() - started)
+                except Exception as e:
+                    with cond:
+                        state["inflight"] -= 1
+                        cond.notify_all()
+                    if job.cancelled or isinstance(e, ScanCancelled):
+                        return
+                    # 存活检测分片中没有回应的主机不会出现在结果里, 整片重做
+                    retry = shard["hosts"] if shard.get("discover") else [ip for ip in shard["hosts"] if ip in remaining]
+                    print(f"[分布式] 代理 {agent.url} 失败: {e}, 重新分配 {len(retry)} 台主机")
+                    agent.mark_dead(e)
+                    if retry:
+                        with cond:
+                            pending.appendleft(dict(shard, hosts=retry))
+                            cond.notify_all()
+                    return
+                with cond:
+                    state["inflight"] -= 1
+                    state["done"] += 1
+                    cond.notify_all()
+                update_status(progress=int(state["done"] * 100 / max(1, total)))
         
-        open_ports.sort(key=lambda x: x['port'])
-        print(f"[完成] 发现 {len(open_ports)} 个开放端口")
-        return open_ports
+        threads = [threading.Thread(target=bind_job(worker), args=(agent,), daemon=True,
+                                    name=f"agent-{agent.url}-{slot}")
+                   for agent in self._workers() for slot in range(AGENT["shards_per_agent"])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if job.cancelled:
+            raise ScanCancelled()
+        if pending:
+            print(f"[分布式] {len(pending)} 个分片没有可用的代理, 已跳过")
+        return list(pending)
     
-    def ping_scan(self):
-        base_ip = '.'.join(self.network.split('.')[:3])
-        found = []
-        timeout_ms = 500
-        workers = 100
-        total_hosts = 254
+    def scan(self, network=None, fast_mode=False, ports=None):
+        """分布式全网扫描: 先分片做存活检测, 再把存活主机 × 端口分片分给各代理扫描
         
-        print(f"[设备发现] 扫描网段 {base_ip}.1-254 ...")
-        SCAN_STATUS["current_device"] = "正在发现内网设备..."
+        返回 (devices, missed, covered): missed 为存活检测分片被跳过、状态未知的主机集合;
+        covered 为所有主机都扫描完成的端口范围 (支持 in), 有端口分片被跳过时只包含完成的端口片
+        """
+        networks = parse_networks(network or scanner.network)
+        workers = self._workers()
+        print(f"[分布式] 扫描 {', '.join(map(str, networks))}, 代理: {', '.join(a.url for a in workers)}")
         
-        def ping_host(suffix):
-            while SCAN_STATUS.get("paused", False):
-                time.sleep(0.5)
-            
-            ip = f"{base_ip}.{suffix}"
-            # 更新进度
-            progress = int((suffix / total_hosts) * 100)
-            SCAN_STATUS["progress"] = progress
-            
-            if ip == self.local_ip:
-                return None
-            try:
-                # Linux: -c 1 (count), -W 0.5 (timeout in seconds)
-                # Windows: -n 1, -w 500 (timeout in ms)
-                result = subprocess.run(
-                    ['ping', '-c', '1', '-W', '1', ip],
-                    capture_output=True, text=True, timeout=3
-                )
-                if result.returncode == 0 and 'TTL' in result.stdout.upper():
-                    try:
-                        arp_result = subprocess.run(
-                            ['arp', '-a', ip], capture_output=True, text=True, timeout=2
-                        )
-                        mac_match = re.search(r'([0-9a-fA-F]{2}[-:]){5}[0-9a-fA-F]{2}', arp_result.stdout)
-                        mac = mac_match.group(0) if mac_match else "00:00:00:00:00:00"
-                    except:
-                        mac = "00:00:00:00:00:00"
-                    
-                    print(f"  [发现] {ip} ({mac})")
-                    return (ip, mac, "")
-            except:
-                pass
-            return None
+        update_status(phase="分布式设备发现", progress=0)
+        found = {}
         
-        with ThreadPoolExecutor(max_workers=workers) as executor:
-            results = list(executor.map(ping_host, range(1, 255)))
+        def on_host(event):
+            if event["type"] == "host":
+                found.setdefault(event["ip"], event)
         
-        found = [r for r in results if r is not None]
-        print(f"[设备发现] 共发现 {len(found)} 个设备")
-        return found
-    
-    def discovery(self, fast_mode=False):
-        global SCAN_STATUS, SCAN_STREAM
+        shards = [{"hosts": hosts, "discover": True}
+                  for hosts in iter_host_shards(networks, AGENT["discover_hosts"], exclude={scanner.local_ip})]
+        missed = {ip for shard in self.run_shards(shards, on_host) for ip in shard["hosts"]}
+        hosts = sorted(found, key=ipaddress.IPv4Address)
+        print(f"[分布式] 发现 {len(hosts)} 个设备")
         
-        SCAN_STATUS["scanning"] = True
-        SCAN_STATUS["paused"] = False
-        SCAN_STATUS["progress"] = 0
-        SCAN_STREAM["found_ports"] = []
-        SCAN_STREAM["completed_devices"] = []
+        update_status(phase="分布式端口扫描", progress=0)
+        results = {ip: {} for ip in hosts}
         
-        found_devices = self.ping_scan()
-        total_devices = len(found_devices)
+        def on_port(event):
+            ip = event["ip"]
+            if event["type"] == "port":
+                port_info = event["port"]
+                if port_info["port"] not in results[ip]:
+                    results[ip][port_info["port"]] = port_info
+                    stream_port_found(ip, port_info)
+            elif event["type"] == "host_done":
+                results[ip].update((p["port"], p) for p in event["ports"])
         
-        print(f"[扫描] 发现 {total_devices} 个设备")
+        base = ports if ports is not None else COMMON_PORTS if fast_mode else ALL_PORTS
+        total_ports = len(base)
+        slices = max(1, -(-total_ports // AGENT["ports_per_shard"]))
+        step = AGENT["hosts_per_shard"]
+        shards = [{"hosts": hosts[i:i + step], "ports": str(ports) if ports is not None else None,
+                   "fast_mode": fast_mode, "slice": [index, slices], "size": -(-total_ports // slices)}
+                  for index in range(slices) for i in range(0, len(hosts), step)]
+        skipped = {shard["slice"][0] for shard in self.run_shards(shards, on_port)}
+        covered = port_scope(ports, fast_mode)
+        if skipped:
+            # 跳过的端口片状态未知, 保存历史时不能把其中之前开放的端口记为关闭
+            covered = frozenset(port for index in range(slices) if index not in skipped
+                                for port in PortSlice(base, index, slices))
+            print(f"[分布式] {len(skipped)}/{slices} 个端口片未完成, 只记录已完成端口片的关闭状态")
         
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         devices = []
-        
-        for idx, device_data in enumerate(found_devices):
-            ip, mac, device_name = device_data
-            device_percent = int((idx / total_devices) * 100)
-            SCAN_STATUS["progress"] = device_percent
-            SCAN_STATUS["current_device"] = ip
-            SCAN_STREAM["current_ip"] = ip
-            SCAN_STREAM["found_ports"] = []
-            
-            def port_progress(scanned, total_ports):
-                pass
-            
-            def on_port_found(port_info):
-                SCAN_STREAM["found_ports"].append(port_info)
-            
-            ports = self.scan_ports(ip, progress_callback=port_progress, 
-                                   found_callback=on_port_found, fast_mode=fast_mode)
-            
-            device_info = {
-                "ip": ip,
-                "mac": mac,
-                "name": device_name or "未知设备",
-                "vendor": "未知",
-                "type": "",
-                "ports": ports,
-                "last_seen": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            }
-            
-            devices.append(device_info)
-            SCAN_STREAM["completed_devices"].append(device_info)
-        
-        SCAN_STATUS["progress"] = 100
-        SCAN_STATUS["current_device"] = ""
-        SCAN_STREAM["current_ip"] = ""
-        
-        try:
-            save_data = {
-                'timestamp': datetime.now().isoformat(),
-                'devices': devices
-            }
-            with open(SAVE_FILE, 'w', encoding='utf-8') as f:
-                json.dump(save_data, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"[保存] 失败: {e}")
-        
-        SCAN_STATUS["scanning"] = False
-        return devices
+        for ip in hosts:
+            device = {"ip": ip, "mac": found[ip].get("mac") or "00:00:00:00:00:00",
+                      "name": found[ip].get("name") or "未知设备", "vendor": "未知", "type": "",
+                      "ports": sorted(results[ip].values(), key=lambda p: p["port"]), "rtt_ms": None,
+                      "last_seen": now}
+            devices.append(device)
+            stream_device_done(device)
+        return devices, missed, covered
 
-scanner = HomeNetworkScanner()
+# 由 init_data() 创建
+COORDINATOR = None
 
 # ======== HTML Frontend ========
 HTML_TEMPLATE = '''<!DOCTYPE html>
@@ -503,7 +4223,7 @@ HTML_TEMPLATE = '''<!DOCTYPE html>
         <div class="config-panel">
             <div class="config-row">
                 <span class="config-label">📡 扫描网段:</span>
-                <input type="text" id="networkInput" class="config-input" placeholder="192.168.1.0/24">
+                <input type="text" id="networkInput" class="config-input" placeholder="192.168.1.0/24, 10.0.0.0/22" style="width: 260px;">
                 <button onclick="saveNetwork()">保存</button>
                 <button onclick="resetNetwork()" style="background: #8e8e93;">重置</button>
                 <button onclick="testPing()" style="background: #34c759;">测试连通</button>
@@ -517,16 +4237,30 @@ HTML_TEMPLATE = '''<!DOCTYPE html>
             <button id="scanDevicesBtn" onclick="scanDevices()">🔍 扫描设备</button>
             <button id="scanPortsBtn" onclick="scanSelectedDevicePorts()" disabled style="background: #8e8e93;">📡 扫描选中设备端口</button>
             <button id="scanAllBtn" onclick="scanAll()">🌐 扫描全部</button>
+            <button id="resumeBtn" onclick="resumeScan()" style="display: none; background: #ff9500;">⏯️ 继续中断的扫描</button>
             <button onclick="exportData()">📊 导出JSON</button>
             <button onclick="clearData()" class="danger">🗑️ 清除数据</button>
             <select id="speedSelect" onchange="changeSpeed(this.value)">
                 <option value="fast" selected>🚀 极速</option>
                 <option value="standard">🔄 常规</option>
             </select>
+            <select id="engineSelect" onchange="changeEngine(this.value)">
+                <option value="async" selected>⚡ 异步引擎</option>
+                <option value="thread">🧵 线程池引擎</option>
+                <option value="process">🖥️ 多进程引擎</option>
+            </select>
+            <select id="discoverySelect" onchange="changeDiscoveryMode(this.value)">
+                <option value="both" selected>📶 ICMP+TCP发现</option>
+                <option value="icmp">📶 仅ICMP</option>
+                <option value="tcp">📶 仅TCP探测</option>
+            </select>
             <select id="portModeSelect">
                 <option value="full" selected>🌐 全端口1-65535</option>
-                <option value="common">📋 常用端口</option>
+                <option value="common">📋 常用端口 Top 1000</option>
+                <option value="top100">⚡ 常用端口 Top 100</option>
             </select>
+            <label style="font-size: 14px; color: #333;"><input type="checkbox" id="incrementalCheck"> ♻️ 增量</label>
+            <input type="text" id="portSpecInput" class="config-input" placeholder="自定义端口, 如 1-1024,3306 或 top200" style="width: 200px;">
             <span id="statusText" style="color: #666; margin-left: 10px;"></span>
         </div>
         
@@ -535,6 +4269,7 @@ HTML_TEMPLATE = '''<!DOCTYPE html>
             <div style="display: flex; justify-content: space-between; align-items: center; margin-top: 10px;">
                 <div id="progressText" style="color: #666;"></div>
                 <button id="pauseBtn" onclick="togglePause()" style="display: none; background: #ff9500;">⏸️ 暂停</button>
+                <button id="cancelBtn" onclick="cancelScan()" class="danger" style="display: none;">⏹️ 取消</button>
             </div>
         </div>
         
@@ -560,6 +4295,10 @@ HTML_TEMPLATE = '''<!DOCTYPE html>
 
     <script>
         let scanInterval;
+        let eventSource = null;
+        let currentJob = null;
+        let scanState = {};
+        let activeHosts = {};
         let selectedDeviceIp = null;
         
         // 加载网段配置
@@ -579,7 +4318,7 @@ HTML_TEMPLATE = '''<!DOCTYPE html>
         function saveNetwork() {
             const network = document.getElementById('networkInput').value.trim();
             if (!network) {
-                alert('请输入网段，如: 192.168.1.0/24');
+                alert('请输入网段，如: 192.168.1.0/24 或 10.0.0.0/22, 10.1.0.0/24');
                 return;
             }
             
@@ -614,13 +4353,15 @@ HTML_TEMPLATE = '''<!DOCTYPE html>
         
         // 测试网关连通性
         function testPing() {
-            const network = document.getElementById('currentNetwork').textContent;
-            if (network === '-') {
-                alert('请先设置网段');
-                return;
-            }
-            const gateway = network.replace('.0/24', '.1');
-            alert(`测试网关 ${gateway}...\n如果无响应，请检查网段设置是否正确。`);
+            fetch('/api/network')
+                .then(r => r.json())
+                .then(data => {
+                    if (!data.current_network) {
+                        alert('请先设置网段');
+                        return;
+                    }
+                    alert(`测试网关 ${data.gateway}...\n如果无响应，请检查网段设置是否正确。`);
+                });
         }
         
         function switchTab(tab) {
@@ -638,6 +4379,28 @@ HTML_TEMPLATE = '''<!DOCTYPE html>
             });
         }
         
+        function changeEngine(engine) {
+            fetch('/api/engine', {
+                method: 'POST',
+                headers: {'Content-Type': 'application/json'},
+                body: JSON.stringify({engine: engine})
+            });
+        }
+        
+        function changeDiscoveryMode(mode) {
+            fetch('/api/engine', {
+                method: 'POST',
+                headers: {'Content-Type': 'application/json'},
+                body: JSON.stringify({discovery_mode: mode})
+            });
+        }
+        
+        function portQuery() {
+            const portMode = document.getElementById('portModeSelect').value;
+            const portSpec = document.getElementById('portSpecInput').value.trim();
+            return `mode=${portMode}` + (portSpec ? `&ports=${encodeURIComponent(portSpec)}` : '');
+        }
+        
         function scanDevices() {
             setScanningState(true);
             document.getElementById('statusText').textContent = '正在发现内网设备...';
@@ -647,7 +4410,7 @@ HTML_TEMPLATE = '''<!DOCTYPE html>
                 .then(r => r.json())
                 .then(data => {
                     if (data.error) { alert(data.error); setScanningState(false); return; }
-                    scanInterval = setInterval(() => checkStatus('devices'), 1000);
+                    startMonitor('devices', data.job);
                 })
                 .catch(err => { alert('扫描失败: ' + err); setScanningState(false); });
         }
@@ -655,32 +4418,59 @@ HTML_TEMPLATE = '''<!DOCTYPE html>
         function scanSelectedDevicePorts() {
             if (!selectedDeviceIp) { alert('请先选择一个设备'); return; }
             setScanningState(true);
-            const portMode = document.getElementById('portModeSelect').value;
             document.getElementById('statusText').textContent = `正在扫描 ${selectedDeviceIp}...`;
             document.getElementById('progressDiv').style.display = 'block';
             
-            fetch(`/api/scan/ports/${selectedDeviceIp}?mode=${portMode}`)
+            fetch(`/api/scan/ports/${selectedDeviceIp}?${portQuery()}`)
                 .then(r => r.json())
                 .then(data => {
                     if (data.error) { alert(data.error); setScanningState(false); return; }
-                    scanInterval = setInterval(() => checkStatus('ports'), 1000);
+                    startMonitor('ports', data.job);
                 })
                 .catch(err => { alert('扫描失败: ' + err); setScanningState(false); });
         }
         
         function scanAll() {
             setScanningState(true);
-            const portMode = document.getElementById('portModeSelect').value;
             document.getElementById('statusText').textContent = '扫描中...';
             document.getElementById('scanningArea').style.display = 'block';
             document.getElementById('devicesList').innerHTML = '';
             document.getElementById('progressDiv').style.display = 'block';
             
-            fetch(`/api/scan/all?mode=${portMode}`)
+            const incremental = document.getElementById('incrementalCheck').checked ? '&incremental=1' : '';
+            fetch(`/api/scan/all?${portQuery()}${incremental}`)
                 .then(r => r.json())
                 .then(data => {
                     if (data.error) { alert(data.error); setScanningState(false); return; }
-                    scanInterval = setInterval(() => checkStatus('all'), 1000);
+                    startMonitor('all', data.job);
+                })
+                .catch(err => { alert('扫描失败: ' + err); setScanningState(false); });
+        }
+        
+        function checkResume() {
+            fetch('/api/scan/resume').then(r => r.json()).then(data => {
+                const btn = document.getElementById('resumeBtn');
+                btn.style.display = data.pending ? 'inline-block' : 'none';
+                if (data.pending) {
+                    btn.title = `开始于 ${data.started_at}, 已完成 ${data.hosts_done}` +
+                        (data.hosts_total !== null ? `/${data.hosts_total}` : '') + ' 台设备';
+                }
+            });
+        }
+        
+        function resumeScan() {
+            setScanningState(true);
+            document.getElementById('resumeBtn').style.display = 'none';
+            document.getElementById('statusText').textContent = '扫描中...';
+            document.getElementById('scanningArea').style.display = 'block';
+            document.getElementById('devicesList').innerHTML = '';
+            document.getElementById('progressDiv').style.display = 'block';
+            
+            fetch('/api/scan/resume', {method: 'POST'})
+                .then(r => r.json())
+                .then(data => {
+                    if (data.error) { alert(data.error); setScanningState(false); checkResume(); return; }
+                    startMonitor('all', data.job);
                 })
                 .catch(err => { alert('扫描失败: ' + err); setScanningState(false); });
         }
@@ -697,13 +4487,24 @@ HTML_TEMPLATE = '''<!DOCTYPE html>
                 pauseBtn.style.display = 'inline-block';
                 pauseBtn.textContent = '⏸️ 暂停';
                 pauseBtn.style.background = '#ff9500';
+                document.getElementById('cancelBtn').style.display = 'inline-block';
             } else {
                 document.getElementById('scanDevicesBtn').classList.remove('scanning');
                 document.getElementById('scanAllBtn').classList.remove('scanning');
                 pauseBtn.style.display = 'none';
+                document.getElementById('cancelBtn').style.display = 'none';
             }
         }
         
+        function cancelScan() {
+            if (!confirm('确定取消当前扫描?')) return;
+            fetch('/api/scan/cancel', {
+                method: 'POST',
+                headers: {'Content-Type': 'application/json'},
+                body: JSON.stringify({job: currentJob})
+            });
+        }
+        
         function togglePause() {
             const pauseBtn = document.getElementById('pauseBtn');
             const isPaused = pauseBtn.textContent.includes('继续');
@@ -711,7 +4512,7 @@ HTML_TEMPLATE = '''<!DOCTYPE html>
             fetch('/api/scan/pause', {
                 method: 'POST',
                 headers: {'Content-Type': 'application/json'},
-                body: JSON.stringify({paused: !isPaused})
+                body: JSON.stringify({paused: !isPaused, job: currentJob})
             }).then(r => r.json()).then(data => {
                 if (data.paused) {
                     pauseBtn.textContent = '▶️ 继续';
@@ -723,48 +4524,152 @@ HTML_TEMPLATE = '''<!DOCTYPE html>
             });
         }
         
-        function checkStatus(type) {
-            fetch('/api/scan/stream').then(r => r.json()).then(data => {
-                const progress = data.progress || 0;
-                document.getElementById('progressFill').style.width = progress + '%';
-                document.getElementById('progressText').textContent = progress + '%';
-                
-                let statusText = '就绪';
-                if (data.scanning) {
-                    if (type === 'devices') statusText = `发现设备中... ${progress}%`;
-                    else if (type === 'ports') statusText = `扫描端口 ${data.current_device || selectedDeviceIp}... ${progress}%`;
-                    else statusText = data.current_device ? `扫描中: ${data.current_device} (${progress}%)` : `扫描中... ${progress}%`;
-                }
-                document.getElementById('statusText').textContent = statusText;
-                
-                // 始终显示扫描区域和进度条当扫描中
-                if (data.scanning) {
-                    document.getElementById('scanningArea').style.display = 'block';
-                    document.getElementById('progressDiv').style.display = 'block';
-                    document.getElementById('scanningDevice').textContent = data.current_device || '扫描中...';
-                    
-                    const portsDiv = document.getElementById('foundPorts');
-                    if (data.found_ports && data.found_ports.length > 0) {
-                        portsDiv.innerHTML = data.found_ports.map(p => 
-                            `<span style="background: #007aff; color: white; padding: 6px 12px; border-radius: 8px; font-size: 13px; margin: 2px; display: inline-block;">${p.port}</span>`
-                        ).join('');
-                    } else {
-                        portsDiv.innerHTML = '<span style="color: #999; font-size: 13px;">等待发现开放端口...</span>';
-                    }
-                }
-                
-                if (!data.scanning) {
-                    clearInterval(scanInterval);
-                    setScanningState(false);
-                    document.getElementById('statusText').textContent = '扫描完成';
-                    setTimeout(() => {
-                        document.getElementById('progressDiv').style.display = 'none';
-                        document.getElementById('scanningArea').style.display = 'none';
-                    }, 2000);
-                    loadDevices();
-                }
-            }).catch(err => {
-                console.error('获取状态失败:', err);
+        // 扫描进度: 优先使用 SSE 推送增量事件, 不支持时退回带 since 游标的轮询
+        function startMonitor(type, job) {
+            stopMonitor();
+            currentJob = job;
+            scanState = {};
+            activeHosts = {};
+            renderFoundPorts([]);
+            
+            if (window.EventSource) {
+                eventSource = new EventSource(`/api/scan/events?job=${job}`);
+                ['snapshot', 'status', 'host_start', 'host_progress', 'host_done', 'port_open', 'port_service'].forEach(name => {
+                    eventSource.addEventListener(name, e => applyEvent(type, name, JSON.parse(e.data)));
+                });
+                return;
+            }
+            
+            let cursor = null;
+            scanInterval = setInterval(() => {
+                fetch(`/api/scan/stream?job=${job}` + (cursor !== null ? `&since=${cursor}` : ''))
+                    .then(r => r.json())
+                    .then(data => {
+                        if (data.events) {
+                            data.events.forEach(ev => applyEvent(type, ev.type, ev.data));
+                            applyEvent(type, 'status', data);
+                        } else {
+                            applyEvent(type, 'snapshot', data);
+                        }
+                        cursor = data.cursor;
+                    })
+                    .catch(err => console.error('获取状态失败:', err));
+            }, 1000);
+        }
+        
+        function stopMonitor() {
+            clearInterval(scanInterval);
+            if (eventSource) {
+                eventSource.close();
+                eventSource = null;
+            }
+        }
+        
+        function applyEvent(type, name, data) {
+            if (name === 'snapshot') {
+                activeHosts = {};
+                (data.active_hosts || []).forEach(h => activeHosts[h.ip] = h);
+                renderFoundPorts(data.found_ports || []);
+                renderHosts();
+                applyStatus(type, data);
+            } else if (name === 'status') {
+                applyStatus(type, data);
+            } else if (name === 'host_start') {
+                activeHosts[data.ip] = {ip: data.ip, scanned: 0, total: data.total, progress: 0, found: 0};
+                renderHosts();
+            } else if (name === 'host_progress') {
+                if (activeHosts[data.ip]) Object.assign(activeHosts[data.ip], data);
+                renderHosts();
+            } else if (name === 'host_done') {
+                delete activeHosts[data.ip];
+                renderHosts();
+            } else if (name === 'port_open') {
+                if (activeHosts[data.ip]) activeHosts[data.ip].found++;
+                appendFoundPort(data);
+                renderHosts();
+            } else if (name === 'port_service') {
+                const badge = document.querySelector(`#foundPorts [data-port="${data.ip}:${data.port}"]`);
+                if (badge) badge.outerHTML = portBadge(data);
+            }
+        }
+        
+        function applyStatus(type, fields) {
+            Object.assign(scanState, fields);
+            const progress = scanState.progress || 0;
+            document.getElementById('progressFill').style.width = progress + '%';
+            document.getElementById('progressText').textContent = progress + '%';
+            
+            if (!scanState.scanning) {
+                finishMonitor(type);
+                return;
+            }
+            
+            const currentDevice = Object.keys(activeHosts).join(', ');
+            let statusText;
+            if (type === 'devices') statusText = scanState.shard
+                ? `发现设备中... 分片 ${scanState.shard.index}/${scanState.shard.total} (${scanState.shard.range}) ${progress}%`
+                : `发现设备中... ${progress}%`;
+            else if (type === 'ports') statusText = `扫描端口 ${currentDevice || selectedDeviceIp}... ${progress}%`;
+            else {
+                const phase = scanState.phase ? `[${scanState.phase}] ` : '';
+                statusText = currentDevice ? `${phase}扫描中: ${currentDevice} (${progress}%)` : `${phase}扫描中... ${progress}%`;
+            }
+            document.getElementById('statusText').textContent = statusText;
+            
+            // 始终显示扫描区域和进度条当扫描中
+            document.getElementById('scanningArea').style.display = 'block';
+            document.getElementById('progressDiv').style.display = 'block';
+        }
+        
+        function finishMonitor(type) {
+            stopMonitor();
+            setScanningState(false);
+            document.getElementById('statusText').textContent = scanState.state === 'cancelled' ? '扫描已取消' : '扫描完成';
+            if (type === 'all' && document.getElementById('incrementalCheck').checked) showScanDiff();
+            setTimeout(() => {
+                document.getElementById('progressDiv').style.display = 'none';
+                document.getElementById('scanningArea').style.display = 'none';
+            }, 2000);
+            loadDevices();
+        }
+        
+        function renderHosts() {
+            const hosts = Object.values(activeHosts);
+            document.getElementById('scanningDevice').innerHTML = hosts.length > 0
+                ? hosts.map(h => `<div>${h.ip} — ${h.progress}% (${h.scanned}/${h.total}, 开放 ${h.found})</div>`).join('')
+                : '扫描中...';
+        }
+        
+        // banner/product 来自设备返回的数据, 插入页面前需要转义
+        function escapeHtml(text) {
+            return String(text).replace(/[&<>"']/g, c => ({'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'}[c]));
+        }
+        
+        function portBadge(p) {
+            // 服务识别结果 (port_service 事件) 到达后显示识别出的产品名, 悬停显示 banner
+            const product = p.product ? ` ${escapeHtml(p.product)}` : '';
+            return `<span data-port="${p.ip}:${p.port}" title="${escapeHtml(p.banner || '')}" style="background: #007aff; color: white; padding: 6px 12px; border-radius: 8px; font-size: 13px; margin: 2px; display: inline-block;">${p.ip ? p.ip + ':' : ''}${p.port}${product}</span>`;
+        }
+        
+        function renderFoundPorts(ports) {
+            document.getElementById('foundPorts').innerHTML = ports.length > 0
+                ? ports.map(portBadge).join('')
+                : '<span id="portsPlaceholder" style="color: #999; font-size: 13px;">等待发现开放端口...</span>';
+        }
+        
+        function appendFoundPort(p) {
+            const placeholder = document.getElementById('portsPlaceholder');
+            if (placeholder) placeholder.remove();
+            document.getElementById('foundPorts').insertAdjacentHTML('beforeend', portBadge(p));
+        }
+        
+        function showScanDiff() {
+            fetch('/api/scan/diff').then(r => r.json()).then(diff => {
+                if (!diff.hosts_appeared) return;
+                const count = obj => Object.values(obj).reduce((n, ports) => n + ports.length, 0);
+                document.getElementById('statusText').textContent =
+                    `增量扫描完成: 新增设备 ${diff.hosts_appeared.length}, 消失设备 ${diff.hosts_disappeared.length}, ` +
+                    `新开放端口 ${count(diff.ports_opened)}, 关闭端口 ${count(diff.ports_closed)}`;
             });
         }
         
@@ -790,7 +4695,7 @@ HTML_TEMPLATE = '''<!DOCTYPE html>
                             ${d.ports.map(p => `
                                 <div class="port-item" onclick="window.open('http://${d.ip}:${p.port}/', '_blank')">
                                     <span class="port-number">${p.port}</span>
-                                    <span style="flex: 1; margin: 0 12px; color: #333;">${p.service}</span>
+                                    <span style="flex: 1; margin: 0 12px; color: #333;" title="${escapeHtml(p.banner || '')}">${p.service}${p.product ? ` <span style="color: #8e8e93;">${escapeHtml(p.product)}</span>` : ''}</span>
                                     <span class="risk-${p.risk}">${p.risk}</span>
                                 </div>
                             `).join('')}
@@ -835,19 +4740,27 @@ HTML_TEMPLATE = '''<!DOCTYPE html>
         window.onload = () => {
             loadNetworkConfig();
             loadDevices();
+            checkResume();
         };
     </script>
 </body>
 </html>'''
 
+@app.before_request
+def ensure_data():
+    # 通过 WSGI 服务器 (不经过 __main__) 运行时, 在第一个请求时打开数据库
+    if not DATA_READY:
+        init_data()
+
 @app.route('/api/network', methods=['GET', 'POST', 'DELETE'])
 def api_network():
     """获取/设置/重置网段配置"""
     if request.method == 'GET':
         return jsonify({
-            'auto_network': scanner._get_network(),
+            'auto_network': scanner._detected("network"),
             'custom_network': scanner.custom_network,
-            'current_network': scanner.network
+            'current_network': scanner.network,
+            'gateway': scanner.gateway
         })
     
     elif request.method == 'POST':
@@ -857,10 +4770,11 @@ def api_network():
         if not network:
             return jsonify({'success': False, 'message': '网段不能为空'})
         
-        # 验证网段格式 (如 192.168.1.0/24)
-        import re
-        if not re.match(r'^\d{1,3}\.\d{1,3}\.\d{1,3}\.0/24$', network):
-            return jsonify({'success': False, 'message': '网段格式错误，应为 x.x.x.0/24'})
+        # 验证网段格式, 支持任意CIDR及多个网段 (如 192.168.0.0/22, 10.0.0.0/16)
+        try:
+            network = ', '.join(map(str, parse_networks(network)))
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)})
         
         if scanner.save_custom_network(network):
             return jsonify({'success': True, 'message': f'网段已设置为 {network}'})
@@ -874,111 +4788,287 @@ def api_network():
 def index():
     return HTML_TEMPLATE
 
+def _submit_job(kind, fn, *args, priority="normal", key=None, params=None, **extra):
+    """提交扫描任务并返回接口响应; 相同 key 的任务未完成时返回 409 和该任务编号"""
+    try:
+        job, created = JOBS.submit(kind, fn, *args, priority=JOB_PRIORITIES[priority], key=key, params=params)
+    except queue.Full as e:
+        return jsonify({"error": str(e)}), 429
+    if not created:
+        return jsonify({"error": "扫描进行中", "job": job.id}), 409
+    return jsonify(dict({"status": "started", "job": job.id}, **extra))
+
 @app.route('/api/scan/devices')
 def api_scan_devices():
-    global SCAN_CACHE
-    
-    if SCAN_STATUS["scanning"]:
-        return jsonify({"error": "扫描进行中"}), 400
-    
-    SCAN_STATUS["scanning"] = True
-    SCAN_STATUS["paused"] = False
-    SCAN_STATUS["progress"] = 0
-    SCAN_STATUS["current_device"] = "正在发现设备..."
-    
-    def scan_task():
-        global SCAN_CACHE
-        try:
-            found_devices = scanner.ping_scan()
-            for ip, mac, name in found_devices:
-                if ip not in SCAN_CACHE:
-                    SCAN_CACHE[ip] = {
-                        "ip": ip,
-                        "mac": mac,
-                        "vendor": "未知",
-                        "type": "",
-                        "ports": [],
-                        "last_seen": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    }
-            SCAN_STATUS["progress"] = 100
-            SCAN_STATUS["scanning"] = False
-        except Exception as e:
-            print(f"[错误] {e}")
-            SCAN_STATUS["scanning"] = False
-    
-    threading.Thread(target=scan_task, daemon=True).start()
-    return jsonify({"status": "started"})
+    return _submit_job("devices", run_device_discovery, key="devices", params={"network": scanner.network})
 
 @app.route('/api/scan/ports/<ip>')
 def api_scan_ports(ip):
-    if SCAN_STATUS["scanning"]:
-        return jsonify({"error": "扫描进行中"}), 400
-    
     if ip not in SCAN_CACHE:
         return jsonify({"error": "设备不存在"}), 404
     
     port_mode = request.args.get('mode', 'common')
-    fast_mode = (port_mode == 'common')
+    try:
+        fast_mode, port_spec = resolve_port_mode(port_mode, request.args.get('ports'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     
-    SCAN_STATUS["scanning"] = True
-    SCAN_STATUS["paused"] = False
-    SCAN_STATUS["current_device"] = ip
-    SCAN_STREAM["found_ports"] = []
+    def port_progress(scanned, total_ports):
+        stream_host_progress(ip, scanned, total_ports)
+        update_status(progress=int(scanned * 100 / max(1, total_ports)))
     
     def scan_task():
+        stream_host_start(ip, 0)
         try:
-            ports = scanner.scan_ports(ip, fast_mode=fast_mode)
+            ports = scanner.scan_ports(ip, ports=port_spec, fast_mode=fast_mode, progress_callback=port_progress,
+                                       found_callback=lambda port_info: stream_port_found(ip, port_info))
+        finally:
+            stream_host_done(ip)
+        scanner.fingerprint_devices([{"ip": ip, "mac": SCAN_CACHE.get(ip, {}).get("mac"), "ports": ports}])
+        if ip in SCAN_CACHE:
             SCAN_CACHE[ip]["ports"] = ports
             SCAN_CACHE[ip]["last_seen"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            SCAN_STATUS["scanning"] = False
-        except Exception as e:
-            print(f"[错误] {e}")
-            SCAN_STATUS["scanning"] = False
+            STORE.save_run("ports", [SCAN_CACHE[ip]], params={"ip": ip, "ports": str(port_spec or port_mode)},
+                           complete=False, port_scope=port_scope(port_spec, fast_mode))
+        return ports
     
-    threading.Thread(target=scan_task, daemon=True).start()
-    return jsonify({"status": "started"})
+    # 单台设备扫描优先级最高, 可以与全网扫描同时进行或暂时抢占它
+    return _submit_job("ports", scan_task, priority="high", key=f"ports:{ip}",
+                       params={"ip": ip, "ports": str(port_spec or port_mode)})
 
 @app.route('/api/scan/all')
 def api_scan_all():
-    global SCAN_CACHE
+    port_mode = request.args.get('mode', 'common')
+    try:
+        fast_mode, port_spec = resolve_port_mode(port_mode, request.args.get('ports'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     
-    if SCAN_STATUS["scanning"]:
-        return jsonify({"error": "扫描进行中"}), 400
+    network = request.args.get('network') or None
+    if network:
+        try:
+            parse_networks(network)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
     
-    port_mode = request.args.get('mode', 'common')
-    fast_mode = (port_mode == 'common')
+    # 增量模式需要已有的扫描结果, 没有时退回完整扫描; 分布式扫描需要先添加代理
+    distributed = request.args.get('distributed') in ('1', 'true')
+    if distributed and not COORDINATOR.has_agents():
+        return jsonify({"error": "没有可用的代理, 请先通过 /api/agents 添加"}), 400
+    incremental = not distributed and request.args.get('incremental') in ('1', 'true') and bool(SCAN_CACHE)
+    
+    return _submit_job("all", run_full_scan, fast_mode, port_spec, incremental, network, distributed,
+                       priority="normal", key="all",
+                       params={"ports": str(port_spec or port_mode), "incremental": incremental,
+                               "distributed": distributed, "network": network or scanner.network},
+                       incremental=incremental)
+
+@app.route('/api/scan/resume', methods=['GET', 'POST', 'DELETE'])
+def api_scan_resume():
+    """查看/继续/放弃上次中断的全网扫描"""
+    pending = JOURNAL.pending()
+    if request.method == 'GET':
+        if not pending:
+            return jsonify({"pending": False})
+        return jsonify({
+            "pending": True,
+            "job": pending["job"],
+            "started_at": pending["started_at"],
+            "hosts_total": len(pending["hosts"]) if pending["hosts"] is not None else None,
+            "hosts_done": len(pending["devices"]),
+        })
+    
+    if not pending:
+        return jsonify({"error": "没有中断的扫描"}), 404
+    if any(job.key == "all" for job in JOBS.active()):
+        return jsonify({"error": "扫描进行中"}), 409
+    if request.method == 'DELETE':
+        JOURNAL.discard()
+        return jsonify({"success": True})
     
-    SCAN_STATUS["scanning"] = True
+    job = pending["job"]
+    port_spec = parse_ports(job["ports"]) if job.get("ports") else None
     
     def scan_task():
-        global SCAN_CACHE
-        devices = scanner.discovery(fast_mode=fast_mode)
-        SCAN_CACHE = {d['ip']: d for d in devices}
-        SCAN_STATUS["scanning"] = False
+        before = list(SCAN_CACHE)
+        devices = scanner.discovery(fast_mode=job.get("fast_mode", False), ports=port_spec, resume=pending,
+                                    network=job.get("network"))
+        merge_scan_results(devices, before, parse_networks(job["network"]) if job.get("network") else None)
+        return [d['ip'] for d in devices]
     
-    threading.Thread(target=scan_task, daemon=True).start()
-    return jsonify({"status": "started"})
+    return _submit_job("all", scan_task, key="all", params={"resume": pending["started_at"]})
+
+@app.route('/api/schedules', methods=['GET', 'POST'])
+def api_schedules():
+    """定时扫描计划: GET 列出, POST 新增 {"kind", "interval" 或 "cron", "network", "mode", "ports", "jitter"}"""
+    if request.method == 'GET':
+        return jsonify(SCHEDULER.list())
+    try:
+        schedule = SCHEDULER.add(request.json or {})
+    except (ValueError, TypeError) as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    return jsonify({"success": True, "schedule": schedule})
+
+@app.route('/api/schedules/<int:schedule_id>', methods=['DELETE'])
+def api_schedule_delete(schedule_id):
+    return jsonify({"success": SCHEDULER.remove(schedule_id)})
+
+@app.route('/api/scan/diff')
+def api_scan_diff():
+    """最近一次增量扫描相对上一次结果的变化"""
+    return jsonify(LAST_SCAN_DIFF or {})
+
+@app.route('/api/history/<ip>')
+def api_history(ip):
+    """设备的历史记录, ?port= 只看单个端口 (含首次开放时间)"""
+    port = request.args.get('port', type=int)
+    history = STORE.host_history(ip, port=port, limit=request.args.get('limit', 200, type=int))
+    if history["host"] is None:
+        return jsonify({"error": "没有该设备的历史记录"}), 404
+    if port is not None:
+        history["first_open"] = STORE.first_open(ip, port)
+    return jsonify(history)
+
+@app.route('/api/runs')
+def api_runs():
+    return jsonify(STORE.recent_runs(limit=request.args.get('limit', 50, type=int)))
 
 @app.route('/api/status')
 def api_status():
-    return jsonify(SCAN_STATUS)
+    """默认展示的任务状态, 附带所有未完成任务和速率控制状态"""
+    status = JOBS.primary().status_snapshot()
+    status["speed_mode"] = scanner.speed_mode
+    status["jobs"] = [job.snapshot() for job in JOBS.active()]
+    status["rate"] = rate_snapshot()
+    return jsonify(status)
+
+@app.route('/api/jobs')
+def api_jobs():
+    return jsonify([job.snapshot() for job in JOBS.jobs()])
+
+@app.route('/api/jobs/<int:job_id>')
+def api_job(job_id):
+    job = JOBS.get(job_id)
+    if job is None:
+        return jsonify({"error": "任务不存在"}), 404
+    return jsonify(job.snapshot(include_result=request.args.get('result') in ('1', 'true')))
+
+def _request_job():
+    """?job=<编号> 指定的任务, 未指定时为默认展示的任务; 编号不存在时返回 None"""
+    job_id = request.args.get('job', type=int)
+    return JOBS.primary() if job_id is None else JOBS.get(job_id)
+
+def _stream_status(job):
+    status = job.status_snapshot()
+    return {key: status[key] for key in ("job", "state", "scanning", "paused", "current_device", "progress", "shard", "phase")}
+
+def _job_events(events, job_id):
+    return events if job_id is None else [event for event in events if event["data"].get("job") == job_id]
 
 @app.route('/api/scan/stream')
 def api_scan_stream():
-    return jsonify({
-        "scanning": SCAN_STATUS["scanning"],
-        "paused": SCAN_STATUS.get("paused", False),
-        "current_device": SCAN_STATUS.get("current_device", ""),
-        "progress": SCAN_STATUS["progress"],
-        "found_ports": SCAN_STREAM.get("found_ports", []),
+    """轮询接口; 带 since=<序号> 时只返回该序号之后的事件, 不再重复返回全部已发现端口"""
+    job = _request_job()
+    if job is None:
+        return jsonify({"error": "任务不存在"}), 404
+    job_filter = request.args.get('job', type=int)
+    since = request.args.get('since', type=int)
+    if since is not None:
+        cursor = SCAN_EVENTS.last_seq
+        events, complete = SCAN_EVENTS.since(since)
+        if complete:
+            result = _stream_status(job)
+            result.update({"events": _job_events(events, job_filter), "cursor": events[-1]["seq"] if events else cursor})
+            return jsonify(result)
+    
+    # 首次请求或游标已过期: 返回完整快照和当前游标
+    cursor = SCAN_EVENTS.last_seq
+    snapshot = job.stream_snapshot()
+    result = _stream_status(job)
+    result.update({
+        "found_ports": snapshot["found_ports"],
+        "active_hosts": snapshot["active_hosts"],
+        "completed_devices": snapshot["completed_devices"],
+        "cursor": cursor,
     })
+    return jsonify(result)
+
+@app.route('/api/scan/events')
+def api_scan_events():
+    """Server-Sent Events 推送扫描事件, 断线重连时浏览器会带上 Last-Event-ID 只补发增量
+    
+    ?job=<编号> 只推送该任务的事件
+    """
+    job = _request_job()
+    if job is None:
+        return jsonify({"error": "任务不存在"}), 404
+    job_filter = request.args.get('job', type=int)
+    last_id = request.headers.get('Last-Event-ID') or request.args.get('since')
+    last_id = int(last_id) if last_id and last_id.isdigit() else None
+    
+    def sse(seq, event_type, data):
+        return f"id: {seq}\nevent: {event_type}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+    
+    def generate():
+        cursor = last_id
+        if cursor is not None:
+            events, complete = SCAN_EVENTS.since(cursor)
+            if not complete:
+                cursor = None
+        if cursor is None:
+            cursor = SCAN_EVENTS.last_seq
+            snapshot = dict(_stream_status(job), **job.stream_snapshot())
+            yield "retry: 2000\n" + sse(cursor, "snapshot", snapshot)
+        while True:
+            events, complete = SCAN_EVENTS.wait(cursor, timeout=15)
+            if not complete:
+                # 客户端太慢, 缓冲区已覆盖未读事件: 重新发送快照
+                cursor = SCAN_EVENTS.last_seq
+                yield sse(cursor, "snapshot", dict(_stream_status(job), **job.stream_snapshot()))
+                continue
+            if not events:
+                yield ": keepalive\n\n"
+                continue
+            for event in _job_events(events, job_filter):
+                yield sse(event["seq"], event["type"], event["data"])
+            cursor = events[-1]["seq"]
+    
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+def _target_jobs(data):
+    """请求中 job 指定的任务, 未指定时为所有未完成的任务; 编号不存在时返回 None"""
+    if data.get('job') is None:
+        return JOBS.active()
+    job = JOBS.get(data['job'])
+    return [job] if job is not None else None
 
 @app.route('/api/scan/pause', methods=['POST'])
 def api_scan_pause():
+    """暂停/继续指定任务 (job), 未指定时作用于所有未完成的任务"""
     data = request.json or {}
     paused = data.get('paused', True)
-    SCAN_STATUS["paused"] = paused
-    return jsonify({"paused": paused})
+    jobs = _target_jobs(data)
+    if jobs is None:
+        return jsonify({"error": "任务不存在"}), 404
+    for job in jobs:
+        if paused:
+            job.pause()
+        else:
+            job.resume()
+    return jsonify({"paused": paused, "jobs": [job.id for job in jobs]})
+
+@app.route('/api/scan/cancel', methods=['POST'])
+def api_scan_cancel():
+    """取消指定任务 (job), 未指定时取消所有未完成的任务"""
+    jobs = _target_jobs(request.json or {})
+    if jobs is None:
+        return jsonify({"error": "任务不存在"}), 404
+    for job in jobs:
+        JOBS.cancel(job)
+    return jsonify({"success": True, "jobs": [job.id for job in jobs]})
 
 @app.route('/api/devices')
 def api_devices():
@@ -1013,28 +5103,323 @@ def api_speed():
         return jsonify({"success": True, "message": f"已切换到{SCAN_SPEED[mode]['name']}模式"})
     return jsonify({"success": False})
 
+@app.route('/api/engine', methods=['POST'])
+def api_engine():
+    """切换端口扫描引擎 / 设备发现引擎 / 设备发现方式 / TCP探测端口 / 服务识别开关"""
+    data = request.json or {}
+    messages = []
+    
+    if 'engine' in data:
+        if not scanner.set_engine(data['engine']):
+            return jsonify({"success": False})
+        messages.append(f"已切换到{SCAN_ENGINES[data['engine']]['name']}引擎")
+    
+    if 'ping_engine' in data:
+        if not scanner.set_ping_engine(data['ping_engine']):
+            return jsonify({"success": False})
+        messages.append(f"已切换到{PING_ENGINES[data['ping_engine']]['name']}设备发现")
+    
+    if 'discovery_mode' in data:
+        if not scanner.set_discovery_mode(data['discovery_mode']):
+            return jsonify({"success": False})
+        messages.append(f"设备发现方式: {DISCOVERY_MODES[data['discovery_mode']]['name']}")
+    
+    if 'probe_ports' in data:
+        try:
+            scanner.probe_ports = list(PortSpec(data['probe_ports']))[:32]
+        except ValueError as e:
+            return jsonify({"success": False, "message": str(e)})
+        messages.append(f"TCP探测端口: {','.join(map(str, scanner.probe_ports))}")
+    
+    if 'fingerprint' in data:
+        scanner.fingerprint_enabled = bool(data['fingerprint'])
+        messages.append(f"服务识别: {'开启' if scanner.fingerprint_enabled else '关闭'}")
+    
+    if not messages:
+        return jsonify({"success": False})
+    return jsonify({"success": True, "message": "，".join(messages)})
+
+# /api/export: 设备逐台序列化并合并成约 chunk_size 字节的块输出, 内存占用与导出规模无关
+EXPORT = {"formats": {"json": "application/json", "ndjson": "application/x-ndjson", "csv": "text/csv"},
+          "chunk_size": 64 * 1024}
+EXPORT_HOST_FIELDS = ["ip", "mac", "name", "vendor", "type", "rtt_ms", "last_seen"]
+EXPORT_PORT_FIELDS = ["port", "service", "risk", "risk_desc", "product", "banner"]
+RISK_ALIASES = {"high": "高", "medium": "中", "low": "低"}
+CSV_FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+def csv_cell(value):
+    """以公式字符开头的文本前加 ' , 避免 Excel 等把设备名/banner 当作公式执行"""
+    if isinstance(value, str) and value.startswith(CSV_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+def parse_ip_ranges(spec):
+    """解析逗号分隔的地址、CIDR 或 起始-结束 范围, 返回 [(起始, 结束)] 整数区间"""
+    ranges = []
+    for part in re.split(r'[,\s;]+', str(spec).strip()):
+        if not part:
+            continue
+        try:
+            if '-' in part:
+                start, end = (int(ipaddress.IPv4Address(x.strip())) for x in part.split('-', 1))
+            else:
+                network = ipaddress.IPv4Network(part, strict=False)
+                start, end = int(network.network_address), int(network.broadcast_address)
+        except ValueError:
+            raise ValueError(f"IP范围格式错误: {part}")
+        ranges.append((min(start, end), max(start, end)))
+    return ranges
+
+def parse_since(value):
+    """Unix 时间戳或 "YYYY-MM-DD[ HH:MM:SS]", 返回与 last_seen 相同格式的字符串"""
+    try:
+        return datetime.fromtimestamp(float(value)).strftime("%Y-%m-%d %H:%M:%S")
+    except (ValueError, OverflowError, OSError):
+        pass
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(value, fmt).strftime("%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            continue
+    raise ValueError(f"时间格式错误: {value}")
+
+def export_filter(ip=None, port=None, risk=None, since=None):
+    """构造导出过滤函数: 返回过滤后的设备 (指定 port/risk 时只保留匹配的端口), 不匹配时返回 None"""
+    ranges = parse_ip_ranges(ip) if ip else None
+    ports = PortSpec(port) if port else None
+    risks = {RISK_ALIASES.get(r.lower(), r) for r in re.split(r'[,\s]+', risk.strip()) if r} if risk else None
+    
+    def apply(device):
+        if since and (device.get("last_seen") or "") < since:
+            return None
+        if ranges:
+            address = int(ipaddress.IPv4Address(device["ip"]))
+            if not any(start <= address <= end for start, end in ranges):
+                return None
+        if ports is None and risks is None:
+            return device
+        matched = [p for p in device.get("ports") or []
+                   if (ports is None or p["port"] in ports) and (risks is None or p.get("risk") in risks)]
+        return dict(device, ports=matched) if matched else None
+    
+    return apply
+
+def export_lines(devices, fmt):
+    """设备流转换为 fmt 格式的文本片段: json 为紧凑的 {"devices": [...]}, ndjson 每行一台设备,
+    csv 每行一个端口 (没有开放端口的设备占一行, 端口列为空)
+    """
+    if fmt == "ndjson":
+        for device in devices:
+            yield json.dumps(device, ensure_ascii=False, separators=(',', ':')) + "\n"
+    elif fmt == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_HOST_FIELDS + EXPORT_PORT_FIELDS)
+        yield "\ufeff" + buffer.getvalue()  # BOM, Excel 才能正确识别 UTF-8 中文
+        for device in devices:
+            buffer.seek(0)
+            buffer.truncate()
+            host = [csv_cell(device.get(field)) for field in EXPORT_HOST_FIELDS]
+            for port_info in device.get("ports") or [{}]:
+                writer.writerow(host + [csv_cell(port_info.get(field)) for field in EXPORT_PORT_FIELDS])
+            yield buffer.getvalue()
+    else:
+        yield '{"devices":['
+        for index, device in enumerate(devices):
+            yield ("," if index else "") + json.dumps(device, ensure_ascii=False, separators=(',', ':'))
+        yield ']}'
+
+def export_chunks(lines, compress=False):
+    """把文本片段合并成约 EXPORT["chunk_size"] 字节的块, compress 时逐块 gzip 压缩"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None  # wbits=31: gzip 格式
+    pending, size = [], 0
+    for line in lines:
+        data = line.encode("utf-8")
+        pending.append(data)
+        size += len(data)
+        if size < EXPORT["chunk_size"]:
+            continue
+        chunk = b"".join(pending)
+        pending, size = [], 0
+        chunk = compressor.compress(chunk) if compressor else chunk
+        if chunk:
+            yield chunk
+    chunk = b"".join(pending)
+    if compressor:
+        chunk = compressor.compress(chunk) + compressor.flush()
+    if chunk:
+        yield chunk
+
 @app.route('/api/export')
 def api_export():
-    devices = list(SCAN_CACHE.values())
-    output = json.dumps({'devices': devices}, ensure_ascii=False, indent=2)
-    response = Response(output, mimetype='application/json')
-    response.headers['Content-Disposition'] = 'attachment; filename=scan_export.json'
+    """流式导出设备和开放端口
+    
+    format=json (默认) / ndjson / csv; source=cache (当前结果, 默认) / store (历史库中的在线设备); gzip=1 压缩;
+    过滤: ip= 地址/CIDR/起止范围 (逗号分隔), port= 端口规格, risk= 高,中,低 (或 high,medium,low),
+    since= Unix 时间戳或日期 (最近发现时间不早于此)
+    """
+    fmt = request.args.get('format', 'json').lower()
+    if fmt not in EXPORT["formats"]:
+        return jsonify({"error": f"不支持的导出格式: {fmt}"}), 400
+    try:
+        since = parse_since(request.args['since']) if request.args.get('since') else None
+        keep = export_filter(ip=request.args.get('ip'), port=request.args.get('port'),
+                             risk=request.args.get('risk'), since=since)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    if request.args.get('source') == 'store':
+        devices = STORE.iter_devices(since=since)
+    else:
+        devices = sorted(SCAN_CACHE.values(), key=lambda d: ipaddress.IPv4Address(d["ip"]))
+    devices = (device for device in map(keep, devices) if device is not None)
+    
+    compress = request.args.get('gzip') in ('1', 'true')
+    filename = f"scan_export.{fmt}" + (".gz" if compress else "")
+    response = Response(export_chunks(export_lines(devices, fmt), compress),
+                        mimetype='application/gzip' if compress else EXPORT["formats"][fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
     return response
 
+@app.route('/metrics')
+def metrics():
+    """Prometheus 文本格式的运行指标"""
+    return Response(METRICS.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/api/trace', methods=['GET', 'POST'])
+def api_trace():
+    """GET 查看追踪开关和最近记录的任务; POST {"enabled": true/false} 开启/关闭追踪 (对之后开始的任务生效)"""
+    if request.method == 'POST':
+        TRACE["enabled"] = bool((request.json or {}).get("enabled"))
+        print(f"[追踪] {'开启' if TRACE['enabled'] else '关闭'}")
+    return jsonify({"enabled": TRACE["enabled"], "runs": [run.summary() for run in list(TRACE_RUNS)]})
+
+@app.route('/api/trace/export')
+def api_trace_export():
+    """最近任务的追踪记录, Chrome trace-event JSON (chrome://tracing / Perfetto); ?job=ID 只导出一个任务"""
+    runs = list(TRACE_RUNS)
+    if request.args.get('job'):
+        runs = [run for run in runs if str(run.job_id) == request.args['job']]
+        if not runs:
+            return jsonify({"error": "没有该任务的追踪记录"}), 404
+    events = [event for run in runs for event in run.chrome_events()]
+    return Response(json.dumps({"traceEvents": events, "displayTimeUnit": "ms"}, ensure_ascii=False),
+                    mimetype='application/json',
+                    headers={'Content-Disposition': 'attachment; filename=scan_trace.json'})
+
+def _agent_authorized():
+    token = AGENT["token"]
+    return bool(token) and hmac.compare_digest(request.headers.get("X-HPM-Token", ""), token)
+
+@app.route('/api/agent/info')
+def api_agent_info():
+    """代理信息, 协调者添加代理和检查连通性时调用"""
+    if not _agent_authorized():
+        return jsonify({"error": "未授权"}), 403
+    return jsonify({"agent": AGENT_MODE, "network": scanner.network, "engine": scanner.engine,
+                    "speed_mode": scanner.speed_mode, "cpus": os.cpu_count(), "jobs": len(JOBS.active())})
+
+@app.route('/api/agent/shard', methods=['POST'])
+def api_agent_shard():
+    """执行协调者下发的扫描分片, 以 NDJSON 流式返回结果; 协调者断开连接时取消扫描"""
+    if not _agent_authorized():
+        return jsonify({"error": "未授权"}), 403
+    shard = request.json or {}
+    if not shard.get("hosts"):
+        return jsonify({"error": "分片没有主机"}), 400
+    events = queue.Queue()
+    
+    def task():
+        try:
+            run_agent_shard(shard, events.put)
+        except ScanCancelled:
+            raise
+        except Exception as e:
+            events.put({"type": "error", "error": str(e)})
+            raise
+        events.put({"type": "done"})
+    
+    try:
+        job, _ = JOBS.submit("agent", task, params={"hosts": len(shard["hosts"]),
+                                                    "discover": bool(shard.get("discover"))})
+    except queue.Full as e:
+        return jsonify({"error": str(e)}), 429
+    
+    def generate():
+        finished = False
+        try:
+            while not finished:
+                try:
+                    event = events.get(timeout=AGENT["heartbeat"])
+                except queue.Empty:
+                    if job.state not in ("queued", "running"):
+                        event = {"type": "error", "error": job.error or job.state}
+                    else:
+                        event = {"type": "heartbeat"}
+                finished = event["type"] in ("done", "error")
+                yield json.dumps(event, ensure_ascii=False) + "\n"
+        finally:
+            if not finished:
+                JOBS.cancel(job)
+    
+    return Response(generate(), mimetype='application/x-ndjson')
+
+@app.route('/api/agents', methods=['GET', 'POST', 'DELETE'])
+def api_agents():
+    """分布式扫描代理: GET 列出, POST {"url", "token", "networks"} 添加, DELETE ?url= 删除"""
+    if request.method == 'POST':
+        data = request.json or {}
+        try:
+            agent = COORDINATOR.add(data.get("url"), data.get("token", ""), data.get("networks"))
+        except ValueError as e:
+            return jsonify({"success": False, "message": str(e)}), 400
+        return jsonify({"success": True, "agent": agent})
+    if request.method == 'DELETE':
+        if not COORDINATOR.remove(request.args.get("url", "")):
+            return jsonify({"success": False, "message": "代理不存在"}), 404
+        return jsonify({"success": True})
+    return jsonify(COORDINATOR.list())
+
 @app.route('/api/clear', methods=['POST'])
 def api_clear():
     global SCAN_CACHE
-    if SCAN_STATUS.get("scanning", False):
+    if JOBS.active():
         return jsonify({'success': False, 'message': '扫描进行中'})
     
     SCAN_CACHE.clear()
     return jsonify({'success': True})
 
 if __name__ == '__main__':
-    print("""
+    import argparse
+    parser = argparse.ArgumentParser(description="家庭网络端口管理器")
+    parser.add_argument("--agent", action="store_true", help="代理模式: 接受协调者下发的扫描分片")
+    parser.add_argument("--host", default="0.0.0.0", help="监听地址")
+    parser.add_argument("--port", type=int, help="监听端口 (默认 2333, 代理模式 2334)")
+    parser.add_argument("--token", help="代理认证 token (默认取 HPM_AGENT_TOKEN)")
+    args = parser.parse_args()
+    
+    if args.token:
+        AGENT["token"] = args.token
+    init_data()
+    print(f"[启动] 就绪, 共 {(time.perf_counter() - STARTUP_STARTED) * 1000:.1f}ms")
+    if AGENT_MODE:
+        port = args.port or 2334
+        if not AGENT["token"]:
+            AGENT["token"] = secrets.token_hex(16)
+            print(f"[代理] 未指定 token, 已生成: {AGENT['token']}")
+        print(f"""
+==========================================
+   家庭网络端口管理器 - 扫描代理
+==========================================
+协调者添加代理: POST /api/agents {{"url": "http://<本机地址>:{port}", "token": "..."}}
+    """)
+    else:
+        port = args.port or 2333
+        SCHEDULER.start()
+        print(f"""
 ==========================================
    家庭网络端口管理器 (Home Port Manager)
 ==========================================
-访问: http://0.0.0.0:2333
+访问: http://{args.host}:{port}
     """)
-    app.run(host='0.0.0.0', port=2333, debug=False, threaded=True)
+    app.run(host=args.host, port=port, debug=False, threaded=True)
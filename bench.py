@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+家庭网络端口管理器 - 扫描性能基准测试
+
+在 127.0.0.0/8 的回环地址上启动本地监听端口, 不需要真实局域网:
+    开放端口   正常监听并接受连接
+    关闭端口   没有监听, 内核直接回复RST
+    过滤端口   监听队列已占满, 新的SYN被丢弃, 模拟防火墙过滤 (连接超时)
+
+分别用各扫描引擎/速度模式运行 scan_ports、多主机端口扫描、ping_scan 和 discovery,
+统计 端口/秒、主机/秒、探测延迟 p50/p99、峰值线程数、文件描述符数和内存占用,
+结果保存为 JSON, 可与其他版本的结果对比
+
+使用方法:
+    python bench.py                                  # 默认配置, 结果写入 bench_results.json
+    python bench.py --hosts 8 --ports 5000 --repeat 3
+    python bench.py --compare old_results.json       # 与旧版本结果对比
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import multiprocessing
+from datetime import datetime
+
+HOST_PREFIX = "127.77"
+
+# ======== 本地监听 ========
+
+def bench_hosts(count):
+    """基准测试使用的回环地址, 位于 127.77.0.0/24"""
+    return [f"{HOST_PREFIX}.0.{i}" for i in range(1, count + 1)]
+
+def port_layout(args):
+    """每台主机的 (开放端口, 过滤端口), 按 seed 固定, 多次运行结果可比"""
+    rng = random.Random(args.seed)
+    ports = range(args.base_port, args.base_port + args.ports)
+    layout = {}
+    for ip in bench_hosts(args.hosts):
+        chosen = rng.sample(ports, args.open + args.filtered)
+        layout[ip] = (sorted(chosen[:args.open]), sorted(chosen[args.open:]))
+    return layout
+
+def serve(layout, ready):
+    """监听进程: 开放端口接受连接后立即关闭, 过滤端口占满监听队列后不再接受连接"""
+    import selectors
+    selector = selectors.DefaultSelector()
+    keep = []
+    for ip, (open_ports, filtered_ports) in layout.items():
+        for port in open_ports:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind((ip, port))
+            sock.listen(1024)
+            sock.setblocking(False)
+            selector.register(sock, selectors.EVENT_READ)
+            keep.append(sock)
+        for port in filtered_ports:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind((ip, port))
+            sock.listen(0)
+            keep.append(sock)
+            for _ in range(3):
+                filler = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                filler.setblocking(False)
+                filler.connect_ex((ip, port))
+                keep.append(filler)
+    ready.set()
+    while True:
+        for key, _ in selector.select():
+            try:
+                conn, _ = key.fileobj.accept()
+                conn.close()
+            except OSError:
+                pass
+
+def start_listeners(layout):
+    ready = multiprocessing.Event()
+    process = multiprocessing.Process(target=serve, args=(layout, ready), daemon=True)
+    process.start()
+    if not ready.wait(30):
+        process.terminate()
+        raise RuntimeError("监听进程启动失败")
+    # 等待过滤端口的占位连接完成握手
+    time.sleep(0.2)
+    return process
+
+# ======== 资源采样 ========
+
+def _fd_count():
+    try:
+        return len(os.listdir('/proc/self/fd'))
+    except OSError:
+        return None
+
+def _rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1048576
+    except (OSError, ValueError):
+        import resource
+        # 没有 /proc 时只能取进程历史峰值 (Linux 为KB, macOS 为字节)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1048576 if sys.platform == 'darwin' else peak / 1024
+
+class ResourceSampler:
+    """后台线程定时采样线程数/文件描述符数/RSS, 记录峰值"""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = {"threads": 0, "fds": 0, "rss_mb": 0.0}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        self.peak["threads"] = max(self.peak["threads"], threading.active_count())
+        fds = _fd_count()
+        if fds is not None:
+            self.peak["fds"] = max(self.peak["fds"], fds)
+        self.peak["rss_mb"] = max(self.peak["rss_mb"], _rss_mb())
+
+    def __enter__(self):
+        self._sample()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+        # 采样线程本身不计入
+        self.peak["threads"] -= 1
+        self.peak["rss_mb"] = round(self.peak["rss_mb"], 1)
+
+def percentile(samples, pct):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+# ======== 测试场景 ========
+
+class Bench:
+    def __init__(self, app, args, layout):
+        self.app = app
+        self.args = args
+        self.layout = layout
+        self.hosts = list(layout)
+        self.ports = app.PortSpec(f"{args.base_port}-{args.base_port + args.ports - 1}")
+        self.scanner = app.scanner
+        self.scanner.fingerprint_enabled = False
+        self.results = []
+
+    def _reset(self):
+        """每次运行前清空RTT样本, 避免自适应超时受上一次运行影响; 返回探测延迟样本列表"""
+        latencies = []
+        tracker = self.app.HostRttTracker()
+        record = tracker.record
+
+        def recording(ip, rtt):
+            latencies.append(rtt)
+            record(ip, rtt)
+
+        tracker.record = recording
+        self.scanner.rtt = tracker
+        return latencies
+
+    def _measure(self, fn):
+        latencies = self._reset()
+        with ResourceSampler() as sampler:
+            start = time.perf_counter()
+            value = fn()
+            elapsed = time.perf_counter() - start
+        return value, elapsed, latencies, sampler.peak
+
+    def run(self, name, fn, ports=0, hosts=0, expected_open=None, expected_hosts=None, **labels):
+        """运行 args.repeat 次, 取耗时中位数的一次作为结果
+        
+        fn 返回发现的开放端口数 (expected_open) 或在线主机数 (expected_hosts); 应有结果却一个都没发现时
+        结果标记为 invalid, 不计算速率, 避免把什么都没扫到的运行当成高速成功
+        """
+        runs = []
+        for _ in range(self.args.repeat):
+            runs.append(self._measure(fn))
+        runs.sort(key=lambda r: r[1])
+        value, elapsed, latencies, peak = runs[len(runs) // 2]
+        result = {
+            "name": name, **labels,
+            "elapsed_s": round(elapsed, 4),
+            "ports": ports,
+            "hosts": hosts,
+            "ports_per_sec": round(ports / elapsed, 1) if ports else None,
+            "hosts_per_sec": round(hosts / elapsed, 1) if hosts else None,
+            "latency_ms": {
+                "samples": len(latencies),
+                "p50": round(percentile(latencies, 50) * 1000, 3) if latencies else None,
+                "p99": round(percentile(latencies, 99) * 1000, 3) if latencies else None,
+            },
+            "peak_threads": peak["threads"],
+            "peak_fds": peak["fds"],
+            "peak_rss_mb": peak["rss_mb"],
+            "runs": len(runs),
+        }
+        check = ""
+        if expected_open is not None:
+            result["open_found"] = value
+            result["open_expected"] = expected_open
+            check = f", 开放 {value}/{expected_open}"
+        if expected_hosts is not None:
+            result["hosts_found"] = value
+            result["hosts_expected"] = expected_hosts
+            check = f", 在线 {value}/{expected_hosts}"
+        expected = expected_open if expected_open is not None else expected_hosts
+        if expected and not value:
+            result["invalid"] = True
+            result["ports_per_sec"] = result["hosts_per_sec"] = None
+        self.results.append(result)
+        if result.get("invalid"):
+            rate = "无效 (没有发现任何结果)"
+        else:
+            rate = f"{result['ports_per_sec']} 端口/秒" if ports else f"{result['hosts_per_sec']} 主机/秒"
+        print(f"[基准] {name}: {elapsed:.3f}s, {rate}, p50 {result['latency_ms']['p50']}ms, "
+              f"p99 {result['latency_ms']['p99']}ms, 线程 {peak['threads']}, FD {peak['fds']}, "
+              f"RSS {peak['rss_mb']}MB{check}")
+        return result
+
+    def scan_ports(self, engine, speed):
+        ip = self.hosts[0]
+        self.scanner.set_engine(engine)
+        self.scanner.set_speed_mode(speed)
+        return self.run(f"scan_ports/{engine}/{speed}",
+                        lambda: len(self.scanner.scan_ports(ip, ports=self.ports)),
+                        ports=len(self.ports), hosts=1, expected_open=len(self.layout[ip][0]),
+                        scenario="scan_ports", engine=engine, speed=speed)
+
+    def scan_hosts(self, engine, speed):
+        self.scanner.set_engine(engine)
+        self.scanner.set_speed_mode(speed)
+        targets = [((ip, "", ""), self.ports) for ip in self.hosts]
+
+        def scan():
+            return sum(len(d["ports"]) for d in self.scanner._scan_hosts(targets))
+
+        return self.run(f"scan_hosts/{engine}/{speed}", scan, ports=len(self.ports) * len(self.hosts),
+                        hosts=len(self.hosts), expected_open=sum(len(o) for o, _ in self.layout.values()),
+                        scenario="scan_hosts", engine=engine, speed=speed)
+
+    def ping_scan(self, ping_engine, mode):
+        if ping_engine == "subprocess" and mode != "tcp" and not shutil.which("ping"):
+            print(f"[基准] 跳过 ping_scan/{ping_engine}/{mode}: 没有 ping 命令")
+            return None
+        self.scanner.set_ping_engine(ping_engine)
+        self.scanner.set_discovery_mode(mode)
+        network = self.app.ipaddress.IPv4Network(f"{HOST_PREFIX}.0.0/{self.args.ping_prefix}")
+        total = self.app.count_hosts([network])
+        return self.run(f"ping_scan/{ping_engine}/{mode}",
+                        lambda: len(self.scanner.ping_scan(network=str(network))),
+                        hosts=total, expected_hosts=total, scenario="ping_scan", engine=ping_engine, mode=mode)
+
+    def discovery(self, engine, speed):
+        self.scanner.set_engine(engine)
+        self.scanner.set_speed_mode(speed)
+        self.scanner.set_discovery_mode("tcp")
+        network = self.app.ipaddress.IPv4Network(f"{HOST_PREFIX}.0.0/{self.args.discovery_prefix}")
+        total = self.app.count_hosts([network])
+        # 回环地址全部在线, 每台主机都会扫描 self.ports
+        return self.run(f"discovery/{engine}/{speed}",
+                        lambda: sum(len(d["ports"]) for d in self.scanner.discovery(ports=self.ports,
+                                                                                   network=str(network))),
+                        ports=len(self.ports) * total, hosts=total,
+                        expected_open=sum(len(o) for ip, (o, _) in self.layout.items()
+                                          if self.app.ipaddress.IPv4Address(ip) in network),
+                        scenario="discovery", engine=engine, speed=speed)
+
+# ======== 结果 ========
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, old_file):
+    """按场景名对比 端口/秒 (或 主机/秒) 的变化"""
+    with open(old_file, 'r', encoding='utf-8') as f:
+        old = {r["name"]: r for r in json.load(f)["results"]}
+    print(f"\n{'场景':<32}{'旧版本':>14}{'当前':>14}{'变化':>10}")
+    for result in results:
+        before = old.get(result["name"])
+        key = "ports_per_sec" if result["ports"] else "hosts_per_sec"
+        if not before or not before.get(key) or not result[key]:
+            current = "无效" if result.get("invalid") else result[key]
+            print(f"{result['name']:<32}{'-':>14}{current:>14}{'-':>10}")
+            continue
+        change = (result[key] - before[key]) * 100 / before[key]
+        print(f"{result['name']:<32}{before[key]:>14}{result[key]:>14}{change:>+9.1f}%")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="回环地址上的扫描性能基准测试")
+    parser.add_argument("--hosts", type=int, default=4, help="监听主机数 (127.77.0.1 起)")
+    parser.add_argument("--ports", type=int, default=2000, help="每台主机扫描的端口数")
+    parser.add_argument("--open", type=int, default=20, help="每台主机的开放端口数")
+    parser.add_argument("--filtered", type=int, default=5, help="每台主机的过滤 (超时) 端口数")
+    parser.add_argument("--base-port", type=int, default=40000, help="扫描端口范围起点")
+    parser.add_argument("--engines", default="async,thread,process", help="端口扫描引擎, 逗号分隔")
+    parser.add_argument("--speeds", default="fast,standard", help="速度模式, 逗号分隔")
+    parser.add_argument("--ping-engines", default="icmp,subprocess", help="设备发现引擎, 逗号分隔")
+    parser.add_argument("--ping-prefix", type=int, default=24, help="ping_scan 的网段掩码")
+    parser.add_argument("--discovery-prefix", type=int, default=29, help="discovery 的网段掩码")
+    parser.add_argument("--scenarios", default="scan_ports,scan_hosts,ping_scan,discovery", help="运行的场景")
+    parser.add_argument("--repeat", type=int, default=1, help="每个场景重复次数, 取中位数")
+    parser.add_argument("--seed", type=int, default=1, help="端口分布随机种子")
+    parser.add_argument("--output", default=os.path.join(tempfile.gettempdir(), "hpm_bench_results.json"),
+                        help="结果文件 (默认写到系统临时目录)")
+    parser.add_argument("--compare", help="对比的旧结果文件")
+    args = parser.parse_args()
+    if args.open + args.filtered > args.ports:
+        parser.error("开放端口与过滤端口之和不能超过扫描端口数")
+    if not 1 <= args.hosts <= 254:
+        parser.error("主机数需在 1-254 之间")
+    return args
+
+def main():
+    args = parse_args()
+    layout = port_layout(args)
+    # 监听进程在导入 app (启动后台线程) 之前创建
+    listener = start_listeners(layout)
+
+    # 扫描历史等数据写入临时目录, 不影响正式数据; 依赖缺失时不自动安装
+    data_dir = tempfile.mkdtemp(prefix="hpm-bench-")
+    os.environ["HPM_DATA_DIR"] = data_dir
+    os.environ.setdefault("HPM_AUTO_INSTALL", "0")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app
+
+    bench = Bench(app, args, layout)
+    scenarios = set(args.scenarios.split(','))
+    engines = [e for e in args.engines.split(',') if e in app.SCAN_ENGINES]
+    speeds = [s for s in args.speeds.split(',') if s in app.SCAN_SPEED]
+    print(f"[基准] {args.hosts} 台主机 × {args.ports} 端口 (开放 {args.open}, 过滤 {args.filtered}), "
+          f"数据目录 {data_dir}")
+    try:
+        for engine in engines:
+            for speed in speeds:
+                if "scan_ports" in scenarios:
+                    bench.scan_ports(engine, speed)
+                if "scan_hosts" in scenarios:
+                    bench.scan_hosts(engine, speed)
+                if "discovery" in scenarios:
+                    bench.discovery(engine, speed)
+        if "ping_scan" in scenarios:
+            for ping_engine in args.ping_engines.split(','):
+                if ping_engine in app.PING_ENGINES:
+                    bench.ping_scan(ping_engine, "icmp")
+            bench.ping_scan(app.scanner.ping_engine, "tcp")
+    finally:
+        listener.terminate()
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    output = {
+        "meta": {
+            "revision": git_revision(),
+            "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        },
+        "results": bench.results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(output, f, ensure_ascii=False, indent=2)
+    print(f"[基准] 结果已保存到 {args.output}")
+
+    if args.compare:
+        compare(bench.results, args.compare)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# 测试时把数据文件放到临时目录, 不自动 pip 安装依赖
+os.environ["HPM_DATA_DIR"] = tempfile.mkdtemp(prefix="hpm-test-")
+os.environ["HPM_AUTO_INSTALL"] = "0"
+
+import app  # noqa: E402
+
+# 导入时不创建数据文件; 测试统一在临时目录中初始化一次
+app.init_data()
+
+
+@pytest.fixture
+def job():
+    """在独立的任务中运行扫描代码, 状态和实时数据不与其他测试共享"""
+    job = app.ScanJob("test", fn=lambda: None)
+    token = app.CURRENT_JOB.set(job)
+    yield job
+    app.CURRENT_JOB.reset(token)
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import os
+
+import pytest
+
+import app
+import bench
+
+
+def bench_args(**overrides):
+    args = dict(hosts=2, ports=200, open=5, filtered=0, base_port=41000, seed=1, repeat=1)
+    args.update(overrides)
+    return argparse.Namespace(**args)
+
+
+def test_data_dir_comes_from_environment():
+    assert app.DATA_DIR == os.environ["HPM_DATA_DIR"]
+    assert os.path.dirname(app.DB_FILE) == app.DATA_DIR
+
+
+def test_percentile():
+    assert bench.percentile([], 50) is None
+    samples = list(range(1, 101))
+    assert bench.percentile(samples, 50) == 51
+    assert bench.percentile(samples, 99) == 100
+
+
+def test_port_layout_is_deterministic():
+    args = bench_args(filtered=3)
+    layout = bench.port_layout(args)
+    assert layout == bench.port_layout(args)
+    assert list(layout) == ["127.77.0.1", "127.77.0.2"]
+    for open_ports, filtered_ports in layout.values():
+        assert len(open_ports) == 5 and len(filtered_ports) == 3
+        assert not set(open_ports) & set(filtered_ports)
+        assert all(41000 <= port < 41200 for port in open_ports + filtered_ports)
+
+
+def test_compare_reports_change(tmp_path, capsys):
+    old = tmp_path / "old.json"
+    old.write_text(json.dumps({"results": [{"name": "scan_ports/async/fast", "ports_per_sec": 1000.0}]}))
+    bench.compare([{"name": "scan_ports/async/fast", "ports": 2000, "ports_per_sec": 1500.0, "hosts_per_sec": None},
+                   {"name": "ping_scan/icmp/tcp", "ports": 0, "ports_per_sec": None, "hosts_per_sec": 20.0}],
+                  str(old))
+    out = capsys.readouterr().out
+    assert "+50.0%" in out and "ping_scan/icmp/tcp" in out
+
+
+def test_run_without_results_is_invalid(tmp_path, capsys, monkeypatch):
+    monkeypatch.setattr(app, "scanner", app.HomeNetworkScanner())
+    runner = bench.Bench(app, bench_args(), {"127.77.0.1": ([], [])})
+    result = runner.run("ping_scan/icmp/icmp", lambda: 0, hosts=254, expected_hosts=254)
+    assert result["invalid"] and result["hosts_per_sec"] is None and result["hosts_found"] == 0
+    old = tmp_path / "old.json"
+    old.write_text(json.dumps({"results": [{"name": "ping_scan/icmp/icmp", "hosts_per_sec": 500.0}]}))
+    bench.compare([result], str(old))
+    assert "无效" in capsys.readouterr().out
+
+
+def test_scan_ports_scenario_finds_open_ports(monkeypatch, job):
+    args = bench_args(hosts=1)
+    layout = bench.port_layout(args)
+    try:
+        listener = bench.start_listeners(layout)
+    except OSError as e:
+        pytest.skip(f"无法监听回环地址: {e}")
+    try:
+        monkeypatch.setattr(app, "scanner", app.HomeNetworkScanner())
+        runner = bench.Bench(app, args, layout)
+        result = runner.scan_ports("async", "fast")
+    finally:
+        listener.terminate()
+    assert result["open_found"] == result["open_expected"] == 5
+    assert result["ports"] == 200 and result["ports_per_sec"] > 0
+    assert result["latency_ms"]["samples"] > 0
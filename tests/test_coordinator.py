@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+import json
+import threading
+
+import pytest
+
+import app
+
+# 模拟网络: 在线主机及其开放端口
+NETWORK = {"10.0.0.2": {22, 80}, "10.0.0.3": {443}, "10.0.0.5": {8080, 9000}, "10.0.0.9": set()}
+
+
+class FakeAgent(app.RemoteAgent):
+    """按 NETWORK 返回结果的代理; fail_after 个事件后抛出异常模拟代理失联, 收到 refuse_slice 端口片时直接失败"""
+
+    def __init__(self, url, networks=None, fail_after=None, refuse_slice=None):
+        super().__init__(url, networks=networks)
+        self.fail_after = fail_after
+        self.refuse_slice = refuse_slice
+        self.shards = []
+        self.lock = threading.Lock()
+
+    def run(self, shard, emit, job):
+        with self.lock:
+            self.shards.append(shard)
+        if self.refuse_slice is not None and shard.get("slice", [None])[0] == self.refuse_slice:
+            raise ConnectionError("代理拒绝分片")
+        events = 0
+        for ip in shard["hosts"]:
+            if ip not in NETWORK:
+                continue
+            if self.fail_after is not None and events >= self.fail_after:
+                raise ConnectionError("代理连接中断")
+            events += 1
+            if shard.get("discover"):
+                emit({"type": "host", "ip": ip, "mac": "m" + ip[-1], "name": ""})
+                continue
+            ports = app.PortSlice(app.parse_ports(shard["ports"]), *shard["slice"])
+            open_ports = [{"port": port, "service": f"Port {port}"} for port in NETWORK[ip] if port in ports]
+            for port_info in open_ports:
+                emit({"type": "port", "ip": ip, "port": port_info})
+            emit({"type": "host_done", "ip": ip, "ports": open_ports, "scanned": len(ports)})
+
+
+@pytest.fixture
+def coordinator(monkeypatch, tmp_path, job):
+    monkeypatch.setitem(app.AGENT, "local_worker", False)
+    monkeypatch.setitem(app.AGENT, "hosts_per_shard", 1)
+    monkeypatch.setitem(app.AGENT, "discover_hosts", 4)
+    monkeypatch.setitem(app.AGENT, "ports_per_shard", 5000)
+    scanner = app.HomeNetworkScanner()
+    scanner._network_info = {"local_ip": "10.0.0.1", "gateway": None, "network": "10.0.0.0/28"}
+    monkeypatch.setattr(app, "scanner", scanner)
+    return app.ScanCoordinator(app.ScanStore(str(tmp_path / "history.db")))
+
+
+def test_scan_merges_discovery_and_port_slices(coordinator):
+    agents = [FakeAgent("http://a1"), FakeAgent("http://a2")]
+    coordinator._agents = {agent.url: agent for agent in agents}
+    devices, missed, covered = coordinator.scan(ports=app.PortSpec("1-10000"))
+    assert not missed and 10000 in covered
+    assert [d["ip"] for d in devices] == sorted(NETWORK, key=app.ipaddress.IPv4Address)
+    assert {d["ip"]: {p["port"] for p in d["ports"]} for d in devices} == NETWORK
+    assert devices[0]["mac"] == "m2"
+    # 10000 个端口分成 2 片, 每台在线主机各一个分片
+    port_shards = [s for agent in agents for s in agent.shards if not s.get("discover")]
+    assert len(port_shards) == len(NETWORK) * 2
+    assert sum(agent.shards_done for agent in agents) == sum(len(agent.shards) for agent in agents)
+    assert any(agent.throughput for agent in agents)
+
+
+def test_failed_agent_hosts_are_reassigned(coordinator):
+    broken = FakeAgent("http://broken", fail_after=0)
+    healthy = FakeAgent("http://healthy")
+    coordinator._agents = {broken.url: broken, healthy.url: healthy}
+    devices, missed, _ = coordinator.scan(ports=app.PortSpec("1-10000"))
+    assert {d["ip"]: {p["port"] for p in d["ports"]} for d in devices} == NETWORK and not missed
+    assert not broken.alive() and broken.failures == 1
+    assert healthy.alive()
+
+
+def test_agent_networks_limit_shards(coordinator):
+    vlan = FakeAgent("http://vlan", networks="10.0.0.4/30")
+    other = FakeAgent("http://other", networks="10.0.0.0/30")
+    coordinator._agents = {vlan.url: vlan, other.url: other}
+    shards = [{"hosts": [ip], "ports": "1-10000", "slice": [0, 1], "size": 10000} for ip in NETWORK]
+    coordinator.run_shards(shards, lambda event: None)
+    assert {s["hosts"][0] for s in vlan.shards} == {"10.0.0.5"}
+    assert {s["hosts"][0] for s in other.shards} == {"10.0.0.2", "10.0.0.3"}
+
+
+def full_scan(coordinator, monkeypatch, previous):
+    """先保存 previous 作为历史, 再经 run_full_scan 做一次分布式扫描, 返回扫描后历史中的在线设备"""
+    monkeypatch.setattr(app, "COORDINATOR", coordinator)
+    monkeypatch.setattr(app, "STORE", coordinator.store)
+    monkeypatch.setattr(app, "SCAN_CACHE", {d["ip"]: d for d in previous})
+    coordinator.store.save_run("discovery", previous, scope=app.parse_networks("10.0.0.0/28"))
+    app.run_full_scan(port_spec=app.PortSpec("1-10000"), network="10.0.0.0/28", distributed=True)
+    return {d["ip"]: {p["port"] for p in d["ports"]} for d in coordinator.store.latest_devices()}
+
+
+def test_skipped_discovery_shards_keep_hosts_online(coordinator, monkeypatch):
+    # 代理只能访问 10.0.0.0/29, 包含 10.0.0.9 和 10.0.0.12 的存活检测分片没有代理能执行
+    coordinator._agents = {"http://a": FakeAgent("http://a", networks="10.0.0.0/29")}
+    previous = [{"ip": ip, "ports": []} for ip in ("10.0.0.9", "10.0.0.12", "10.0.0.4")]
+    online = full_scan(coordinator, monkeypatch, previous)
+    # 设备列表不完整, 没有发现的设备都不记为离线, 也不移出缓存
+    assert {"10.0.0.9", "10.0.0.12", "10.0.0.4"} <= set(online) <= set(app.SCAN_CACHE)
+    assert online["10.0.0.2"] == NETWORK["10.0.0.2"]
+    assert app.STORE.recent_runs(limit=1)[0]["kind"] == "distributed"
+
+
+def test_skipped_port_slice_keeps_ports_open(coordinator, monkeypatch):
+    # 唯一的代理拒绝第 2 个端口片后失联, 该端口片的分片全部跳过
+    coordinator._agents = {"http://a": FakeAgent("http://a", refuse_slice=1)}
+    spec = app.PortSpec("1-10000")
+    first, second = (next(p for p in app.PortSlice(spec, index, 2) if p not in NETWORK["10.0.0.2"])
+                     for index in range(2))
+    ports = [{"port": port, "service": ""} for port in (first, second)]
+    online = full_scan(coordinator, monkeypatch, [{"ip": "10.0.0.2", "ports": ports}])
+    # 第 1 片完整扫描过, 之前开放的端口记为关闭; 第 2 片没有扫描, 保持开放
+    assert first not in online["10.0.0.2"] and second in online["10.0.0.2"]
+    assert {"10.0.0.3", "10.0.0.5", "10.0.0.9"} <= set(online)
+
+
+def test_workers_ordered_by_throughput(coordinator):
+    slow, fast, new = FakeAgent("http://slow"), FakeAgent("http://fast"), FakeAgent("http://new")
+    slow.throughput, fast.throughput = 10.0, 500.0
+    coordinator._agents = {agent.url: agent for agent in (slow, new, fast)}
+    assert [agent.url for agent in coordinator._workers()] == ["http://fast", "http://slow", "http://new"]
+
+
+def test_add_agent_validates_and_persists(coordinator, monkeypatch):
+    with pytest.raises(ValueError):
+        coordinator.add("ftp://agent")
+    monkeypatch.setattr(app.RemoteAgent, "info", lambda self: {"agent": True})
+    coordinator.add("http://agent:2334/", "secret", "10.0.1.0/24")
+    assert coordinator.store.get_meta("agents") == [{"url": "http://agent:2334", "token": "secret",
+                                                     "networks": "10.0.1.0/24"}]
+    assert app.ScanCoordinator(coordinator.store).has_agents()
+    assert coordinator.remove("http://agent:2334") and not coordinator.has_agents()
+
+
+def test_agent_shard_route_streams_events(monkeypatch):
+    monkeypatch.setitem(app.AGENT, "token", "secret")
+    monkeypatch.setattr(app, "JOBS", app.JobManager(workers=1, max_queue=4, history=10))
+
+    def fake_shard(shard, emit):
+        for ip in shard["hosts"]:
+            emit({"type": "host", "ip": ip, "mac": None, "name": ""})
+
+    monkeypatch.setattr(app, "run_agent_shard", fake_shard)
+    client = app.app.test_client()
+    shard = {"hosts": ["10.0.0.2", "10.0.0.3"], "discover": True}
+    assert client.post("/api/agent/shard", json=shard).status_code == 403
+    headers = {"X-HPM-Token": "secret"}
+    assert client.post("/api/agent/shard", json={"hosts": []}, headers=headers).status_code == 400
+    response = client.post("/api/agent/shard", json=shard, headers=headers)
+    events = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    events = [event for event in events if event["type"] != "heartbeat"]
+    assert [event.get("ip") for event in events] == ["10.0.0.2", "10.0.0.3", None]
+    assert events[-1]["type"] == "done"
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime
+
+import pytest
+
+import app
+
+
+def weekdays(field):
+    return app.parse_cron(f"0 3 * * {field}")[4][0]
+
+
+@pytest.mark.parametrize("field, expected", [
+    ("1-7", {0, 1, 2, 3, 4, 5, 6}),
+    ("7", {0}),
+    ("0", {0}),
+    ("5-7", {5, 6, 0}),
+    ("*/2", {0, 2, 4, 6}),
+    ("1-5", {1, 2, 3, 4, 5}),
+    ("6,7", {6, 0}),
+])
+def test_weekday_field(field, expected):
+    assert weekdays(field) == expected
+
+
+@pytest.mark.parametrize("expr", ["0 3 * * 8", "0 3 * * 6-8", "60 * * * *", "0 3 * *", "0 3 * * a"])
+def test_invalid_expressions(expr):
+    with pytest.raises(ValueError):
+        app.parse_cron(expr)
+
+
+def test_cron_next_crosses_into_sunday():
+    # 2026-10-17 是周六
+    saturday = datetime(2026, 10, 17, 4, 0)
+    assert app.cron_next(app.parse_cron("0 3 * * 7"), saturday) == datetime(2026, 10, 18, 3, 0)
+    assert app.cron_next(app.parse_cron("0 3 * * 5-7"), saturday) == datetime(2026, 10, 18, 3, 0)
+    assert app.cron_next(app.parse_cron("0 3 * * 1-5"), saturday) == datetime(2026, 10, 19, 3, 0)
+
+
+def test_cron_next_day_or_weekday():
+    # 日和星期都有限制时满足其一即可
+    fields = app.parse_cron("0 0 1 * 0")
+    assert app.cron_next(fields, datetime(2026, 10, 17, 12, 0)) == datetime(2026, 10, 18, 0, 0)
+    assert app.cron_next(fields, datetime(2026, 10, 25, 12, 0)) == datetime(2026, 11, 1, 0, 0)
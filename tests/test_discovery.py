@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+import socket
+import threading
+import time
+
+import app
+
+
+def test_host_concurrency_splits_budget():
+    scanner = app.HomeNetworkScanner()
+    scanner.speed_mode = "standard"
+    config = app.SCAN_SPEED["standard"]
+    assert scanner.host_concurrency("thread", 1) == min(config["per_host_limit"], config["port_workers"])
+    assert scanner.host_concurrency("async", 4) == min(config["per_host_limit"], config["async_workers"] // 4)
+    assert scanner.host_concurrency("thread", 10 ** 6) == 1
+
+
+def test_discovery_scans_hosts_concurrently(monkeypatch, tmp_path, job):
+    monkeypatch.setattr(app, "STORE", app.ScanStore(str(tmp_path / "history.db")))
+    monkeypatch.setattr(app, "JOURNAL", app.ScanJournal(str(tmp_path / "journal.jsonl")))
+    scanner = app.HomeNetworkScanner()
+    scanner.speed_mode = "standard"
+    scanner.fingerprint_enabled = False
+    hosts = [(f"10.0.0.{i}", None, None) for i in range(2, 8)]
+    monkeypatch.setattr(scanner, "ping_scan", lambda *args, **kwargs: list(hosts))
+    lock = threading.Lock()
+    state = {"active": 0, "peak": 0, "workers": set()}
+
+    def fake_scan_ports(ip, ports=None, progress_callback=None, found_callback=None, workers=None, **kwargs):
+        with lock:
+            state["active"] += 1
+            state["peak"] = max(state["peak"], state["active"])
+            state["workers"].add(workers)
+        time.sleep(0.05)
+        found_callback({"port": 22, "service": "SSH"})
+        progress_callback(1, 1)
+        with lock:
+            state["active"] -= 1
+        return [{"port": 22, "service": "SSH"}]
+
+    monkeypatch.setattr(scanner, "scan_ports", fake_scan_ports)
+    devices = scanner.discovery(fast_mode=True)
+    host_workers = app.SCAN_SPEED["standard"]["host_workers"]
+    assert 1 < state["peak"] <= host_workers
+    assert state["workers"] == {scanner.host_concurrency(scanner.engine, host_workers)}
+    # 结果保持发现顺序, 流中的端口带上所属主机
+    assert [d["ip"] for d in devices] == [ip for ip, _, _ in hosts]
+    snapshot = job.stream_snapshot()
+    assert snapshot["active_hosts"] == []
+    assert snapshot["completed_devices"] == len(hosts)
+    assert sorted(p["ip"] for p in snapshot["found_ports"]) == [ip for ip, _, _ in hosts]
+    assert job.status["progress"] == 100 and job.status["current_device"] == ""
+
+
+def closed_port():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def test_tcp_probe_counts_refused_as_alive():
+    scanner = app.HomeNetworkScanner()
+    scanner.probe_ports = [closed_port()]
+    assert list(scanner._tcp_probe_sweep(["127.0.0.1"])) == ["127.0.0.1"]
+
+
+def test_tcp_probe_ignores_timeouts_and_unreachable(monkeypatch):
+    scanner = app.HomeNetworkScanner()
+    scanner.probe_ports = [22, 80]
+    results = {"10.0.0.2": app.errno.ECONNREFUSED, "10.0.0.3": 0,
+               "10.0.0.4": app.errno.ETIMEDOUT, "10.0.0.5": app.errno.EHOSTUNREACH}
+
+    async def fake_connect(loop, ip, port, timeout=1.0):
+        return results[ip] if port == 80 else app.errno.ETIMEDOUT
+
+    monkeypatch.setattr(scanner, "_async_connect", fake_connect)
+    assert sorted(scanner._tcp_probe_sweep(list(results))) == ["10.0.0.2", "10.0.0.3"]
+
+
+def test_ping_scan_merges_tcp_and_echo(monkeypatch):
+    scanner = app.HomeNetworkScanner()
+    scanner.custom_network = "10.0.0.0/24"
+    monkeypatch.setattr(app, "read_neighbor_table", lambda: {})
+    monkeypatch.setattr(scanner, "_echo_sweep", lambda ips, workers, progress_callback=None, rate=None: {"10.0.0.2": 0.2})
+    monkeypatch.setattr(scanner, "_tcp_probe_sweep", lambda ips: {"10.0.0.3": 1.0, "10.0.0.2": 5.0})
+    for mode, expected in [("both", ["10.0.0.2", "10.0.0.3"]), ("icmp", ["10.0.0.2"]), ("tcp", ["10.0.0.2", "10.0.0.3"])]:
+        scanner.set_discovery_mode(mode)
+        assert [ip for ip, _, _ in scanner.ping_scan()] == expected
+    assert not scanner.set_discovery_mode("arp")
+
+
+def test_engine_route_sets_probe_ports(monkeypatch):
+    monkeypatch.setattr(app.scanner, "probe_ports", list(app.scanner.probe_ports))
+    monkeypatch.setattr(app.scanner, "discovery_mode", app.scanner.discovery_mode)
+    client = app.app.test_client()
+    assert client.post("/api/engine", json={"discovery_mode": "tcp", "probe_ports": "22,80"}).json["success"]
+    assert app.scanner.discovery_mode == "tcp" and sorted(app.scanner.probe_ports) == [22, 80]
+    assert not client.post("/api/engine", json={"probe_ports": "0"}).json["success"]
+    assert not client.post("/api/engine", json={}).json["success"]
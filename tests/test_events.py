@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+import json
+
+import pytest
+
+import app
+
+
+def test_since_returns_only_newer_events():
+    log = app.ScanEventLog(maxlen=10)
+    assert log.since(0) == ([], True)
+    for i in range(3):
+        log.publish("port_open", port=i)
+    events, complete = log.since(1)
+    assert complete and [e["seq"] for e in events] == [2, 3]
+    assert events[0] == {"seq": 2, "type": "port_open", "data": {"port": 1}}
+    assert log.since(3) == ([], True)
+
+
+def test_since_reports_overwritten_events():
+    log = app.ScanEventLog(maxlen=3)
+    for i in range(5):
+        log.publish("status", progress=i)
+    # 序号 1..2 已被挤出缓冲区
+    events, complete = log.since(0)
+    assert not complete and [e["seq"] for e in events] == [3, 4, 5]
+    assert log.since(2)[1]
+    assert not log.since(99)[1]
+
+
+def test_wait_times_out_without_events():
+    log = app.ScanEventLog()
+    seq = log.publish("status", scanning=True)
+    assert log.wait(seq, timeout=0.05) == ([], True)
+
+
+@pytest.fixture
+def events(monkeypatch, job):
+    log = app.ScanEventLog()
+    monkeypatch.setattr(app, "SCAN_EVENTS", log)
+    monkeypatch.setattr(app.JOBS, "primary", lambda: job)
+    return log
+
+
+def test_update_status_publishes_changed_fields(events, job):
+    app.update_status(scanning=True, progress=0)
+    app.update_status(scanning=False, progress=0)
+    app.update_status(scanning=False, progress=5)
+    assert [e["data"] for e in events.since(0)[0]] == [{"job": job.id, "scanning": False},
+                                                        {"job": job.id, "progress": 5}]
+
+
+def test_host_progress_is_published_per_percent(events, job):
+    app.stream_host_start("10.0.0.2", 1000)
+    for scanned in range(0, 1001, 5):
+        app.stream_host_progress("10.0.0.2", scanned, 1000)
+    app.stream_port_found("10.0.0.2", {"port": 22})
+    app.stream_host_done("10.0.0.2")
+    types = [e["type"] for e in events.since(0)[0]]
+    assert types.count("host_progress") == 100
+    assert types[0] == "host_start" and types[-2:] == ["port_open", "host_done"]
+    assert events.since(0)[0][-1]["data"] == {"job": job.id, "ip": "10.0.0.2", "found": 1}
+
+
+def test_stream_route_with_cursor(events):
+    client = app.app.test_client()
+    app.stream_host_start("10.0.0.2", 10)
+    app.stream_port_found("10.0.0.2", {"port": 80})
+    snapshot = client.get("/api/scan/stream").json
+    assert snapshot["cursor"] == events.last_seq
+    assert snapshot["found_ports"] == [{"port": 80, "ip": "10.0.0.2"}]
+    app.stream_port_found("10.0.0.2", {"port": 443})
+    delta = client.get(f"/api/scan/stream?since={snapshot['cursor']}").json
+    assert [e["data"]["port"] for e in delta["events"]] == [443]
+    assert "found_ports" not in delta and delta["cursor"] == events.last_seq
+
+
+def test_sse_resumes_from_last_event_id(events):
+    client = app.app.test_client()
+    first = events.publish("port_open", ip="10.0.0.2", port=22)
+    events.publish("port_open", ip="10.0.0.2", port=80)
+    response = client.get("/api/scan/events", headers={"Last-Event-ID": str(first)})
+    chunk = next(iter(response.response)).decode("utf-8")
+    response.close()
+    assert chunk.startswith("id: 2\nevent: port_open\n")
+    assert json.loads(chunk.split("data: ", 1)[1]) == {"ip": "10.0.0.2", "port": 80}
+
+
+def test_sse_sends_snapshot_without_cursor(events):
+    client = app.app.test_client()
+    events.publish("port_open", ip="10.0.0.2", port=22)
+    response = client.get("/api/scan/events")
+    chunk = next(iter(response.response)).decode("utf-8")
+    response.close()
+    assert chunk.startswith("retry: 2000\nid: 1\nevent: snapshot\n")
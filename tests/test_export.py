@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+import csv
+import gzip
+import io
+import json
+
+import pytest
+
+import app
+
+DEVICES = {
+    "10.0.0.2": {"ip": "10.0.0.2", "mac": "m2", "name": "nas", "last_seen": "2024-05-01 10:00:00",
+                 "ports": [{"port": 22, "service": "SSH", "risk": "中"},
+                           {"port": 445, "service": "SMB", "risk": "高"}]},
+    "10.0.0.3": {"ip": "10.0.0.3", "mac": "m3", "name": "电视", "last_seen": "2024-06-01 10:00:00",
+                 "ports": []},
+}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(app, "SCAN_CACHE", dict(DEVICES))
+    return app.app.test_client()
+
+
+def test_json_export_keeps_shape(client):
+    response = client.get("/api/export")
+    assert response.headers["Content-Disposition"] == "attachment; filename=scan_export.json"
+    assert response.json == {"devices": list(DEVICES.values())}
+
+
+def test_ndjson_and_gzip(client):
+    response = client.get("/api/export?format=ndjson&gzip=1")
+    assert response.mimetype == "application/gzip"
+    assert response.headers["Content-Disposition"].endswith("scan_export.ndjson.gz")
+    lines = gzip.decompress(response.data).decode("utf-8").splitlines()
+    assert [json.loads(line) for line in lines] == list(DEVICES.values())
+
+
+def test_csv_has_row_per_port(client):
+    text = client.get("/api/export?format=csv").data.decode("utf-8")
+    assert text.startswith("\ufeff")
+    rows = list(csv.DictReader(io.StringIO(text.lstrip("\ufeff"))))
+    assert [(row["ip"], row["port"]) for row in rows] == [("10.0.0.2", "22"), ("10.0.0.2", "445"),
+                                                           ("10.0.0.3", "")]
+    assert rows[2]["name"] == "电视"
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("ip=10.0.0.3", {"10.0.0.3": []}),
+    ("ip=10.0.0.0/31,10.0.0.2-10.0.0.2", {"10.0.0.2": [22, 445]}),
+    ("port=400-500", {"10.0.0.2": [445]}),
+    ("risk=high", {"10.0.0.2": [445]}),
+    ("risk=中,低", {"10.0.0.2": [22]}),
+    ("since=2024-05-15", {"10.0.0.3": []}),
+])
+def test_filters(client, query, expected):
+    devices = client.get(f"/api/export?{query}").json["devices"]
+    assert {d["ip"]: [p["port"] for p in d["ports"]] for d in devices} == expected
+
+
+@pytest.mark.parametrize("query", ["format=xml", "ip=10.0.0", "port=0", "since=yesterday"])
+def test_invalid_arguments(client, query):
+    assert client.get(f"/api/export?{query}").status_code == 400
+
+
+def test_chunks_are_bounded(monkeypatch):
+    monkeypatch.setitem(app.EXPORT, "chunk_size", 100)
+    lines = [json.dumps({"ip": f"10.0.{i // 256}.{i % 256}"}) + "\n" for i in range(200)]
+    chunks = list(app.export_chunks(iter(lines)))
+    assert len(chunks) > 10 and all(len(chunk) < 200 for chunk in chunks)
+    assert b"".join(chunks).decode() == "".join(lines)
+    assert gzip.decompress(b"".join(app.export_chunks(iter(lines), compress=True))).decode() == "".join(lines)
+
+
+def test_store_source_streams_online_devices(client, monkeypatch, tmp_path):
+    store = app.ScanStore(str(tmp_path / "history.db"))
+    store.save_run("discovery", [{"ip": "10.0.0.2", "mac": "m2", "ports": [{"port": 22, "service": "SSH",
+                                                                           "risk": "中", "risk_desc": ""}]},
+                                 {"ip": "10.0.0.3", "mac": "m3", "ports": []}])
+    store.save_fingerprints("10.0.0.2", "m2", {22: {"service": "SSH", "product": "OpenSSH_9.6"}})
+    store.save_run("discovery", [{"ip": "10.0.0.2", "mac": "m2", "ports": [{"port": 22, "service": "SSH",
+                                                                           "risk": "中", "risk_desc": ""}]}])
+    monkeypatch.setattr(app, "STORE", store)
+    devices = client.get("/api/export?source=store").json["devices"]
+    assert [d["ip"] for d in devices] == ["10.0.0.2"]
+    assert devices[0]["ports"][0]["product"] == "OpenSSH_9.6"
+
+
+def test_csv_neutralizes_formula_cells():
+    devices = [{"ip": "10.0.0.2", "name": "=HYPERLINK(\"http://x\")", "rtt_ms": -1,
+                "ports": [{"port": 80, "banner": "@SUM(A1)", "product": "+cmd"}]}]
+    text = "".join(app.export_lines(devices, "csv")).lstrip("\ufeff")
+    header, row = list(csv.reader(io.StringIO(text)))
+    row = dict(zip(header, row))
+    assert row["name"] == "'=HYPERLINK(\"http://x\")"
+    assert row["banner"] == "'@SUM(A1)"
+    assert row["product"] == "'+cmd"
+    assert row["rtt_ms"] == "-1"
+    assert row["ip"] == "10.0.0.2"
+
+
+def test_store_export_sorted_by_numeric_ip(tmp_path):
+    store = app.ScanStore(str(tmp_path / "history.db"))
+    store.save_run("ping", [{"ip": ip, "ports": []} for ip in ("10.0.0.10", "10.0.0.9", "10.0.0.100", "10.0.0.2")])
+    assert [d["ip"] for d in store.iter_devices()] == ["10.0.0.2", "10.0.0.9", "10.0.0.10", "10.0.0.100"]
+
+
+def test_cache_export_sorted_by_numeric_ip(monkeypatch):
+    cache = {ip: {"ip": ip, "ports": []} for ip in ("10.0.0.10", "10.0.0.9", "10.0.0.2")}
+    monkeypatch.setattr(app, "SCAN_CACHE", cache)
+    response = app.app.test_client().get("/api/export?format=ndjson")
+    lines = response.get_data(as_text=True).splitlines()
+    assert [json.loads(line)["ip"] for line in lines] == ["10.0.0.2", "10.0.0.9", "10.0.0.10"]
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import socket
+import threading
+
+import pytest
+
+import app
+
+
+@pytest.mark.parametrize("data, port, expected", [
+    (b"SSH-2.0-OpenSSH_9.6\r\n", 2222, ("SSH", "OpenSSH_9.6")),
+    (b"HTTP/1.0 200 OK\r\nServer: nginx/1.25\r\n\r\n", 8080, ("HTTP", "nginx/1.25")),
+    (b"HTTP/1.1 404 Not Found\r\n\r\n", 8443, ("HTTPS", None)),
+    (b"220 mail.example ESMTP Postfix\r\n", 2525, ("SMTP", "mail.example ESMTP Postfix")),
+    (b"220 ProFTPD Server\r\n", 2121, ("FTP", "ProFTPD Server")),
+    (b"-NOAUTH Authentication required.\r\n", 6379, ("Redis", None)),
+    (b"RFB 003.008\n", 5901, ("VNC", "RFB 003.008")),
+    (b"\x4a\x00\x00\x00\x0a8.0.36\x00rest", 3307, ("MySQL", "8.0.36")),
+    (b"\x16\x03\x03\x00\x31\x02\x00\x00\x2d\x03\x03", 443, ("HTTPS", "TLSv1.2")),
+    (b"\x15\x03\x03\x00\x02\x02\x28", 9999, ("TLS", None)),
+    (b"", 80, (None, None)),
+])
+def test_classify_banner(data, port, expected):
+    result = app.classify_banner(data, port)
+    assert (result["service"], result["product"]) == expected
+
+
+def test_unknown_banner_keeps_printable_first_line():
+    result = app.classify_banner(b"hello\x07 world\r\nsecond line", 7000)
+    assert result == {"service": None, "product": None, "banner": "hello world"}
+
+
+def test_apply_fingerprint_relabels_risk():
+    port_info = {"port": 8022, "service": "Port 8022", "risk": "低", "risk_desc": ""}
+    app.apply_fingerprint(port_info, {"service": "SSH", "product": "OpenSSH_9.6", "banner": None})
+    assert port_info["service"] == "SSH" and port_info["risk"] == app.PORT_SERVICES[22][1]
+    assert port_info["product"] == "OpenSSH_9.6" and "banner" not in port_info
+    unknown = {"port": 7000, "service": "Port 7000", "risk": "低", "risk_desc": ""}
+    app.apply_fingerprint(unknown, {"service": "AMQP"})
+    assert unknown["service"] == "AMQP" and unknown["risk"] == "低"
+
+
+@pytest.fixture
+def greeting_server():
+    """只发送一行 SSH 欢迎信息的本地服务, 记录连接次数"""
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(("127.0.0.1", 0))
+    server.listen(8)
+    connections = []
+
+    def serve():
+        while True:
+            try:
+                conn, _ = server.accept()
+            except OSError:
+                return
+            connections.append(conn)
+            conn.sendall(b"SSH-2.0-TestSSH_1.0\r\n")
+            conn.close()
+
+    threading.Thread(target=serve, daemon=True).start()
+    yield server.getsockname()[1], connections
+    server.close()
+
+
+def test_fingerprint_devices_probes_and_caches(greeting_server, monkeypatch, tmp_path, job):
+    port, connections = greeting_server
+    monkeypatch.setattr(app, "STORE", app.ScanStore(str(tmp_path / "history.db")))
+    scanner = app.HomeNetworkScanner()
+
+    def devices():
+        return [{"ip": "127.0.0.1", "mac": "m1",
+                 "ports": [{"port": port, "service": f"Port {port}", "risk": "低", "risk_desc": ""}]}]
+
+    first = devices()
+    scanner.fingerprint_devices(first)
+    assert first[0]["ports"][0]["service"] == "SSH"
+    assert first[0]["ports"][0]["product"] == "TestSSH_1.0"
+    assert len(connections) == 1
+    # 缓存按 (ip, port, MAC) 命中, 不再连接
+    second = devices()
+    scanner.fingerprint_devices(second)
+    assert second[0]["ports"][0]["product"] == "TestSSH_1.0"
+    assert len(connections) == 1
+    assert app.STORE.fresh_fingerprints("127.0.0.1", "m2", 3600) == {}
+
+
+def test_fingerprint_can_be_disabled(monkeypatch):
+    scanner = app.HomeNetworkScanner()
+    monkeypatch.setattr(app, "scanner", scanner)
+    response = app.app.test_client().post("/api/engine", json={"fingerprint": False})
+    assert response.status_code == 200 and not scanner.fingerprint_enabled
+    monkeypatch.setattr(app, "STORE", None)  # 关闭后不会读取缓存
+    scanner.fingerprint_devices([{"ip": "127.0.0.1", "ports": [{"port": 1}]}])
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+import struct
+
+import pytest
+
+import app
+
+
+def sweeper(raw=False):
+    # 不打开socket, 只测试报文构造和解析
+    s = app.IcmpSweeper.__new__(app.IcmpSweeper)
+    s.raw, s.ident, s.timeout = raw, 0x1234, 0.5
+    return s
+
+
+def test_packet_checksum_verifies():
+    packet = sweeper()._packet(7)
+    assert app.IcmpSweeper._checksum(packet) == 0
+    assert app.IcmpSweeper._checksum(b"\x00\x01\xf2") == app.IcmpSweeper._checksum(b"\x00\x01\xf2\x00")
+
+
+def test_parse_reply():
+    s = sweeper()
+    reply = bytearray(s._packet(9))
+    reply[0] = app.IcmpSweeper.ECHO_REPLY
+    assert s._parse_reply(bytes(reply)) == (0x1234, 9)
+    assert s._parse_reply(s._packet(9)) is None  # echo 请求不是回复
+    assert s._parse_reply(b"\x00\x00") is None
+    # 原始socket收到的数据带IP头
+    ip_header = struct.pack("!BBHHHBBH4s4s", 0x45, 0, 20 + len(reply), 0, 0, 64, 1, 0,
+                            bytes([127, 0, 0, 1]), bytes([127, 0, 0, 1]))
+    assert sweeper(raw=True)._parse_reply(ip_header + bytes(reply)) == (0x1234, 9)
+
+
+def test_sweep_loopback():
+    try:
+        s = app.IcmpSweeper(timeout=1.0)
+    except OSError:
+        pytest.skip("无法创建ICMP socket")
+    alive = s.sweep(["127.0.0.1"])
+    assert list(alive) == ["127.0.0.1"] and alive["127.0.0.1"] >= 0
+
+
+def test_ping_scan_records_rtt(monkeypatch):
+    scanner = app.HomeNetworkScanner()
+    scanner.custom_network = "10.0.0.0/24"
+    scanner._network_info = {"local_ip": "10.0.0.1", "gateway": None, "network": None}
+    swept = []
+
+    def fake_sweep(ips, timeout, progress_callback=None, rate=None):
+        swept.extend(ips)
+        return {"10.0.0.5": 1.5, "10.0.0.3": 0.4}
+
+    monkeypatch.setattr(scanner, "ping_engine", "icmp")
+    monkeypatch.setattr(scanner, "discovery_mode", "icmp")
+    monkeypatch.setattr(scanner, "_icmp_sweep", fake_sweep)
+    monkeypatch.setattr(app, "read_neighbor_table", lambda: {"10.0.0.3": ("aa:bb:cc:dd:ee:ff", "STALE"),
+                                                             "10.0.0.5": ("aa:bb:cc:dd:ee:ff", None)})
+    found = scanner.ping_scan()
+    assert len(swept) == 253 and "10.0.0.1" not in swept
+    assert found == [("10.0.0.3", "aa:bb:cc:dd:ee:ff", ""), ("10.0.0.5", "aa:bb:cc:dd:ee:ff", "")]
+    assert scanner.host_rtt["10.0.0.5"] == 1.5
+
+
+def test_ping_scan_falls_back_to_subprocess(monkeypatch):
+    scanner = app.HomeNetworkScanner()
+    scanner.custom_network = "10.0.0.0/24"
+    monkeypatch.setattr(scanner, "ping_engine", "icmp")
+    monkeypatch.setattr(scanner, "discovery_mode", "icmp")
+    monkeypatch.setattr(scanner, "_icmp_sweep", lambda ips, timeout, progress_callback=None, rate=None: None)
+    monkeypatch.setattr(scanner, "_subprocess_sweep", lambda ips, workers, progress_callback=None: {"10.0.0.9": None})
+    monkeypatch.setattr(app, "read_neighbor_table", lambda: {})
+    assert [ip for ip, _, _ in scanner.ping_scan()] == ["10.0.0.9"]
+
+
+def test_set_ping_engine():
+    scanner = app.HomeNetworkScanner()
+    assert scanner.set_ping_engine("subprocess") and scanner.ping_engine == "subprocess"
+    assert not scanner.set_ping_engine("nope")
+
+
+def test_each_ping_scan_has_its_own_rate_controller(monkeypatch, job):
+    scanner = app.HomeNetworkScanner()
+    scanner.custom_network = "10.0.0.0/30"
+    rates = []
+
+    def fake_sweep(ips, timeout, progress_callback=None, rate=None):
+        rates.append(rate)
+        return {}
+
+    monkeypatch.setattr(scanner, "ping_engine", "icmp")
+    monkeypatch.setattr(scanner, "discovery_mode", "icmp")
+    monkeypatch.setattr(scanner, "_icmp_sweep", fake_sweep)
+    monkeypatch.setattr(app, "read_neighbor_table", lambda: {})
+    scanner.ping_scan()
+    scanner.ping_scan()
+    # 同时运行的发现任务不会互相重置对方的 AIMD 状态
+    assert len(rates) == 2 and rates[0] is not rates[1] and None not in rates
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import app
+
+
+@pytest.fixture
+def scanner(monkeypatch, tmp_path):
+    monkeypatch.setattr(app, "STORE", app.ScanStore(str(tmp_path / "history.db")))
+    scanner = app.HomeNetworkScanner()
+    scanner.fingerprint_enabled = False
+    return scanner
+
+
+def test_port_slices_cover_space_once():
+    ports = app.PortSpec("1-10000")
+    slices = [app.PortSlice(ports, i, 3) for i in range(3)]
+    assert [len(s) for s in slices] == [3333, 3333, 3334]
+    # 切片按端口排名划分, 合起来正好覆盖每个端口一次
+    assert sorted(p for s in slices for p in s) == list(range(1, 10001))
+    assert str(slices[1]) == "2/3"
+
+
+def test_port_slice_cursor_rotates(scanner):
+    total = -(-65535 // app.INCREMENTAL_SLICE_SIZE)
+    seen = [scanner._next_port_slice(False, None).index for _ in range(total + 1)]
+    assert seen == list(range(total)) + [0]
+    assert len(scanner._next_port_slice(True, None)) == len(app.COMMON_PORTS)
+
+
+def test_incremental_scan_diff(scanner, monkeypatch):
+    # 网络现状: .2 关闭了 22 开放了 8080, .3 已离线, .4 在线但没有已知端口, .9 是新设备
+    network = {"10.0.0.2": {80, 8080}, "10.0.0.4": {443}, "10.0.0.9": {22}}
+    previous = {
+        "10.0.0.2": {"ip": "10.0.0.2", "mac": "m2", "name": "nas", "ports": [{"port": 22}, {"port": 80}]},
+        "10.0.0.3": {"ip": "10.0.0.3", "mac": "m3", "ports": [{"port": 22}]},
+        "10.0.0.4": {"ip": "10.0.0.4", "mac": "m4", "ports": []},
+    }
+    scans = []
+
+    def fake_scan_hosts(targets, fast_mode=False):
+        scans.append([ip for (ip, _, _), _ in targets])
+        devices = []
+        for (ip, mac, name), ports in targets:
+            ports = range(1, 65536) if ports is None else ports
+            devices.append({"ip": ip, "mac": mac, "rtt_ms": 1.0, "last_seen": "now",
+                            "ports": [{"port": p} for p in sorted(network.get(ip, set()) & set(ports))]})
+        return devices
+
+    monkeypatch.setattr(scanner, "_scan_hosts", fake_scan_hosts)
+    monkeypatch.setattr(scanner, "_sweep_shard", lambda ips, workers, progress_callback=None, rate=None:
+                        [(ip, "00:00:00:00:00:00", "") for ip in ips if ip in network])
+    monkeypatch.setattr(scanner, "ping_scan", lambda shard_callback=None, exclude=(), **kwargs:
+                        [(ip, "m9", "") for ip in network if ip not in exclude])
+    monkeypatch.setattr(app, "INCREMENTAL_SLICE_SIZE", 65535)
+    devices, diff = scanner.incremental_scan(previous)
+
+    # 复查只涉及有已知端口的设备, 端口扫描只涉及在线设备
+    assert scans[0] == ["10.0.0.2", "10.0.0.3"]
+    assert sorted(scans[1]) == ["10.0.0.2", "10.0.0.4", "10.0.0.9"]
+    assert diff == {"hosts_appeared": ["10.0.0.9"], "hosts_disappeared": ["10.0.0.3"],
+                    "ports_opened": {"10.0.0.2": [8080], "10.0.0.4": [443], "10.0.0.9": [22]},
+                    "ports_closed": {"10.0.0.2": [22]}}
+    by_ip = {d["ip"]: d for d in devices}
+    assert sorted(by_ip) == ["10.0.0.2", "10.0.0.4", "10.0.0.9"]
+    assert by_ip["10.0.0.2"]["name"] == "nas" and by_ip["10.0.0.4"]["mac"] == "m4"
+    assert [p["port"] for p in by_ip["10.0.0.2"]["ports"]] == [80, 8080]
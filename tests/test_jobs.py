@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import queue
+import threading
+import time
+
+import pytest
+
+import app
+
+
+def wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "等待超时"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def manager():
+    return app.JobManager(workers=1, max_queue=2, history=10)
+
+
+def test_jobs_run_in_priority_order(manager):
+    release = threading.Event()
+    order = []
+    blocker, _ = manager.submit("all", release.wait, 5)
+    wait_for(lambda: blocker.state == "running")
+    for name, priority in [("low", 10), ("normal", 5)]:
+        manager.submit(name, order.append, name, priority=priority)
+    release.set()
+    wait_for(lambda: len(order) == 2)
+    assert order == ["normal", "low"]
+
+
+def test_duplicate_key_and_full_queue(manager):
+    release = threading.Event()
+    first, created = manager.submit("all", release.wait, 5, key="all")
+    assert created
+    assert manager.submit("all", release.wait, 5, key="all") == (first, False)
+    wait_for(lambda: first.state == "running")
+    manager.submit("a", release.wait, 5)
+    manager.submit("b", release.wait, 5)
+    with pytest.raises(queue.Full):
+        manager.submit("c", release.wait, 5)
+    release.set()
+
+
+def test_result_and_failure(manager):
+    ok, _ = manager.submit("ok", lambda: app.current_job().id)
+    bad, _ = manager.submit("bad", lambda: 1 / 0)
+    wait_for(lambda: bad.state == "failed")
+    assert ok.state == "done" and ok.result == ok.id
+    assert "division" in bad.error and not bad.status["scanning"]
+
+
+def test_high_priority_job_preempts_background_scan(manager):
+    release_low, release_high = threading.Event(), threading.Event()
+    low, _ = manager.submit("all", release_low.wait, 5, priority=app.JOB_PRIORITIES["low"])
+    wait_for(lambda: low.state == "running")
+    high, _ = manager.submit("ports", release_high.wait, 5, priority=app.JOB_PRIORITIES["high"])
+    # 没有空闲线程: 高优先级任务立即在额外线程中运行, 后台任务暂停投递
+    wait_for(lambda: high.state == "running")
+    assert low.waiting() and low.status_snapshot()["paused"]
+    assert manager.primary() is high
+    release_high.set()
+    wait_for(lambda: not low.waiting())
+    release_low.set()
+    wait_for(lambda: low.state == "done")
+
+
+def test_bind_job_carries_job_into_threads(job):
+    seen = []
+    thread = threading.Thread(target=app.bind_job(lambda: seen.append(app.current_job())))
+    thread.start()
+    thread.join()
+    assert seen == [job]
+    assert app.current_job() is job
+
+
+def test_routes_report_conflicts(monkeypatch):
+    manager = app.JobManager(workers=1, max_queue=4, history=10)
+    monkeypatch.setattr(app, "JOBS", manager)
+    release = threading.Event()
+    running, _ = manager.submit("all", release.wait, 5, key="all")
+    client = app.app.test_client()
+    response = client.get("/api/scan/all")
+    assert response.status_code == 409 and response.json["job"] == running.id
+    assert client.get(f"/api/jobs/{running.id}").json["kind"] == "all"
+    assert client.get("/api/jobs/999999").status_code == 404
+    assert [job["id"] for job in client.get("/api/jobs").json] == [running.id]
+    assert client.post("/api/scan/pause", json={"job": running.id, "paused": True}).json["jobs"] == [running.id]
+    assert running.waiting()
+    release.set()
+
+
+def test_checkpoint_blocks_until_resume(job):
+    passed = threading.Event()
+    job.pause()
+    
+    def worker():
+        job.checkpoint()
+        passed.set()
+    
+    threading.Thread(target=worker, daemon=True).start()
+    assert not passed.wait(0.2)
+    job.resume()
+    assert passed.wait(2)
+
+
+def test_acheckpoint_wakes_coroutine_on_resume(job):
+    job.pause()
+    threading.Timer(0.1, job.resume).start()
+    
+    async def run():
+        await asyncio.wait_for(job.acheckpoint(), 2)
+        return True
+    
+    assert asyncio.run(run())
+
+
+def test_cancel_raises_at_checkpoint_even_when_paused(job):
+    job.pause()
+    threading.Timer(0.1, job.cancel).start()
+    with pytest.raises(app.ScanCancelled):
+        job.checkpoint()
+    assert job.cancelled and job.waiting()
+
+
+def test_run_cancellable_aborts_pending_coroutine(job):
+    threading.Timer(0.1, job.cancel).start()
+    started = time.monotonic()
+    with pytest.raises(app.ScanCancelled):
+        app.run_cancellable(lambda: asyncio.sleep(30))
+    assert time.monotonic() - started < 5
+
+
+def test_on_cancel_after_cancel_runs_immediately(job):
+    calls = []
+    unregister = job.on_cancel(lambda: calls.append("before"))
+    unregister()
+    job.cancel()
+    job.on_cancel(lambda: calls.append("after"))
+    assert calls == ["after"]
+
+
+def test_cancel_queued_and_running_jobs(manager):
+    def loop():
+        while True:
+            app.current_job().checkpoint()
+            time.sleep(0.01)
+    
+    running, _ = manager.submit("all", loop)
+    wait_for(lambda: running.state == "running")
+    queued, _ = manager.submit("ports", loop)
+    manager.cancel(queued)
+    assert queued.state == "cancelled" and queued not in manager.active()
+    manager.cancel(running)
+    wait_for(lambda: running.state == "cancelled")
+    assert not running.status["scanning"]
+
+
+def test_cancel_route(monkeypatch):
+    manager = app.JobManager(workers=1, max_queue=4, history=10)
+    monkeypatch.setattr(app, "JOBS", manager)
+    release = threading.Event()
+    running, _ = manager.submit("all", release.wait, 5)
+    client = app.app.test_client()
+    assert client.post("/api/scan/cancel", json={"job": 999999}).status_code == 404
+    assert client.post("/api/scan/cancel", json={}).json["jobs"] == [running.id]
+    assert running.cancelled
+    release.set()
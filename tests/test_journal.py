@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+import errno
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def journal(tmp_path):
+    return app.ScanJournal(str(tmp_path / "scan_journal.jsonl"), batch_size=1000, flush_interval=3600)
+
+
+def test_replay_and_torn_record(journal):
+    assert journal.load() is None and journal.pending() is None
+    journal.begin({"kind": "discovery", "fast_mode": False})
+    journal.hosts([("10.0.0.2", "m2", ""), ("10.0.0.3", "m3", "")])
+    journal.chunk("10.0.0.2", 0, 8, [{"port": 22}])
+    journal.host({"ip": "10.0.0.3", "ports": []})
+    journal.flush()
+    with open(journal.path, "a", encoding="utf-8") as f:
+        f.write('{"t": "chunk", "ip": "10.0.0.2", "ind')  # 崩溃时写了一半
+    state = journal.pending()
+    assert state["job"]["kind"] == "discovery"
+    assert state["hosts"] == [("10.0.0.2", "m2", ""), ("10.0.0.3", "m3", "")]
+    assert state["chunks"] == {"10.0.0.2": {(0, 8): [{"port": 22}]}}
+    assert list(state["devices"]) == ["10.0.0.3"]
+    # 继续任务时重写日志, 半条记录被丢弃
+    journal.resume(state)
+    assert journal.load() == dict(state)
+    with open(journal.path, encoding="utf-8") as f:
+        assert all(line.endswith("}\n") for line in f)
+
+
+def test_buffered_records_are_not_visible_until_flush(journal):
+    journal.begin({"kind": "discovery"})
+    journal.host({"ip": "10.0.0.2", "ports": []})
+    assert journal.load()["devices"] == {}
+    journal.flush()
+    assert list(journal.load()["devices"]) == ["10.0.0.2"]
+
+
+def test_complete_compacts_journal(journal):
+    journal.begin({"kind": "discovery"})
+    journal.host({"ip": "10.0.0.2", "ports": []})
+    journal.complete(run_id=7)
+    with open(journal.path, encoding="utf-8") as f:
+        assert len(f.readlines()) == 1
+    assert journal.load()["complete"] and journal.pending() is None
+    journal.discard()
+    assert journal.load() is None
+
+
+def test_scan_ports_checkpoints_and_skips_chunks(monkeypatch):
+    scanner = app.HomeNetworkScanner()
+    monkeypatch.setattr(app, "CHECKPOINT_CHUNK_SIZE", 100)
+    slices = [list(app.PortSlice(app.PortSpec("1-300"), index, 3)) for index in range(3)]
+    opened = [ports[49] for ports in slices]
+    scanned = []
+
+    def fake_engine(ip, ports, get_timeout, rate, on_result):
+        for port in ports:
+            scanned.append(port)
+            on_result(port, 0 if port in opened else errno.ECONNREFUSED)
+
+    monkeypatch.setattr(scanner, "_scan_ports_thread", fake_engine)
+    chunks = {}
+    result = scanner.scan_ports("10.0.0.2", ports="1-300", engine="thread", skip_chunks={(1, 3)},
+                                checkpoint=lambda index, count, ports: chunks.update({(index, count): ports}))
+    assert scanned == slices[0] + slices[2]
+    assert {key: [p["port"] for p in ports] for key, ports in chunks.items()} == {(0, 3): [opened[0]],
+                                                                                  (2, 3): [opened[2]]}
+    assert sorted(p["port"] for p in result) == sorted([opened[0], opened[2]])
+
+
+def test_discovery_resumes_from_journal(monkeypatch, tmp_path, journal):
+    monkeypatch.setattr(app, "STORE", app.ScanStore(str(tmp_path / "history.db")))
+    monkeypatch.setattr(app, "JOURNAL", journal)
+    monkeypatch.setattr(app, "CHECKPOINT_CHUNK_SIZE", 100)
+    scanner = app.HomeNetworkScanner()
+    scanner.fingerprint_enabled = False
+    monkeypatch.setattr(scanner, "ping_scan", lambda *args, **kwargs: pytest.fail("恢复时不应重新发现设备"))
+    slices = [list(app.PortSlice(app.PortSpec("1-300"), index, 3)) for index in range(3)]
+    opened = slices[2][-1]
+    scanned = []
+
+    def fake_engine(ip, ports, get_timeout, rate, on_result):
+        for port in ports:
+            scanned.append((ip, port))
+            on_result(port, 0 if port == opened else errno.ECONNREFUSED)
+
+    monkeypatch.setattr(scanner, "_scan_ports_thread", fake_engine)
+    monkeypatch.setattr(scanner, "engine", "thread")
+    # 中断前: .3 已完成, .2 的第一块已完成并发现 22
+    journal.begin({"kind": "discovery", "ports": "1-300"})
+    journal.hosts([("10.0.0.2", "m2", ""), ("10.0.0.3", "m3", "")])
+    journal.chunk("10.0.0.2", 0, 3, [{"port": 22, "service": "SSH"}])
+    journal.host({"ip": "10.0.0.3", "ports": [{"port": 80}]})
+    journal.flush()
+
+    devices = scanner.discovery(ports=app.PortSpec("1-300"), resume=journal.pending())
+    assert scanned == [("10.0.0.2", port) for port in slices[1] + slices[2]]
+    assert [d["ip"] for d in devices] == ["10.0.0.2", "10.0.0.3"]
+    assert sorted(p["port"] for p in devices[0]["ports"]) == sorted([22, opened])
+    assert journal.pending() is None and journal.load()["complete"]
+    assert sorted(d["ip"] for d in app.STORE.latest_devices()) == ["10.0.0.2", "10.0.0.3"]
+
+
+def test_timeout_retry_results_are_checkpointed(monkeypatch):
+    scanner = app.HomeNetworkScanner()
+    attempts = {}
+
+    # 443 第一次超时, 重试时开放; 22 直接开放
+    def fake_engine(ip, ports, get_timeout, rate, on_result):
+        for port in ports:
+            attempts[port] = attempts.get(port, 0) + 1
+            if port == 22 or (port == 443 and attempts[port] > 1):
+                on_result(port, 0)
+            elif port == 443:
+                on_result(port, errno.ETIMEDOUT)
+            else:
+                on_result(port, errno.ECONNREFUSED)
+
+    monkeypatch.setattr(scanner, "_scan_ports_thread", fake_engine)
+    chunks = {}
+
+    def checkpoint(index, count, open_ports):
+        chunks[(index, count)] = [p["port"] for p in open_ports]
+
+    result = scanner.scan_ports("10.0.0.2", ports="1-1000", engine="thread", checkpoint=checkpoint)
+    assert sorted(p["port"] for p in result) == [22, 443]
+    # 重试发现的端口重新写入所在块的检查点
+    assert sorted(port for ports in chunks.values() for port in ports) == [22, 443]
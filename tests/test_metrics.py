@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+import errno
+import threading
+
+import app
+
+
+def test_counters_merge_thread_shards():
+    metrics = app.Metrics()
+    metrics.counter("test_total", "测试计数")
+
+    def work():
+        for _ in range(1000):
+            metrics.inc("test_total", (("result", "open"),))
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    metrics.inc("test_total", (("result", "closed"),), 5)
+    values = metrics.collect()
+    assert values[("test_total", (("result", "open"),))] == 4000
+    assert values[("test_total", (("result", "closed"),))] == 5
+    # 已结束线程的分片并入 _retired, 再次抓取结果不变
+    assert len(metrics._shards) == 1
+    assert metrics.collect() == values
+
+
+def test_histogram_render_is_cumulative():
+    metrics = app.Metrics()
+    metrics.histogram("test_seconds", "测试耗时", (0.1, 1))
+    for value in (0.05, 0.5, 0.5, 3):
+        metrics.observe("test_seconds", value)
+    text = metrics.render()
+    assert "# TYPE test_seconds histogram" in text
+    assert 'test_seconds_bucket{le="0.1"} 1' in text
+    assert 'test_seconds_bucket{le="1"} 3' in text
+    assert 'test_seconds_bucket{le="+Inf"} 4' in text
+    assert "test_seconds_sum 4.05" in text and "test_seconds_count 4" in text
+
+
+def test_gauges_and_label_escaping():
+    metrics = app.Metrics()
+    metrics.gauge("test_set", "设置的值")
+    metrics.gauge("test_collect", "抓取时采集", lambda: {(("name", 'a"b\\c'),): 3})
+    metrics.gauge("test_broken", "采集失败", lambda: 1 / 0)
+    metrics.set("test_set", 7)
+    text = metrics.render()
+    assert "test_set 7" in text
+    assert 'test_collect{name="a\\"b\\\\c"} 3' in text
+    # 采集失败的仪表盘不输出, 不影响其他指标
+    assert "test_broken" not in text
+
+
+def test_scan_ports_records_probe_results(monkeypatch, job):
+    metrics = app.Metrics()
+    monkeypatch.setattr(app, "METRICS", metrics)
+    metrics.counter("hpm_probes_total", "")
+    metrics.histogram("hpm_scan_duration_seconds", "", app.DURATION_BUCKETS)
+    metrics.counter("hpm_scans_total", "")
+    metrics.gauge("hpm_scan_ports_per_second", "")
+    scanner = app.HomeNetworkScanner()
+
+    def fake_engine(ip, ports, get_timeout, rate, on_result):
+        for port in ports:
+            on_result(port, {22: 0, 23: errno.ETIMEDOUT}.get(port, errno.ECONNREFUSED))
+
+    monkeypatch.setattr(scanner, "_scan_ports_thread", fake_engine)
+    scanner.scan_ports("10.0.0.2", ports="21-24", engine="thread")
+    values = metrics.collect()
+    assert values[("hpm_probes_total", (("result", "open"),))] == 1
+    # 主机有响应, 超时的端口以更长的超时重试一次, 两次都计入
+    assert values[("hpm_probes_total", (("result", "timeout"),))] == 2
+    assert values[("hpm_probes_total", (("result", "closed"),))] == 2
+    assert values[("hpm_scans_total", (("kind", "ports"),))] == 1
+
+
+def test_metrics_route():
+    response = app.app.test_client().get("/metrics")
+    assert response.status_code == 200
+    assert response.content_type.startswith("text/plain; version=0.0.4")
+    text = response.get_data(as_text=True)
+    for name in ("hpm_probes_total", "hpm_job_queue_depth", "hpm_threads", "hpm_startup_seconds"):
+        assert f"# TYPE {name} " in text
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+import io
+import socket
+import struct
+
+import pytest
+
+import app
+
+PROC_NET_ARP = """IP address       HW type     Flags       HW address            Mask     Device
+192.168.1.1      0x1         0x2         AA:BB:CC:00:00:01     *        eth0
+192.168.1.7      0x1         0x0         00:00:00:00:00:00     *        eth0
+192.168.1.8      0x1         0x6         aa:bb:cc:00:00:08     *        eth0
+192.168.1.9      0x1         0x2         00:00:00:00:00:00     *        eth0
+"""
+
+
+def attr(attr_type, value):
+    data = app.NETLINK_ATTR.pack(app.NETLINK_ATTR.size + len(value), attr_type) + value
+    return data + b"\0" * (-len(data) % 4)
+
+
+def neigh_message(ip, mac, state, family=socket.AF_INET):
+    body = app.NETLINK_NDMSG.pack(family, 0, 0, 2, state, 0, 1)
+    body += attr(app.NDA_DST, socket.inet_aton(ip))
+    if mac:
+        body += attr(app.NDA_LLADDR, bytes.fromhex(mac.replace(":", "")))
+    return app.NETLINK_HEADER.pack(app.NETLINK_HEADER.size + len(body), app.RTM_NEWNEIGH, 2, 1, 0) + body
+
+
+def done_message():
+    return app.NETLINK_HEADER.pack(app.NETLINK_HEADER.size + 4, app.NLMSG_DONE, 2, 1, 0) + b"\0" * 4
+
+
+def test_parse_netlink_neighbors():
+    chunks = [neigh_message("192.168.1.1", "AA:BB:CC:00:00:01", 0x02)
+              + neigh_message("192.168.1.7", None, 0x01)
+              + neigh_message("192.168.1.8", "aa:bb:cc:00:00:08", 0x04),
+              neigh_message("192.168.1.9", "aa:bb:cc:00:00:09", 0x08)
+              + neigh_message("192.168.1.10", "aa:bb:cc:00:00:10", 0x20)
+              + done_message(),
+              pytest.fail]
+    assert app.parse_netlink_neighbors(iter(chunks)) == {"192.168.1.1": ("aa:bb:cc:00:00:01", "REACHABLE"),
+                                                         "192.168.1.8": ("aa:bb:cc:00:00:08", "STALE"),
+                                                         "192.168.1.9": ("aa:bb:cc:00:00:09", "DELAY")}
+
+
+def test_netlink_error_is_raised():
+    error = app.NETLINK_HEADER.pack(app.NETLINK_HEADER.size + 4, app.NLMSG_ERROR, 0, 1, 0) + struct.pack("=i", -1)
+    with pytest.raises(OSError):
+        app.parse_netlink_neighbors(iter([error]))
+
+
+def test_netlink_needs_no_subprocess(monkeypatch):
+    if not hasattr(socket, "AF_NETLINK"):
+        pytest.skip("需要 Linux netlink")
+    monkeypatch.setattr(app.subprocess, "run", lambda *args, **kwargs: pytest.fail("不应启动子进程"))
+    monkeypatch.setattr(app, "open", lambda *args, **kwargs: pytest.fail("不应读取 /proc/net/arp"), raising=False)
+    table = app.read_neighbor_table()
+    assert all(state in app.NUD_STATES.values() for _, state in table.values())
+
+
+def test_proc_net_arp_flags_become_states(monkeypatch):
+    monkeypatch.setattr(app, "_netlink_neighbors", lambda: (_ for _ in ()).throw(OSError("no netlink")))
+    monkeypatch.setattr(app, "open", lambda path, *args, **kwargs: io.StringIO(PROC_NET_ARP), raising=False)
+    assert app.read_neighbor_table() == {"192.168.1.1": ("aa:bb:cc:00:00:01", "COMPLETE"),
+                                         "192.168.1.8": ("aa:bb:cc:00:00:08", "PERMANENT")}
+
+
+def test_arp_fallback_without_proc(monkeypatch):
+    class Result:
+        stdout = "? (10.0.0.1) at 00-11-22-33-44-55 on en0 ifscope [ethernet]\n? (10.0.0.2) at (incomplete) on en0\n"
+
+    def no_proc(path, *args, **kwargs):
+        raise FileNotFoundError(path)
+
+    monkeypatch.setattr(app, "_netlink_neighbors", lambda: (_ for _ in ()).throw(AttributeError("AF_NETLINK")))
+    monkeypatch.setattr(app, "open", no_proc, raising=False)
+    monkeypatch.setattr(app.subprocess, "run", lambda *args, **kwargs: Result())
+    assert app.read_neighbor_table() == {"10.0.0.1": ("00:11:22:33:44:55", None)}
+
+
+def test_ping_scan_reads_table_once(monkeypatch):
+    scanner = app.HomeNetworkScanner()
+    scanner.custom_network = "10.0.0.0/24"
+    reads = []
+
+    def table():
+        reads.append(1)
+        return {"10.0.0.2": ("aa:00:00:00:00:02", "STALE"), "10.0.0.4": ("aa:00:00:00:00:04", "REACHABLE"),
+                "10.0.0.5": ("aa:00:00:00:00:05", "STALE"), "10.0.0.6": ("aa:00:00:00:00:06", "COMPLETE")}
+
+    monkeypatch.setattr(scanner, "ping_engine", "icmp")
+    monkeypatch.setattr(scanner, "discovery_mode", "icmp")
+    monkeypatch.setattr(scanner, "_icmp_sweep", lambda ips, timeout, progress_callback=None, rate=None: {"10.0.0.2": 0.3, "10.0.0.3": 0.5})
+    monkeypatch.setattr(app, "read_neighbor_table", table)
+    # 10.0.0.3 回应但不在邻居表; 10.0.0.4 没回应但刚回应过ARP;
+    # 10.0.0.5 只有 STALE 条目, 10.0.0.6 来自 /proc/net/arp 无法判断新鲜度, 都不算在线
+    assert scanner.ping_scan() == [("10.0.0.2", "aa:00:00:00:00:02", ""), ("10.0.0.3", "00:00:00:00:00:00", ""),
+                                   ("10.0.0.4", "aa:00:00:00:00:04", "")]
+    assert reads == [1]
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+import ipaddress
+
+import pytest
+
+import app
+
+
+def nets(*cidrs):
+    return [ipaddress.IPv4Network(c) for c in cidrs]
+
+
+def test_parse_networks_accepts_lists_and_any_prefix():
+    assert app.parse_networks("192.168.0.0/22, 10.0.0.0/16") == nets("10.0.0.0/16", "192.168.0.0/22")
+    assert app.parse_networks("10.1.2.3/14") == nets("10.0.0.0/14")
+    assert app.parse_networks("10.0.0.7") == nets("10.0.0.7/32")
+
+
+def test_size_limit():
+    limit_prefix = 32 - app.MAX_DISCOVERY_HOSTS.bit_length() + 1
+    assert app.parse_networks(f"10.0.0.0/{limit_prefix}") == nets(f"10.0.0.0/{limit_prefix}")
+    with pytest.raises(ValueError):
+        app.parse_networks(f"10.0.0.0/{limit_prefix - 1}")
+
+
+def test_nested_network_is_merged_into_enclosing():
+    assert app.parse_networks("10.0.0.0/24, 10.0.0.0/16") == nets("10.0.0.0/16")
+    assert app.parse_networks("10.0.0.0/16 10.0.0.0/24") == nets("10.0.0.0/16")
+    assert app.parse_networks("10.0.1.0/24 10.0.0.0/23") == nets("10.0.0.0/23")
+
+
+def test_adjacent_networks_are_collapsed():
+    assert app.parse_networks("10.0.0.0/24;10.0.1.0/24") == nets("10.0.0.0/23")
+    assert app.parse_networks("10.0.0.0/24, 10.0.2.0/24") == nets("10.0.0.0/24", "10.0.2.0/24")
+
+
+def test_host_bits_and_duplicates():
+    assert app.parse_networks("192.168.1.77/24, 192.168.1.0/24") == nets("192.168.1.0/24")
+
+
+def test_size_limit_counts_collapsed_networks():
+    # 重叠部分只计一次
+    limit_prefix = 32 - app.MAX_DISCOVERY_HOSTS.bit_length() + 1
+    spec = f"10.0.0.0/{limit_prefix}, 10.0.0.0/{limit_prefix + 1}"
+    assert app.parse_networks(spec) == nets(f"10.0.0.0/{limit_prefix}")
+
+
+@pytest.mark.parametrize("spec", ["", "  ", "10.0.0.0/33", "foo"])
+def test_invalid_specs(spec):
+    with pytest.raises(ValueError):
+        app.parse_networks(spec)
+
+
+def test_count_hosts():
+    assert app.count_hosts(nets("10.0.0.0/24", "10.0.1.0/31", "10.0.2.1/32")) == 254 + 2 + 1
+
+
+def test_host_shards_are_lazy_and_sized():
+    shards = app.iter_host_shards(nets("10.0.0.0/22", "10.1.0.0/30"), shard_size=300, exclude={"10.0.0.1"})
+    sizes = [len(shard) for shard in shards]
+    assert sizes == [300, 300, 300, 123]
+    first = next(app.iter_host_shards(nets("10.0.0.0/14"), shard_size=4))
+    assert first == ["10.0.0.1", "10.0.0.2", "10.0.0.3", "10.0.0.4"]
+
+
+def test_ping_scan_reports_each_shard(monkeypatch, job):
+    scanner = app.HomeNetworkScanner()
+    scanner.custom_network = "10.0.0.0/22, 10.0.8.0/24"
+    scanner._network_info = {"local_ip": "10.0.0.1", "gateway": None, "network": None}
+    swept, shards = [], []
+
+    def fake_shard(ips, workers, progress_callback=None, rate=None):
+        swept.append(len(ips))
+        return [(ips[0], "00:00:00:00:00:00", "")]
+
+    monkeypatch.setattr(scanner, "_sweep_shard", fake_shard)
+    found = scanner.ping_scan(shard_callback=lambda found, index, total: shards.append((found[0][0], index, total)))
+    assert swept == [app.DISCOVERY_SHARD_SIZE, 1022 - 1 + 254 - app.DISCOVERY_SHARD_SIZE]
+    assert [ip for ip, _, _ in found] == [s[0] for s in shards]
+    assert [(index, total) for _, index, total in shards] == [(i, len(swept)) for i in range(1, len(swept) + 1)]
+    assert job.status["shard"] is None
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import app
+
+
+def unique_ranked(source):
+    seen = []
+    for port in app._expand_ports(source):
+        if port not in seen:
+            seen.append(port)
+    return seen
+
+
+def test_ranked_is_first_occurrence_order_without_duplicates():
+    ranked = app.PORTS.ranked("tcp")
+    assert ranked == unique_ranked(app._TCP_RANKED)
+    assert len(ranked) == len(set(ranked))
+    assert all(1 <= port <= 65535 for port in ranked)
+    assert app.PORTS.ranked("udp") == unique_ranked(app._UDP_RANKED)
+
+
+@pytest.mark.parametrize("n", [1, 100, 1000, 2000])
+def test_top_n_is_head_of_ranking(n):
+    ranked = unique_ranked(app._TCP_RANKED)
+    top = list(app.PORTS.top(n))
+    assert len(top) == n == len(app.PORTS.top(n))
+    assert len(set(top)) == n
+    head = ranked[:n]
+    assert top[:len(head)] == head
+    # 排名表不够 n 个时按端口号补足
+    rest = top[len(head):]
+    assert rest == sorted(rest)
+
+
+def test_port_modes_stay_within_ranking():
+    # 除全端口外, 预设模式不能超出频率排名表, 否则只是按端口号补足
+    ranked = len(app.PORTS.ranked())
+    assert all(n <= ranked for mode, n in app.PORT_MODES.items() if mode != "full")
+    with pytest.raises(ValueError):
+        app.resolve_port_mode("top5000")
+
+
+def test_top_ports_membership():
+    top100 = app.PORTS.top(100)
+    ranked = app.PORTS.ranked()
+    assert ranked[0] in top100 and ranked[99] in top100
+    assert ranked[100] not in top100
+    assert 0 not in top100 and 65536 not in top100
+    full = app.PORTS.top(65535)
+    assert 1 in full and 65535 in full and 0 not in full
+    assert str(top100) == "top100" and str(full) == "1-65535"
+    assert app.COMMON_PORTS.n == 1000 and len(app.ALL_PORTS) == 65535
+
+
+def test_full_range_iterates_every_port_once():
+    ports = list(app.ALL_PORTS)
+    assert len(ports) == 65535
+    assert set(ports) == set(range(1, 65536))
+    assert ports[:10] == app.PORTS.ranked()[:10]
+
+
+@pytest.mark.parametrize("spec, expected", [
+    ("22", {22}),
+    ("80,443,80", {80, 443}),
+    ("1-100,50-150,22", set(range(1, 151))),
+    ("1-65535", set(range(1, 65536))),
+])
+def test_port_spec_covers_each_port_once(spec, expected):
+    port_spec = app.PortSpec(spec)
+    ports = list(port_spec)
+    assert len(ports) == len(expected) == len(port_spec)
+    assert set(ports) == expected
+    assert all(port in port_spec for port in expected)
+
+
+@pytest.mark.parametrize("spec", ["", "0", "65536", "abc", "10-5x", "top0", "top65536"])
+def test_parse_ports_rejects_bad_specs(spec):
+    with pytest.raises(ValueError):
+        app.parse_ports(spec)
+
+
+def test_resolve_port_mode():
+    assert app.resolve_port_mode("common") == (True, None)
+    assert app.resolve_port_mode("full") == (False, None)
+    fast_mode, top = app.resolve_port_mode("top100")
+    assert fast_mode and str(top) == "top100"
+    fast_mode, spec = app.resolve_port_mode("full", "22,80")
+    assert not fast_mode and set(spec) == {22, 80}
+    with pytest.raises(ValueError):
+        app.resolve_port_mode("top7")
+
+
+def test_bad_mode_returns_400(monkeypatch):
+    monkeypatch.setitem(app.SCAN_CACHE, "10.0.0.2", {"ip": "10.0.0.2", "ports": []})
+    client = app.app.test_client()
+    assert client.get("/api/scan/all?mode=bogus").status_code == 400
+    assert client.get("/api/scan/ports/10.0.0.2?mode=bogus").status_code == 400
+    assert client.get("/api/scan/ports/10.0.0.2?mode=full&ports=abc").status_code == 400
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+import errno
+
+import app
+
+
+def feed(rate, err, count):
+    for _ in range(count):
+        rate.on_result(err)
+
+
+def test_additive_increase_per_window():
+    rate = app.RateController("test:increase", maximum=320, initial=100)
+    feed(rate, errno.ECONNREFUSED, 99)
+    assert rate.limit == 100
+    rate.on_result(0)
+    assert rate.limit == 100 + rate.step == 110
+    feed(rate, errno.ECONNREFUSED, 10 ** 4)
+    assert rate.limit == 320
+
+
+def test_local_errors_halve_the_limit_once_per_period():
+    rate = app.RateController("test:emfile", maximum=400, initial=200, minimum=60)
+    rate.on_result(errno.EMFILE)
+    rate.on_result(errno.ENOBUFS)  # 同一批在途连接的失败只降一次
+    assert rate.limit == 100 and rate.decreases == 1
+    rate._last_decrease = 0
+    rate.on_result(errno.EADDRNOTAVAIL)
+    assert rate.limit == 60
+
+
+def test_timeouts_only_count_when_host_answers():
+    rate = app.RateController("test:loss", maximum=200, initial=100)
+    # 全部超时: 主机过滤了端口, 继续加速
+    feed(rate, errno.ETIMEDOUT, 100)
+    assert rate.limit == 106 and rate.decreases == 0
+    # 有响应且超时超过 30%: 网络丢包, 降速
+    feed(rate, 0, 60)
+    feed(rate, errno.ETIMEDOUT, 46)
+    assert rate.limit == 53 and rate.decreases == 1
+
+
+def test_wait_time_paces_to_pps_cap():
+    rate = app.RateController("test:pps", maximum=10, pps_cap=100)
+    waits = [rate.wait_time() for _ in range(5)]
+    assert waits[0] == 0
+    assert 0.03 < waits[-1] <= 0.04
+    assert app.RateController("test:nocap", maximum=10).wait_time() == 0
+
+
+def test_status_is_published_and_kept_after_close():
+    rate = app.RateController("ports:10.0.0.2", maximum=64)
+    assert app.rate_snapshot()["ports:10.0.0.2"]["limit"] == rate.limit
+    rate.close()
+    snapshot = app.rate_snapshot()
+    assert "ports:10.0.0.2" not in snapshot and snapshot["last:ports"]["maximum"] == 64
+
+
+def test_ports_failed_for_local_resources_are_rescanned(monkeypatch):
+    scanner = app.HomeNetworkScanner()
+    calls = []
+
+    def fake_engine(ip, ports, get_timeout, rate, on_result):
+        ports = list(ports)
+        calls.append((len(ports), rate.limit))
+        for port in ports:
+            # 第一轮 100 之后的端口都因为文件描述符耗尽失败
+            on_result(port, errno.EMFILE if len(calls) == 1 and port > 100 else (0 if port == 500 else errno.ECONNREFUSED))
+
+    monkeypatch.setattr(scanner, "_scan_ports_thread", fake_engine)
+    result = scanner.scan_ports("10.0.0.2", ports="1-1000", engine="thread")
+    assert [p["port"] for p in result] == [500]
+    assert calls[1][0] == 900 and calls[1][1] < calls[0][1]
+
+
+def test_jobs_scanning_same_host_keep_separate_entries(monkeypatch):
+    first, second = app.ScanJob("ports", fn=None), app.ScanJob("all", fn=None)
+    seen = {}
+
+    def fake_engine(ip, ports, get_timeout, rate, on_result):
+        seen[app.current_job().id] = (rate.name, dict(app.rate_snapshot()))
+        for port in ports:
+            on_result(port, errno.ECONNREFUSED)
+
+    scanner = app.HomeNetworkScanner()
+    monkeypatch.setattr(scanner, "_scan_ports_thread", fake_engine)
+    token = app.CURRENT_JOB.set(first)
+    try:
+        outer = app.RateController(f"ports:thread:{second.id}:10.0.0.2", maximum=8)
+        scanner.scan_ports("10.0.0.2", ports="1-10", engine="thread")
+    finally:
+        app.CURRENT_JOB.reset(token)
+    name, snapshot = seen[first.id]
+    assert name == f"ports:thread:{first.id}:10.0.0.2"
+    assert outer.name in snapshot and name in snapshot
+    # 一个任务结束不影响另一个任务的状态
+    assert outer.name in app.rate_snapshot() and name not in app.rate_snapshot()
+    outer.close()
+
+
+def test_concurrency_gauge_sums_by_kind_and_engine(monkeypatch):
+    monkeypatch.setattr(app, "RATE_STATUS", {})
+    rates = [app.RateController(name, maximum=64, initial=10)
+             for name in ("ports:async:1:10.0.0.2", "ports:async:2:10.0.0.3", "ping:icmp:1")]
+    assert app._concurrency_limits() == {(("controller", "ports"), ("engine", "async")): 20,
+                                         (("controller", "ping"), ("engine", "icmp")): 10}
+    for rate in rates:
+        rate.close()
+    assert app._concurrency_limits() == {}
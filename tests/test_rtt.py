@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+import errno
+
+import app
+
+
+def test_timeout_uses_default_until_enough_samples():
+    tracker = app.HostRttTracker()
+    assert tracker.timeout_for("10.0.0.2", 0.5) == 0.5
+    for _ in range(app.ADAPTIVE_TIMEOUT["min_samples"] - 1):
+        tracker.record("10.0.0.2", 0.01)
+    assert tracker.timeout_for("10.0.0.2", 0.5) == 0.5
+    tracker.record("10.0.0.2", 0.01)
+    assert tracker.timeout_for("10.0.0.2", 0.5) == 0.01 * app.ADAPTIVE_TIMEOUT["multiplier"]
+
+
+def test_timeout_percentile_and_clamp():
+    tracker = app.HostRttTracker()
+    for rtt in [0.001] * 19 + [0.1]:
+        tracker.record("fast", rtt)
+    # 95 分位落在最慢的样本上
+    assert tracker.timeout_for("fast", 1.0) == 0.1 * app.ADAPTIVE_TIMEOUT["multiplier"]
+    for _ in range(5):
+        tracker.record("lan", 0.0001)
+        tracker.record("far", 5.0)
+    assert tracker.timeout_for("lan", 1.0) == app.ADAPTIVE_TIMEOUT["min"]
+    assert tracker.timeout_for("far", 1.0) == app.ADAPTIVE_TIMEOUT["max"]
+
+
+def test_full_window_uses_cache_and_refreshes():
+    tracker = app.HostRttTracker(max_samples=16)
+    for _ in range(16):
+        tracker.record("10.0.0.2", 0.01)
+    first = tracker.timeout_for("10.0.0.2", 1.0)
+    sorts = []
+    original = tracker._samples["10.0.0.2"]
+
+    class CountingDeque(type(original)):
+        def __iter__(self):
+            sorts.append(1)
+            return super().__iter__()
+
+    tracker._samples["10.0.0.2"] = CountingDeque(original, maxlen=16)
+    # 窗口已满, 样本数不变, 但仍应命中缓存
+    tracker.record("10.0.0.2", 0.2)
+    assert tracker.timeout_for("10.0.0.2", 1.0) == first
+    assert sorts == []
+    # 新增满8个样本后重新计算, 即使 len() 一直是16
+    for _ in range(7):
+        tracker.record("10.0.0.2", 0.2)
+    assert tracker.timeout_for("10.0.0.2", 1.0) == 0.2 * app.ADAPTIVE_TIMEOUT["multiplier"]
+    assert sorts == [1]
+
+
+def test_stats():
+    tracker = app.HostRttTracker()
+    assert tracker.stats("10.0.0.2") is None
+    for rtt in (0.003, 0.001, 0.002):
+        tracker.record("10.0.0.2", rtt)
+    assert tracker.stats("10.0.0.2") == {"samples": 3, "p50_ms": 2.0, "max_ms": 3.0}
+
+
+def test_timed_out_ports_are_retried_with_longer_timeout(monkeypatch):
+    scanner = app.HomeNetworkScanner()
+    calls = []
+
+    def fake_engine(ip, ports, get_timeout, workers, on_result):
+        ports = list(ports)
+        calls.append((ports, get_timeout()))
+        for port in ports:
+            # 443 第一次超时, 重试时开放
+            if port == 22 or (port == 443 and len(calls) > 1):
+                on_result(port, 0)
+            elif port == 443:
+                on_result(port, errno.ETIMEDOUT)
+            else:
+                on_result(port, errno.ECONNREFUSED)
+
+    monkeypatch.setattr(scanner, "_scan_ports_thread", fake_engine)
+    result = scanner.scan_ports("10.0.0.2", ports="1-1000", engine="thread")
+    assert [p["port"] for p in result] == [22, 443]
+    assert calls[1][0] == [443] and calls[1][1] > calls[0][1]
+
+
+def test_filtered_host_is_not_retried(monkeypatch):
+    scanner = app.HomeNetworkScanner()
+    calls = []
+
+    def fake_engine(ip, ports, get_timeout, workers, on_result):
+        calls.append(1)
+        for port in ports:
+            on_result(port, errno.ETIMEDOUT)
+
+    monkeypatch.setattr(scanner, "_scan_ports_thread", fake_engine)
+    assert scanner.scan_ports("10.0.0.2", ports="1-1000", engine="thread") == []
+    assert calls == [1]
@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+import app
+
+
+def test_full_scan_keeps_devices_added_concurrently(monkeypatch):
+    monkeypatch.setattr(app, "SCAN_CACHE", {"10.0.0.2": {"ip": "10.0.0.2"}, "10.0.0.3": {"ip": "10.0.0.3"}})
+    before = list(app.SCAN_CACHE)
+    # 全网扫描进行中, 设备发现任务加入了一台新设备
+    app.SCAN_CACHE["10.0.0.9"] = {"ip": "10.0.0.9"}
+    app.merge_scan_results([{"ip": "10.0.0.2", "ports": []}], before)
+    assert sorted(app.SCAN_CACHE) == ["10.0.0.2", "10.0.0.9"]
+
+
+def test_scoped_scan_only_removes_devices_in_scope(monkeypatch):
+    monkeypatch.setattr(app, "SCAN_CACHE", {"10.0.0.2": {"ip": "10.0.0.2"}, "10.0.1.2": {"ip": "10.0.1.2"}})
+    app.merge_scan_results([], list(app.SCAN_CACHE), app.parse_networks("10.0.0.0/24"))
+    assert list(app.SCAN_CACHE) == ["10.0.1.2"]
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+import socket
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def listener():
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(("127.0.0.1", 0))
+    server.listen(16)
+    yield server.getsockname()[1]
+    server.close()
+
+
+def closed_port():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+@pytest.mark.parametrize("engine", ["async", "thread"])
+def test_engines_find_open_port(listener, engine):
+    scanner = app.HomeNetworkScanner()
+    ports = [closed_port(), listener]
+    found, progress = [], []
+    result = scanner.scan_ports("127.0.0.1", ports=ports, engine=engine,
+                                found_callback=found.append,
+                                progress_callback=lambda done, total: progress.append((done, total)))
+    assert [p["port"] for p in result] == [listener]
+    assert found == result
+    assert progress[-1] == (2, 2)
+
+
+def test_set_engine_rejects_unknown():
+    scanner = app.HomeNetworkScanner()
+    assert scanner.set_engine("thread") and scanner.engine == "thread"
+    assert not scanner.set_engine("nope") and scanner.engine == "thread"
+
+
+def test_port_spec_merges_ranges():
+    spec = app.PortSpec("8000-9000, 80,1-1024,1025, 8500")
+    assert spec.ranges == [(1, 1025), (8000, 9000)]
+    assert len(spec) == 1025 + 1001
+    assert str(spec) == "1-1025,8000-9000"
+    # 按开放概率排序迭代
+    assert list(app.PortSpec("22,21-23")) == [p for p in app.PORTS.ranked() if p in (21, 22, 23)]
+
+
+@pytest.mark.parametrize("spec", ["", "0", "1-65536", "10-5", "a", "1-2-3"])
+def test_port_spec_rejects_invalid(spec):
+    with pytest.raises(ValueError):
+        app.PortSpec(spec)
+
+
+def test_thread_engine_bounds_in_flight_window(monkeypatch):
+    scanner = app.HomeNetworkScanner()
+    lock = app.threading.Lock()
+    state = {"inflight": 0, "peak": 0, "pulled": 0}
+
+    def ports():
+        for port in range(1, 2001):
+            state["pulled"] += 1
+            yield port
+
+    def fake_check(ip, port, timeout=1.0):
+        with lock:
+            state["inflight"] += 1
+            state["peak"] = max(state["peak"], state["inflight"])
+        app.time.sleep(0.0005)
+        with lock:
+            state["inflight"] -= 1
+        return 0 if port == 1000 else app.errno.ECONNREFUSED
+
+    monkeypatch.setattr(scanner, "_tcp_connect", fake_check)
+    seen = []
+    rate = app.RateController("test", maximum=8, initial=4)
+    scanner._scan_ports_thread("10.0.0.2", ports(), lambda: 0.1, rate, lambda port, err: seen.append(port))
+    assert sorted(seen) == list(range(1, 2001))
+    assert state["peak"] <= rate.limit
+
+
+def test_thread_engine_pulls_ports_lazily(monkeypatch):
+    scanner = app.HomeNetworkScanner()
+    release = app.threading.Event()
+    pulled = []
+
+    def ports():
+        for port in range(1, 65536):
+            pulled.append(port)
+            yield port
+
+    def blocked_check(ip, port, timeout=1.0):
+        release.wait(5)
+        return app.errno.ECONNREFUSED
+
+    monkeypatch.setattr(scanner, "_tcp_connect", blocked_check)
+    results = []
+    worker = app.threading.Thread(target=scanner._scan_ports_thread,
+                                  args=("10.0.0.2", ports(), lambda: 0.1, app.RateController("test", maximum=8, initial=4),
+                                        lambda port, err: results.append(port)))
+    worker.start()
+    app.time.sleep(0.2)
+    # 连接都阻塞时只取出一个窗口 (rate.limit) 的端口
+    assert len(pulled) == 4
+    release.set()
+    worker.join(10)
+    assert len(results) == 65535
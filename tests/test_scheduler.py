@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+from datetime import datetime
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def store(tmp_path):
+    return app.ScanStore(str(tmp_path / "history.db"))
+
+
+def wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "等待超时"
+        time.sleep(0.01)
+
+
+def test_cron_next():
+    # 2026-10-17 是周六
+    now = datetime(2026, 10, 17, 12, 30)
+    assert app.cron_next(app.parse_cron("*/15 * * * *"), now) == datetime(2026, 10, 17, 12, 45)
+    assert app.cron_next(app.parse_cron("0 3 * * *"), now) == datetime(2026, 10, 18, 3, 0)
+    assert app.cron_next(app.parse_cron("0 3 * * 1-5"), now) == datetime(2026, 10, 19, 3, 0)
+    assert app.cron_next(app.parse_cron("30 2 1 1 *"), now) == datetime(2027, 1, 1, 2, 30)
+
+
+@pytest.mark.parametrize("data", [
+    {"kind": "all"},
+    {"kind": "nope", "interval": 3600},
+    {"interval": 30},
+    {"cron": "0 3 * *"},
+    {"interval": 3600, "network": "10.0.0.0/33"},
+    {"interval": 3600, "ports": "0-10"},
+])
+def test_validate_rejects(data):
+    with pytest.raises(ValueError):
+        app.ScanScheduler.validate(data)
+
+
+def test_schedules_persist_in_store(store):
+    scheduler = app.ScanScheduler(store)
+    first = scheduler.add({"kind": "incremental", "interval": 3600, "network": "10.0.0.0/24", "ports": "22,80"})
+    second = scheduler.add({"kind": "devices", "cron": "0 3 * * *", "jitter": 0})
+    assert first == {"id": 1, "kind": "incremental", "enabled": True, "mode": "common", "interval": 3600,
+                     "network": "10.0.0.0/24", "ports": "22,80"}
+    assert scheduler.remove(first["id"]) and not scheduler.remove(first["id"])
+    assert [s["id"] for s in app.ScanScheduler(store).list()] == [second["id"]]
+
+
+def test_next_run_jitter(store):
+    scheduler = app.ScanScheduler(store)
+    now = time.time()
+    for _ in range(20):
+        delay = scheduler._compute_next({"interval": 1000, "jitter": 0.1}, now) - now
+        assert 1000 <= delay <= 1100
+    cron = scheduler._compute_next({"cron": "*/5 * * * *", "jitter": 0}, now)
+    assert datetime.fromtimestamp(cron).minute % 5 == 0 and 0 < cron - now <= 300
+
+
+def test_fire_submits_low_priority_background_job(store, monkeypatch):
+    manager = app.JobManager(workers=1, max_queue=4, history=10)
+    monkeypatch.setattr(app, "JOBS", manager)
+    calls = []
+    monkeypatch.setattr(app, "run_device_discovery", lambda network=None: calls.append(app.current_job()))
+    scheduler = app.ScanScheduler(store)
+    schedule = scheduler.add({"kind": "devices", "interval": 3600, "network": "10.0.0.0/24"})
+    scheduler._fire(schedule)
+    wait_for(lambda: calls)
+    job = calls[0]
+    assert job.background and job.priority == app.JOB_PRIORITIES["low"]
+    assert job.params == {"schedule": schedule["id"], "network": "10.0.0.0/24"}
+    assert scheduler.list()[0]["last"]["job"] == job.id
+
+
+def test_background_job_is_throttled(job):
+    scanner = app.HomeNetworkScanner()
+    interactive = scanner._speed_config()
+    job.background = True
+    background = scanner._speed_config()
+    assert background["port_workers"] == int(interactive["port_workers"] * app.BACKGROUND_SCAN["concurrency_factor"])
+    assert 0 < background["pps"] <= app.BACKGROUND_SCAN["pps"]
+    assert background["ping_pps"] <= app.BACKGROUND_SCAN["ping_pps"]
+
+
+def test_background_job_yields_to_interactive_job():
+    manager = app.JobManager(workers=2, max_queue=4, history=10)
+    release_bg, release_fg = threading.Event(), threading.Event()
+    background, _ = manager.submit("all", release_bg.wait, 5, priority=app.JOB_PRIORITIES["low"], background=True)
+    wait_for(lambda: background.state == "running")
+    assert not background.waiting()
+    interactive, _ = manager.submit("devices", release_fg.wait, 5)
+    wait_for(lambda: interactive.state == "running")
+    assert background.waiting() and not interactive.waiting()
+    release_fg.set()
+    wait_for(lambda: not background.waiting())
+    release_bg.set()
+
+
+def test_complete_run_only_marks_hosts_in_scope_offline(store):
+    store.save_run("discovery", [{"ip": "10.0.0.2"}, {"ip": "10.0.1.2"}])
+    store.save_run("discovery", [], scope=app.parse_networks("10.0.1.0/24"))
+    assert [d["ip"] for d in store.latest_devices()] == ["10.0.0.2"]
+
+
+def test_network_scan_only_replaces_devices_in_network(monkeypatch):
+    monkeypatch.setattr(app, "SCAN_CACHE", {"10.0.0.2": {"ip": "10.0.0.2"}, "10.0.1.2": {"ip": "10.0.1.2"}})
+    monkeypatch.setattr(app.scanner, "discovery", lambda fast_mode=False, ports=None, network=None:
+                        [{"ip": "10.0.1.3", "ports": []}])
+    assert app.run_full_scan(network="10.0.1.0/24") == ["10.0.1.3"]
+    assert sorted(app.SCAN_CACHE) == ["10.0.0.2", "10.0.1.3"]
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import socket
+import subprocess
+import sys
+import threading
+
+import pytest
+
+import app
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_import_does_not_auto_install():
+    assert not app.AUTO_INSTALL
+    assert [name for name, _ in app.STARTUP_PHASES][:1] == ["加载依赖"]
+
+
+def test_startup_phase_records_elapsed_time(monkeypatch):
+    monkeypatch.setattr(app, "STARTUP_PHASES", [])
+    with pytest.raises(RuntimeError):
+        with app.startup_phase("失败阶段"):
+            raise RuntimeError()
+    assert [name for name, _ in app.STARTUP_PHASES] == ["失败阶段"]
+    assert app.STARTUP_PHASES[0][1] >= 0
+
+
+def test_exit_without_tty_does_not_wait_for_input(monkeypatch):
+    monkeypatch.setattr(app.sys, "stdin", io.StringIO())
+    monkeypatch.setattr("builtins.input", lambda *args: pytest.fail("非交互环境不应等待输入"))
+    with pytest.raises(SystemExit):
+        app.exit_with_error()
+
+
+def test_network_is_detected_lazily_once(monkeypatch):
+    calls = []
+    monkeypatch.setattr(app.HomeNetworkScanner, "_get_local_ip", lambda self: calls.append("ip") or "10.0.0.5")
+    monkeypatch.setattr(app.HomeNetworkScanner, "_get_gateway", lambda self: calls.append("gw") or "10.0.0.1")
+    monkeypatch.setattr(app.HomeNetworkScanner, "_get_network", lambda self, ip=None: calls.append(ip) or "10.0.0.0/24")
+    scanner = app.HomeNetworkScanner()
+    scanner.custom_network = None
+    assert calls == []
+    threads = [threading.Thread(target=lambda: scanner.network) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert (scanner.local_ip, scanner.gateway, scanner.network) == ("10.0.0.5", "10.0.0.1", "10.0.0.0/24")
+    # 只检测一次, 网段计算复用已检测到的本机IP
+    assert calls == ["ip", "gw", "10.0.0.5"]
+
+
+def test_local_ip_falls_back_to_interface_address(monkeypatch):
+    class NoRoute(socket.socket):
+        def connect(self, address):
+            raise OSError("Network is unreachable")
+
+    monkeypatch.setattr(app.socket, "socket", NoRoute)
+    monkeypatch.setattr(app.netifaces, "interfaces", lambda: ["lo", "eth0"])
+    monkeypatch.setattr(app.netifaces, "ifaddresses", lambda iface: {
+        app.netifaces.AF_INET: [{"addr": "127.0.0.1"}] if iface == "lo" else [{"addr": "192.168.5.9"}]})
+    assert app.HomeNetworkScanner._get_local_ip(None) == "192.168.5.9"
+
+
+def test_import_does_not_start_scheduler():
+    # 定时扫描线程只在 __main__ 中启动, 导入模块不会触发扫描
+    assert app.SCHEDULER._thread is None
+
+
+def test_import_creates_no_data_files(tmp_path):
+    # 数据库和扫描日志在 init_data() 中创建, 仅导入模块不会在数据目录写入任何文件
+    env = dict(os.environ, HPM_DATA_DIR=str(tmp_path), HPM_AUTO_INSTALL="0")
+    code = "import app; assert app.STORE is None and app.JOURNAL is None and app.SCHEDULER is None"
+    subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env, check=True, capture_output=True)
+    assert list(tmp_path.iterdir()) == []
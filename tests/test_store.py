@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import json
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def store(tmp_path):
+    return app.ScanStore(str(tmp_path / "history.db"))
+
+
+def device(ip, *ports, **fields):
+    return dict({"ip": ip, "mac": "aa:bb:cc:dd:ee:ff", "ports": [{"port": port, "service": "svc"} for port in ports]},
+                **fields)
+
+
+def test_latest_devices_tracks_open_ports(store):
+    store.save_run("ports", [device("10.0.0.2", 22, 80, name="nas")])
+    store.save_run("ports", [device("10.0.0.2", 80, 443)])
+    (nas,) = store.latest_devices()
+    assert [p["port"] for p in nas["ports"]] == [80, 443]
+    history = store.host_history("10.0.0.2", port=22)
+    assert [o["state"] for o in history["observations"]] == ["closed", "open"]
+    assert history["ports"][0]["open"] == 0
+
+
+def test_complete_run_marks_missing_hosts_offline(store):
+    store.save_run("discovery", [device("10.0.0.2", 22), device("10.0.0.3")])
+    store.save_run("devices", [{"ip": "10.0.0.4"}], complete=False)
+    assert sorted(d["ip"] for d in store.latest_devices()) == ["10.0.0.2", "10.0.0.3", "10.0.0.4"]
+    store.save_run("discovery", [device("10.0.0.2", 22)])
+    assert [d["ip"] for d in store.latest_devices()] == ["10.0.0.2"]
+    states = [o["state"] for o in store.host_history("10.0.0.3")["observations"]]
+    assert states == ["down", "up"]
+
+
+def test_device_without_ports_keeps_known_ports(store):
+    store.save_run("ports", [device("10.0.0.2", 22)])
+    store.save_run("devices", [{"ip": "10.0.0.2", "mac": "aa:bb:cc:dd:ee:ff"}], complete=False)
+    assert [p["port"] for p in store.latest_devices()[0]["ports"]] == [22]
+
+
+def test_first_open_and_runs(store):
+    first = store.save_run("ports", [device("10.0.0.2", 22)], params={"ip": "10.0.0.2"})
+    store.save_run("ports", [device("10.0.0.2", 22)])
+    assert store.first_open("10.0.0.2", 22) is not None
+    assert store.first_open("10.0.0.2", 80) is None
+    runs = store.recent_runs()
+    assert [r["id"] for r in runs] == [first + 1, first] and json.loads(runs[1]["params"]) == {"ip": "10.0.0.2"}
+
+
+def test_meta_and_legacy_import(store, tmp_path):
+    assert store.is_empty() and store.get_meta("cursor", 0) == 0
+    store.set_meta("cursor", 3)
+    store.set_meta("cursor", 4)
+    assert store.get_meta("cursor") == 4
+    legacy = tmp_path / "scan_history.json"
+    legacy.write_text(json.dumps({"devices": [device("10.0.0.7", 8080)]}), encoding="utf-8")
+    assert store.import_json(str(legacy)) == 1
+    assert not store.is_empty()
+    assert store.latest_devices()[0]["ports"][0]["port"] == 8080
+
+
+def test_history_route(store, monkeypatch):
+    monkeypatch.setattr(app, "STORE", store)
+    store.save_run("ports", [device("10.0.0.2", 22)])
+    client = app.app.test_client()
+    assert client.get("/api/history/10.0.0.9").status_code == 404
+    history = client.get("/api/history/10.0.0.2?port=22").json
+    assert history["first_open"] and history["host"]["ip"] == "10.0.0.2"
+    assert client.get("/api/runs").json[0]["kind"] == "ports"
+
+
+def states(store):
+    return [tuple(row) for row in store._conn.execute("SELECT port, state FROM observations ORDER BY id")]
+
+
+def test_observations_only_record_state_changes(store):
+    store.save_run("ports", [device("10.0.0.2", 22, 80)])
+    store.save_run("ports", [device("10.0.0.2", 22, 80)])
+    store.save_run("ports", [device("10.0.0.2", 22)])
+    store.save_run("ports", [device("10.0.0.2", 22, 80)])
+    assert states(store) == [(None, "up"), (22, "open"), (80, "open"), (80, "closed"), (80, "open")]
+
+
+def test_restricted_scan_does_not_close_unscanned_ports(store):
+    store.save_run("ports", [device("10.0.0.2", 22, 80, 8080)])
+    store.save_run("ports", [device("10.0.0.2", 80)], complete=False, port_scope=app.parse_ports("80"))
+    assert [p["port"] for p in store.latest_devices()[0]["ports"]] == [22, 80, 8080]
+    store.save_run("ports", [device("10.0.0.2", 22, 80)], complete=False, port_scope=app.port_scope("1-10000"))
+    assert [p["port"] for p in store.latest_devices()[0]["ports"]] == [22, 80]
+    assert states(store)[-1] == (8080, "closed")
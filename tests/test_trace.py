@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+import inspect
+import threading
+import time
+
+import pytest
+
+import app
+
+
+def wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "等待超时"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def tracing(monkeypatch):
+    monkeypatch.setitem(app.TRACE, "enabled", True)
+    runs = app.deque(maxlen=app.TRACE["runs"])
+    monkeypatch.setattr(app, "TRACE_RUNS", runs)
+    return runs
+
+
+def test_disabled_tracing_returns_null_span(job):
+    assert job.trace is None
+    assert app.trace_span("anything", ip="10.0.0.2") is app.NULL_SPAN
+
+
+def test_job_records_nested_spans_across_threads(tracing):
+    manager = app.JobManager(workers=1, max_queue=2, history=10)
+
+    @app.traced("work", lambda n: {"n": n})
+    def work(n):
+        with app.trace_span("inner", ip="10.0.0.2"):
+            pass
+        def helper():
+            with app.trace_span("in_thread"):
+                pass
+
+        thread = threading.Thread(target=app.bind_job(helper), name="helper")
+        thread.start()
+        thread.join()
+        return n
+
+    job, _ = manager.submit("ports", work, 3)
+    wait_for(lambda: job.state == "done")
+    assert job.result == 3 and list(tracing) == [job.trace]
+    events = {event["name"]: event for event in job.trace.events}
+    assert set(events) == {f"ports #{job.id}", "work", "inner", "in_thread"}
+    assert events["work"]["args"] == {"n": 3} and events["inner"]["args"] == {"ip": "10.0.0.2"}
+    assert all(event["ph"] == "X" and event["pid"] == job.id for event in events.values())
+    # 外层区间包含内层区间
+    outer, inner = events[f"ports #{job.id}"], events["inner"]
+    assert outer["ts"] <= inner["ts"] and inner["ts"] + inner["dur"] <= outer["ts"] + outer["dur"]
+    assert "helper" in job.trace.threads.values()
+
+
+def test_span_records_exception(tracing, job):
+    job.trace = app.TraceRun(job)
+    with pytest.raises(ValueError):
+        with app.trace_span("failing"):
+            raise ValueError()
+    assert job.trace.events[-1]["args"] == {"error": "ValueError"}
+
+
+def test_events_are_bounded(monkeypatch, job):
+    monkeypatch.setitem(app.TRACE, "max_events", 3)
+    job.trace = app.TraceRun(job)
+    for index in range(5):
+        with app.trace_span("span", index=index):
+            pass
+    assert [event["args"]["index"] for event in job.trace.events] == [2, 3, 4]
+
+
+def test_trace_routes(tracing, job):
+    client = app.app.test_client()
+    assert client.post("/api/trace", json={"enabled": False}).json["enabled"] is False
+    assert client.post("/api/trace", json={"enabled": True}).json["enabled"] is True
+    job.trace = app.begin_trace(job)
+    with app.trace_span("shard", index=1):
+        pass
+    assert client.get("/api/trace").json["runs"] == [job.trace.summary()]
+    response = client.get(f"/api/trace/export?job={job.id}")
+    assert "attachment" in response.headers["Content-Disposition"]
+    events = response.json["traceEvents"]
+    assert events[0]["name"] == "process_name" and events[0]["pid"] == job.id
+    assert [event["name"] for event in events if event["ph"] == "X"] == ["shard"]
+    assert client.get("/api/trace/export?job=999999").status_code == 404
+
+
+def test_traced_keeps_function_metadata():
+    method = app.HomeNetworkScanner.scan_ports
+    assert method.__qualname__ == "HomeNetworkScanner.scan_ports" and method.__doc__
+    assert "ip" in inspect.signature(method).parameters
+    assert method.__wrapped__.__name__ == "scan_ports"
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+import array
+import base64
+import errno
+import json
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    pool = app.PortWorkerPool()
+    monkeypatch.setattr(app, "PORT_WORKERS", pool)
+    monkeypatch.setitem(app.PROCESS_ENGINE, "workers", 2)
+    monkeypatch.setitem(app.PROCESS_ENGINE, "min_ports", 1)
+    yield pool
+    for worker in pool._idle:
+        worker.kill()
+
+
+@pytest.fixture
+def listeners():
+    servers = []
+    for _ in range(3):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(("127.0.0.1", 0))
+        server.listen(16)
+        servers.append(server)
+    yield sorted(server.getsockname()[1] for server in servers)
+    for server in servers:
+        server.close()
+
+
+def closed_ports(count):
+    ports = []
+    for _ in range(count):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(("127.0.0.1", 0))
+        ports.append(sock.getsockname()[1])
+        sock.close()
+    return ports
+
+
+def test_worker_protocol():
+    """工作进程按行读取任务, 以定长记录返回结果, 端口 0 表示任务结束"""
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(("127.0.0.1", 0))
+    server.listen(4)
+    open_port, closed_port = server.getsockname()[1], closed_ports(1)[0]
+    proc = subprocess.Popen([sys.executable, app.__file__, "--port-worker"],
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    try:
+        ports = array.array("H", [open_port, closed_port])
+        task = {"ip": "127.0.0.1", "ports": base64.b64encode(ports.tobytes()).decode(), "timeout": 1,
+                "window": 4, "pps": 0}
+        proc.stdin.write(json.dumps(task).encode() + b"\n")
+        proc.stdin.flush()
+        records = []
+        while not records or records[-1][0] != 0:
+            records.append(app.PORT_WORKER_RECORD.unpack(proc.stdout.read(app.PORT_WORKER_RECORD.size)))
+        results = {port: err for port, err, _ in records[:-1]}
+        assert results == {open_port: 0, closed_port: errno.ECONNREFUSED}
+    finally:
+        proc.stdin.close()
+        assert proc.wait(timeout=10) == 0
+        server.close()
+
+
+def test_process_engine_finds_open_ports(pool, listeners, job):
+    scanner = app.HomeNetworkScanner()
+    ports = closed_ports(20) + listeners
+    found, progress = [], []
+    result = scanner.scan_ports("127.0.0.1", ports=ports, engine="process", found_callback=found.append,
+                                progress_callback=lambda done, total: progress.append((done, total)))
+    assert sorted(p["port"] for p in result) == listeners
+    assert sorted(p["port"] for p in found) == listeners
+    assert progress[-1] == (len(ports), len(ports))
+    assert scanner.rtt.stats("127.0.0.1")["samples"] > 0
+    # 工作进程放回池中复用
+    assert pool.count() == 2 and len(pool._idle) == 2
+    idle = list(pool._idle)
+    scanner.scan_ports("127.0.0.1", ports=ports, engine="process")
+    assert sorted(pool._idle, key=id) == sorted(idle, key=id)
+
+
+def test_concurrent_hosts_share_pool(pool, job):
+    taken = pool.acquire(2)
+    assert len(taken) == 2
+    waiting = []
+    thread = threading.Thread(target=app.bind_job(lambda: waiting.append(pool.acquire(2))))
+    thread.start()
+    time.sleep(0.2)
+    # 进程都在使用中时等待归还
+    assert waiting == [] and pool.count() == 2
+    pool.release(taken)
+    thread.join(5)
+    # 只剩一个扫描在用, 分到全部进程
+    assert len(waiting[0]) == 2
+    pool.release(waiting[0])
+
+
+def test_broken_workers_are_killed(pool, job):
+    workers = pool.acquire(2)
+    pool.release(workers, broken=workers[:1])
+    assert not workers[0].alive() and pool.count() == 1
+    assert pool._idle == workers[1:]
+
+
+def test_cancel_stops_workers(pool, job):
+    scanner = app.HomeNetworkScanner()
+    results = []
+
+    def on_result(port, err):
+        results.append(port)
+        if len(results) == 10:
+            job.cancel()
+
+    started = time.monotonic()
+    with pytest.raises(app.ScanCancelled):
+        scanner._scan_ports_process("127.0.0.1", list(range(1, 65536)), lambda: 1,
+                                    app.RateController("test", maximum=2, initial=2), on_result)
+    assert time.monotonic() - started < 10 and len(results) < 65535
+    # 取消时进程可能还在扫描, 不放回池中
+    assert pool.count() == len(pool._idle)